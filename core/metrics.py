@@ -0,0 +1,156 @@
+""" what each request spends in SQL, the view, the serializers and rendering.
+
+RequestMetricsMiddleware times every request, sends the timings back in a Server-Timing header
+(settings.METRICS_SERVER_TIMING, by default only with DEBUG) and adds them to per route prometheus
+histograms, served in the text format by core.views.metrics at /metrics. Routes are labelled with
+their url name, so the number of series stays the same whatever paths are requested. With several worker processes set
+PROMETHEUS_MULTIPROC_DIR and every scrape merges the numbers of all of them """
+import os
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+from prometheus_client import CollectorRegistry, Counter, Histogram, multiprocess
+from rest_framework.serializers import BaseSerializer
+
+LABELS = ['method', 'route']
+INF = float('inf')
+
+registry = CollectorRegistry()
+REQUESTS = Counter('http_requests', 'Requests answered', [*LABELS, 'status'], registry=registry)
+DURATION = Histogram('http_request_duration_seconds', 'Time from the first middleware to the response',
+                     LABELS, registry=registry)
+VIEW_DURATION = Histogram('http_request_view_duration_seconds', 'Time in the view, before the response is rendered',
+                          LABELS, registry=registry)
+SERIALIZER_DURATION = Histogram('http_request_serializer_duration_seconds',
+                                'Time in serializer.data, the queries it runs included', LABELS, registry=registry)
+SQL_DURATION = Histogram('http_request_sql_duration_seconds', 'Time in SQL queries', LABELS, registry=registry)
+SQL_QUERIES = Histogram('http_request_sql_queries', 'SQL queries per request', LABELS, registry=registry,
+                        buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, INF))
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Size of the response body', LABELS, registry=registry,
+                          buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, INF))
+
+current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """ the counters of one request, times in seconds """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.serializer = 0.0
+        self.serializing = False
+        self.view_started = self.view_finished = None
+
+    def record_query(self, execute, sql, params, many, context):
+        """ an execute_wrapper of the database connections """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - start
+            self.queries += 1
+
+
+def timed_data(data):
+    """ serializer.data that adds its time to the request, a serializer read inside another counts once """
+
+    def get_data(serializer):
+        metrics = current.get()
+        if metrics is None or metrics.serializing:
+            return data(serializer)
+        metrics.serializing = True
+        start = time.perf_counter()
+        try:
+            return data(serializer)
+        finally:
+            metrics.serializer += time.perf_counter() - start
+            metrics.serializing = False
+
+    get_data.timed = True
+    return get_data
+
+
+def instrument_serializers():
+    """ called once from CoreConfig.ready, Serializer.data and ListSerializer.data both go through
+    BaseSerializer.data """
+    if not getattr(BaseSerializer.data.fget, 'timed', False):
+        BaseSerializer.data = property(timed_data(BaseSerializer.data.fget))
+
+
+def collecting_registry():
+    """ the registry a scrape reads, merged from the files of every process in multiprocess mode """
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return registry
+    merged = CollectorRegistry()
+    multiprocess.MultiProcessCollector(merged)
+    return merged
+
+
+def server_timing(timings, queries):
+    """ the Server-Timing header value, durations in milliseconds """
+    entries = []
+    for name, seconds in timings.items():
+        entry = f'{name};dur={seconds * 1000:.2f}'
+        if name == 'sql':
+            entry += f';desc="{queries} queries"'
+        entries.append(entry)
+    return ', '.join(entries)
+
+
+class RequestMetricsMiddleware:
+    """ goes first in MIDDLEWARE, so the total covers the whole stack """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        finished = time.perf_counter()
+
+        view = 0.0
+        if metrics.view_started is not None:
+            view = (metrics.view_finished or finished) - metrics.view_started
+        timings = {'sql': metrics.sql, 'serializer': metrics.serializer, 'view': view}
+        if metrics.view_finished is not None:
+            timings['render'] = finished - metrics.view_finished
+        timings['total'] = finished - start
+
+        match = getattr(request, 'resolver_match', None)
+        labels = (request.method, match.view_name if match else 'unmatched')
+        REQUESTS.labels(*labels, response.status_code).inc()
+        DURATION.labels(*labels).observe(timings['total'])
+        VIEW_DURATION.labels(*labels).observe(view)
+        SERIALIZER_DURATION.labels(*labels).observe(metrics.serializer)
+        SQL_DURATION.labels(*labels).observe(metrics.sql)
+        SQL_QUERIES.labels(*labels).observe(metrics.queries)
+        if not response.streaming:
+            RESPONSE_SIZE.labels(*labels).observe(len(response.content))
+
+        server_timing_header = getattr(settings, 'METRICS_SERVER_TIMING', None)
+        if settings.DEBUG if server_timing_header is None else server_timing_header:
+            response['Server-Timing'] = server_timing(timings, metrics.queries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current.get()
+        if metrics is not None:
+            metrics.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # drf responses are rendered after the view returns
+        metrics = current.get()
+        if metrics is not None:
+            metrics.view_finished = time.perf_counter()
+        return response
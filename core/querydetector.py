@@ -0,0 +1,161 @@
+""" finds N+1 queries: the same statement run again and again with other parameters, usually by a
+serializer reaching for a relation nobody prefetched.
+
+QueryDetector fingerprints every statement run while it is active, with the literals and IN lists
+taken out, and reports the shapes run more than settings.QUERY_DETECTOR_THRESHOLD times together
+with the serializer field and the line of project code that ran them. QueryDetectorMiddleware
+checks every request when settings.QUERY_DETECTOR_MODE is set to 'warn', 'log' or 'raise', the
+tests raise, so a new N+1 fails them. Around other code (a task, a command, part of a test)::
+
+    with QueryDetector() as detector:
+        ...
+    detector.report('import')
+"""
+import functools
+import logging
+import re
+import sys
+import warnings
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connections
+from rest_framework.serializers import Serializer
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+MODES = ('warn', 'log', 'raise')
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST = re.compile(r'\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)', re.IGNORECASE)
+VALUES_LIST = re.compile(r'(\((?:%s|\?)(?:, (?:%s|\?))*\))(?:, \1)+')
+SPACE = re.compile(r'\s+')
+IGNORED = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class RepeatedQueriesWarning(UserWarning):
+    pass
+
+
+class RepeatedQueriesError(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """ the shape of a statement, the same for every value it was run with """
+    sql = SPACE.sub(' ', sql.strip())
+    sql = NUMBER.sub('?', STRING.sub('?', sql))
+    return VALUES_LIST.sub(r'\1, ...', IN_LIST.sub('IN (...)', sql))
+
+
+# the wrappers around queries and serializers are never the culprit
+INSTRUMENTATION = {__file__, metrics.__file__}
+
+
+def is_project_file(filename):
+    return filename.startswith(str(settings.BASE_DIR)) and 'site-packages' not in filename \
+        and filename not in INSTRUMENTATION
+
+
+def trigger():
+    """ the serializer field being rendered and the innermost line of project code, found on the stack """
+    field = location = None
+    frame = sys._getframe(2)
+    while frame is not None and (field is None or location is None):
+        code = frame.f_code
+        if field is None and code is Serializer.to_representation.__code__ and 'field' in frame.f_locals:
+            field = f'{type(frame.f_locals["self"]).__name__}.{frame.f_locals["field"].field_name}'
+        if location is None and is_project_file(code.co_filename):
+            location = f'{code.co_filename[len(str(settings.BASE_DIR)) + 1:]}:{frame.f_lineno} in {code.co_name}'
+        frame = frame.f_back
+    return field, location
+
+
+class Shape:
+    """ the statements of one fingerprint """
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.params = set()
+        self.field = self.location = None
+
+    @property
+    def kind(self):
+        # the same values every time is a duplicate, caching would do. Other values is an N+1
+        return 'duplicate' if len(self.params) == 1 else 'N+1'
+
+    def __str__(self):
+        where = ' '.join(part for part in (self.field and f'from {self.field}',
+                                           self.location and f'at {self.location}') if part)
+        return f'{self.count} {self.kind} queries {where}: {fingerprint(self.sql)}'
+
+
+class QueryDetector:
+    """ counts the statements run on every connection by shape while it is active """
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold if threshold is not None else getattr(settings, 'QUERY_DETECTOR_THRESHOLD', 5)
+        self.shapes = {}
+        self.stack = None
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if sql.startswith(IGNORED):
+            return result
+        key = fingerprint(sql)
+        shape = self.shapes.get(key)
+        if shape is None:
+            shape = self.shapes[key] = Shape(sql)
+        shape.count += 1
+        shape.params.add(repr(params))
+        # the stack is only walked for statements that repeat
+        if shape.count == 2:
+            shape.field, shape.location = trigger()
+        return result
+
+    def repeated(self):
+        return [shape for shape in self.shapes.values() if shape.count > self.threshold]
+
+    def report(self, where, mode=None):
+        """ warns, logs or raises about the repeated shapes, as settings.QUERY_DETECTOR_MODE says """
+        mode = mode or getattr(settings, 'QUERY_DETECTOR_MODE', None) or 'warn'
+        repeated = self.repeated()
+        if not repeated:
+            return
+        message = f'repeated queries in {where}:\n' + '\n'.join(f'  {shape}' for shape in repeated)
+        if mode == 'raise':
+            raise RepeatedQueriesError(message)
+        if mode == 'log':
+            logger.warning(message)
+        else:
+            warnings.warn(message, RepeatedQueriesWarning)
+
+
+class QueryDetectorMiddleware:
+    """ checks the queries of every request, left out of the stack unless QUERY_DETECTOR_MODE is set """
+
+    def __init__(self, get_response):
+        mode = getattr(settings, 'QUERY_DETECTOR_MODE', None)
+        if mode is None:
+            raise MiddlewareNotUsed
+        if mode not in MODES:
+            raise ImproperlyConfigured(f'QUERY_DETECTOR_MODE must be one of {MODES}, not {mode!r}')
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryDetector() as detector:
+            response = self.get_response(request)
+        detector.report(f'{request.method} {request.path}')
+        return response
@@ -1,7 +1,9 @@
 from django.urls import path
 from django.views.generic import TemplateView
+from . import views
 
 
 urlpatterns = [
-    path('', TemplateView.as_view(template_name='core/index.html'))
-]
\ No newline at end of file
+    path('', TemplateView.as_view(template_name='core/index.html')),
+    path('metrics', views.metrics, name='metrics')
+]
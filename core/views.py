@@ -1,3 +1,19 @@
-from django.shortcuts import render
+import hmac
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from .metrics import collecting_registry
 
-# Create your views here.
+
+def metrics(request):
+    """ the request histograms in the prometheus text format, for a bearer METRICS_TOKEN or a staff
+    user. Without a token they are open with DEBUG only """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        allowed = True
+    else:
+        user = getattr(request, 'user', None)
+        allowed = bool(user and user.is_staff) or (not token and settings.DEBUG)
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(collecting_registry()), content_type=CONTENT_TYPE_LATEST)
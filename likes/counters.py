@@ -0,0 +1,321 @@
+""" like counts and "liked by me" without a database write per like.
+
+With settings.LIKES_STORE naming a LikeStore class, likes are kept in the store as a set of the
+liked object ids per user and a like counter per object, both seeded from likes_likeditem the first
+time they are needed. Every like and unlike marks its (content type, user, object) as changed, and
+the periodic flush_likes task writes the changed ones to the database in batches, so a burst of
+likes on a popular product costs the database one insert per batch instead of one per click.
+Without a store the likes are written to and counted in the database directly.
+
+Objects are given as the model and object ids, users by their id """
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+from .models import LikedItem
+
+
+class LikeStore:
+    """ the interface of a like store, content_type_id, user_id and object ids are ints """
+
+    def has_user(self, content_type_id, user_id):
+        raise NotImplementedError
+
+    def load_user(self, content_type_id, user_id, object_ids):
+        """ seeds the ids of the objects a user likes from the database, unless the store holds them """
+        raise NotImplementedError
+
+    def liked(self, content_type_id, user_id, object_ids):
+        """ returns the set of object_ids the user likes """
+        raise NotImplementedError
+
+    def counts(self, content_type_id, object_ids):
+        """ returns {object_id: count} for the objects whose count the store holds """
+        raise NotImplementedError
+
+    def load_counts(self, content_type_id, counts):
+        """ seeds {object_id: count} from the database, leaving the counts the store holds alone """
+        raise NotImplementedError
+
+    def like(self, content_type_id, user_id, object_id):
+        """ returns whether the like is new, only a new like is counted """
+        raise NotImplementedError
+
+    def unlike(self, content_type_id, user_id, object_id):
+        """ returns whether there was a like to take back """
+        raise NotImplementedError
+
+    def pop_dirty(self, count):
+        """ takes up to count (content_type_id, user_id, object_id) changed since they were last flushed """
+        raise NotImplementedError
+
+    def mark_dirty(self, changes):
+        """ puts changes taken by pop_dirty back for the next flush, after their flush failed """
+        raise NotImplementedError
+
+
+class RedisLikeStore(LikeStore):
+    """ keeps each user's likes as a set that expires after a day without use, the counts of a
+    content type in one hash, plus a set of the likes waiting for a flush """
+    prefix = 'likes'
+    # an always present member so users who like nothing are still held
+    marker = '_'
+    ttl = 60 * 60 * 24
+
+    def __init__(self, client=None):
+        if client is None:
+            from django_redis import get_redis_connection
+            client = get_redis_connection('default')
+        self.client = client
+
+    def user_key(self, content_type_id, user_id):
+        return f'{self.prefix}:{content_type_id}:user:{user_id}'
+
+    def counts_key(self, content_type_id):
+        return f'{self.prefix}:{content_type_id}:counts'
+
+    @property
+    def dirty_key(self):
+        return f'{self.prefix}:dirty'
+
+    def has_user(self, content_type_id, user_id):
+        return bool(self.client.exists(self.user_key(content_type_id, user_id)))
+
+    def load_user(self, content_type_id, user_id, object_ids):
+        key = self.user_key(content_type_id, user_id)
+        if self.client.sadd(key, self.marker):
+            pipe = self.client.pipeline()
+            if object_ids:
+                pipe.sadd(key, *object_ids)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def liked(self, content_type_id, user_id, object_ids):
+        pipe = self.client.pipeline()
+        for object_id in object_ids:
+            pipe.sismember(self.user_key(content_type_id, user_id), object_id)
+        pipe.expire(self.user_key(content_type_id, user_id), self.ttl)
+        return {object_id for object_id, liked in zip(object_ids, pipe.execute()) if liked}
+
+    def counts(self, content_type_id, object_ids):
+        if not object_ids:
+            return {}
+        values = self.client.hmget(self.counts_key(content_type_id), list(object_ids))
+        return {object_id: max(int(value), 0) for object_id, value in zip(object_ids, values) if value is not None}
+
+    def load_counts(self, content_type_id, counts):
+        pipe = self.client.pipeline()
+        for object_id, count in counts.items():
+            pipe.hsetnx(self.counts_key(content_type_id), object_id, count)
+        pipe.execute()
+
+    def changed(self, content_type_id, user_id, object_id, amount):
+        pipe = self.client.pipeline()
+        pipe.hincrby(self.counts_key(content_type_id), object_id, amount)
+        pipe.expire(self.user_key(content_type_id, user_id), self.ttl)
+        pipe.sadd(self.dirty_key, f'{content_type_id}:{user_id}:{object_id}')
+        pipe.execute()
+
+    def like(self, content_type_id, user_id, object_id):
+        # the set decides, so of two concurrent likes only one is counted
+        if not self.client.sadd(self.user_key(content_type_id, user_id), object_id):
+            return False
+        self.changed(content_type_id, user_id, object_id, 1)
+        return True
+
+    def unlike(self, content_type_id, user_id, object_id):
+        if not self.client.srem(self.user_key(content_type_id, user_id), object_id):
+            return False
+        self.changed(content_type_id, user_id, object_id, -1)
+        return True
+
+    def pop_dirty(self, count):
+        return [tuple(int(part) for part in member.split(b':'))
+                for member in self.client.spop(self.dirty_key, count) or []]
+
+    def mark_dirty(self, changes):
+        if changes:
+            self.client.sadd(self.dirty_key, *(':'.join(map(str, change)) for change in changes))
+
+
+class InMemoryLikeStore(LikeStore):
+    """ a process local store with the same behaviour as RedisLikeStore, for tests and development """
+
+    def __init__(self):
+        self.users = {}
+        self.like_counts = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def has_user(self, content_type_id, user_id):
+        return (content_type_id, user_id) in self.users
+
+    def load_user(self, content_type_id, user_id, object_ids):
+        with self.lock:
+            self.users.setdefault((content_type_id, user_id), set(object_ids))
+
+    def liked(self, content_type_id, user_id, object_ids):
+        return set(object_ids) & self.users.get((content_type_id, user_id), set())
+
+    def counts(self, content_type_id, object_ids):
+        return {object_id: max(self.like_counts[content_type_id, object_id], 0) for object_id in object_ids
+                if (content_type_id, object_id) in self.like_counts}
+
+    def load_counts(self, content_type_id, counts):
+        with self.lock:
+            for object_id, count in counts.items():
+                self.like_counts.setdefault((content_type_id, object_id), count)
+
+    def change(self, content_type_id, user_id, object_id, liked):
+        with self.lock:
+            user = self.users.setdefault((content_type_id, user_id), set())
+            if (object_id in user) == liked:
+                return False
+            if liked:
+                user.add(object_id)
+            else:
+                user.discard(object_id)
+            key = (content_type_id, object_id)
+            self.like_counts[key] = self.like_counts.get(key, 0) + (1 if liked else -1)
+            self.dirty.add((content_type_id, user_id, object_id))
+            return True
+
+    def like(self, content_type_id, user_id, object_id):
+        return self.change(content_type_id, user_id, object_id, True)
+
+    def unlike(self, content_type_id, user_id, object_id):
+        return self.change(content_type_id, user_id, object_id, False)
+
+    def pop_dirty(self, count):
+        with self.lock:
+            changes = [self.dirty.pop() for _ in range(min(count, len(self.dirty)))]
+        return changes
+
+    def mark_dirty(self, changes):
+        with self.lock:
+            self.dirty.update(changes)
+
+
+_store = None
+
+
+def get_like_store():
+    """ returns the configured like store, or None when likes live in the database """
+    global _store
+    path = getattr(settings, 'LIKES_STORE', None)
+    if path is None:
+        return None
+    if _store is None:
+        _store = import_string(path)()
+    return _store
+
+
+def reset_like_store():
+    global _store
+    _store = None
+
+
+def content_type_id(model):
+    # the content types are cached by their manager, only the first lookup queries
+    return ContentType.objects.get_for_model(model).id
+
+
+def database_counts(content_type_id, object_ids):
+    counts = dict(LikedItem.objects.filter(content_type_id=content_type_id, object_id__in=object_ids)
+                  .order_by().values('object_id').annotate(count=Count('id')).values_list('object_id', 'count'))
+    return {object_id: counts.get(object_id, 0) for object_id in object_ids}
+
+
+def existing_counts(model, content_type_id, object_ids):
+    """ {object_id: count} of the objects that exist, the store never holds counts of made up ids """
+    likes = LikedItem.objects.filter(content_type_id=content_type_id, object_id=OuterRef('pk')) \
+        .order_by().values('object_id').annotate(count=Count('id')).values('count')
+    return dict(model.objects.filter(pk__in=object_ids).annotate(likes=Coalesce(Subquery(likes), 0))
+                .values_list('pk', 'likes'))
+
+
+def load_user(store, content_type_id, user_id):
+    if not store.has_user(content_type_id, user_id):
+        store.load_user(content_type_id, user_id, list(LikedItem.objects.filter(
+            content_type_id=content_type_id, user_id=user_id).values_list('object_id', flat=True)))
+
+
+def like_counts(model, object_ids):
+    """ returns {object_id: count} for every one of object_ids, 0 for objects that don't exist """
+    content_type = content_type_id(model)
+    store = get_like_store()
+    if store is None:
+        return database_counts(content_type, object_ids)
+    counts = store.counts(content_type, object_ids)
+    missing = [object_id for object_id in object_ids if object_id not in counts]
+    if missing:
+        loaded = existing_counts(model, content_type, missing)
+        store.load_counts(content_type, loaded)
+        counts.update(store.counts(content_type, list(loaded)))
+    return {object_id: counts.get(object_id, 0) for object_id in object_ids}
+
+
+def liked_by(model, user_id, object_ids):
+    """ returns the set of object_ids the user likes """
+    content_type = content_type_id(model)
+    store = get_like_store()
+    if store is None:
+        return set(LikedItem.objects.filter(content_type_id=content_type, user_id=user_id, object_id__in=object_ids)
+                   .values_list('object_id', flat=True))
+    load_user(store, content_type, user_id)
+    return store.liked(content_type, user_id, object_ids)
+
+
+def set_liked(model, user_id, object_id, liked):
+    """ likes or unlikes an object for the user, doing nothing when it already is, and returns the
+    object's like count """
+    content_type = content_type_id(model)
+    store = get_like_store()
+    if store is None:
+        if liked:
+            LikedItem.objects.bulk_create([LikedItem(content_type_id=content_type, user_id=user_id,
+                                                     object_id=object_id)], ignore_conflicts=True)
+        else:
+            LikedItem.objects.filter(content_type_id=content_type, user_id=user_id, object_id=object_id).delete()
+        return database_counts(content_type, [object_id])[object_id]
+    # the count is seeded before it changes, or the change would be counted on top of nothing
+    load_user(store, content_type, user_id)
+    like_counts(model, [object_id])
+    if liked:
+        store.like(content_type, user_id, object_id)
+    else:
+        store.unlike(content_type, user_id, object_id)
+    return like_counts(model, [object_id])[object_id]
+
+
+def flush_likes(store, changes):
+    """ writes changed likes as the store holds them now, in one transaction. A user no longer
+    held by the store is skipped, the database keeps their last flushed likes """
+    by_user = defaultdict(list)
+    for content_type, user_id, object_id in changes:
+        by_user[content_type, user_id].append(object_id)
+    # users deleted since they liked would fail the whole batch on their foreign key
+    users = set(get_user_model().objects.filter(id__in={user_id for _, user_id in by_user})
+                .values_list('id', flat=True))
+    liked, unliked = [], Q()
+    flushed = 0
+    for (content_type, user_id), object_ids in by_user.items():
+        if user_id not in users or not store.has_user(content_type, user_id):
+            continue
+        likes = store.liked(content_type, user_id, object_ids)
+        liked += [LikedItem(content_type_id=content_type, user_id=user_id, object_id=object_id)
+                  for object_id in object_ids if object_id in likes]
+        if len(likes) < len(object_ids):
+            unliked |= Q(content_type_id=content_type, user_id=user_id,
+                         object_id__in=[object_id for object_id in object_ids if object_id not in likes])
+        flushed += len(object_ids)
+    with transaction.atomic():
+        LikedItem.objects.bulk_create(liked, ignore_conflicts=True)
+        if unliked:
+            LikedItem.objects.filter(unliked).delete()
+    return flushed
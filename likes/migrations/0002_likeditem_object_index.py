@@ -0,0 +1,36 @@
+# Generated by Django 4.0.5 on 2026-10-18 20:47
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def delete_duplicates(apps, schema_editor):
+    """ keeps the first like of each user and object, the unique constraint needs them gone """
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    earlier = LikedItem.objects.filter(user_id=OuterRef('user_id'), content_type_id=OuterRef('content_type_id'),
+                                       object_id=OuterRef('object_id'), id__lt=OuterRef('id'))
+    LikedItem.objects.filter(Exists(earlier)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('likes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='likeditem',
+            name='object_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='likeditem',
+            index=models.Index(fields=['content_type', 'object_id'], name='likes_liked_content_7292dd_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='likeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'content_type', 'object_id'), name='likes_likeditem_unique_user_object'),
+        ),
+    ]
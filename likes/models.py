@@ -6,5 +6,11 @@ from django.conf import settings
 class LikedItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
-    object_id = models.PositiveSmallIntegerField()
-    content_object = GenericForeignKey()
\ No newline at end of file
+    object_id = models.PositiveBigIntegerField()
+    content_object = GenericForeignKey()
+
+    class Meta:
+        # the likes of an object are counted with the index, a user likes an object once
+        indexes = [models.Index(fields=['content_type', 'object_id'])]
+        constraints = [models.UniqueConstraint(fields=['user', 'content_type', 'object_id'],
+                                               name='likes_likeditem_unique_user_object')]
@@ -0,0 +1,9 @@
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from .counters import reset_like_store
+
+
+@receiver(setting_changed)
+def like_store_changed(sender, setting, **kwargs):
+    if setting == 'LIKES_STORE':
+        reset_like_store()
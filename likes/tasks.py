@@ -0,0 +1,24 @@
+from celery import shared_task
+from .counters import flush_likes as flush, get_like_store
+
+
+@shared_task
+def flush_likes(batch_size=500):
+    """ writes the likes changed in the like store since the last run to the database. A no-op when
+    likes live in the database. A batch that fails is put back for the next run """
+    store = get_like_store()
+    if store is None:
+        return 0
+    flushed = 0
+    while True:
+        changes = store.pop_dirty(batch_size)
+        if changes:
+            try:
+                flushed += flush(store, changes)
+            except Exception:
+                # the store still holds the likes, they are written by the next run
+                store.mark_dirty(changes)
+                raise
+        if len(changes) < batch_size:
+            break
+    return flushed
@@ -1,20 +1,11 @@
 from django.contrib import admin
 from . import models
-from django.db.models.aggregates import Count
 
 
 @admin.register(models.Collection)
 class CollectionAdmin(admin.ModelAdmin):
     list_display = ['title', 'products_count']
 
-    @admin.display(ordering='products_count')
-    def products_count(self, collection):
-        return collection.products_count
-
-    def get_queryset(self, request):
-        return super().get_queryset(request) \
-            .annotate(products_count=Count('product')).all()
-
 
 @admin.register(models.Product)
 class ProductAdmin(admin.ModelAdmin):
@@ -49,8 +40,9 @@ class CustomerAdmin(admin.ModelAdmin):
 
 @admin.register(models.Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['placed_at', 'payment_status', 'customer']
+    list_display = ['placed_at', 'payment_status', 'customer', 'total_amount', 'item_count']
     list_per_page = 10
+    list_select_related = ['customer__user']
 
 
 @admin.register(models.Cart)
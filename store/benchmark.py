@@ -0,0 +1,291 @@
+""" a load test of the store api, run by the benchmark management command.
+
+Traffic is replayed as sessions, the short lists of requests one visitor makes (SCENARIOS), picked by
+the weights of a MIX, or read from a JSONL trace with one request per line::
+
+    {"method": "POST", "path": "/store/carts/", "save": {"cart": "id"}}
+    {"method": "POST", "path": "/store/carts/{cart}/items/", "body": {"product_id": 1, "quantity": 2}}
+
+`save` keeps values of the response for the requests after it, which refer to them as {name} in
+their path or body, and `user` ("customer" or "staff") makes the request authenticated. Requests
+go through the django handler in this process, where the queries of each one are counted, or over
+http to a running server, which reports them in its Server-Timing header. Every request is timed and the timings are summarized per endpoint """
+import itertools
+import json
+import math
+import re
+import time
+from urllib.parse import urlsplit
+import requests
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import Collection, Product
+from .pagination import DefaultPagination
+
+# the share of the sessions each scenario gets in a mix
+MIXES = {
+    'mixed': {'browse': 60, 'search': 20, 'cart': 15, 'checkout': 5},
+    'browse': {'browse': 1},
+    'search': {'search': 1},
+    'cart': {'cart': 1},
+    'checkout': {'checkout': 1},
+}
+SQL_TIMING = re.compile(r'\bsql;dur=(?P<duration>[\d.]+);desc="(?P<queries>\d+) queries"')
+USERS = {'customer': 'benchmark-customer', 'staff': 'benchmark-staff'}
+
+
+def request(method, path, body=None, user=None, save=None):
+    return {key: value for key, value in
+            {'method': method, 'path': path, 'body': body, 'user': user, 'save': save}.items()
+            if value is not None}
+
+
+def pick(rng, values, k):
+    """ k different values, when there are that many """
+    return rng.sample(values, k) if len(values) >= k else rng.choices(values, k=k)
+
+
+def browse(rng, catalog):
+    product = rng.choice(catalog.products)
+    return [
+        request('GET', '/store/collections/'),
+        request('GET', f'/store/products/?collection_id={rng.choice(catalog.collections)}'),
+        request('GET', f'/store/products/?page={rng.randint(1, min(5, catalog.pages))}'),
+        request('GET', f'/store/products/{product}/'),
+        request('GET', f'/store/products/{product}/images/'),
+        request('GET', f'/store/products/{product}/reviews/'),
+    ]
+
+
+def search(rng, catalog):
+    word, other = pick(rng, catalog.words, 2)
+    return [
+        request('GET', f'/store/products/?search={word}'),
+        request('GET', f'/store/products/?search={word}+{other}&ordering=unit_price'),
+        request('GET', f'/store/products/{rng.choice(catalog.products)}/'),
+    ]
+
+
+def cart(rng, catalog):
+    products = pick(rng, catalog.products, 3)
+    return [
+        request('POST', '/store/carts/', save={'cart': 'id'}),
+        *(request('POST', '/store/carts/{cart}/items/', {'product_id': product, 'quantity': rng.randint(1, 3)},
+                  save={'item': 'id'})
+          for product in products),
+        request('GET', '/store/carts/{cart}/'),
+        request('PATCH', '/store/carts/{cart}/items/{item}/', {'quantity': rng.randint(1, 5)}),
+        request('GET', '/store/carts/{cart}/summary/'),
+        request('DELETE', '/store/carts/{cart}/items/{item}/'),
+        request('DELETE', '/store/carts/{cart}/'),
+    ]
+
+
+def checkout(rng, catalog):
+    items = [{'product_id': product, 'quantity': 1} for product in pick(rng, catalog.products, 2)]
+    return [
+        request('POST', '/store/carts/', save={'cart': 'id'}),
+        request('POST', '/store/carts/{cart}/items/batch/', {'items': items}),
+        request('GET', '/store/carts/{cart}/summary/'),
+        request('GET', '/store/customers/me/', user='customer'),
+        request('POST', '/store/orders/', {'cart_id': '{cart}'}, user='customer'),
+        request('GET', '/store/orders/', user='customer'),
+    ]
+
+
+SCENARIOS = {'browse': browse, 'search': search, 'cart': cart, 'checkout': checkout}
+
+
+class Catalog:
+    """ the products, collections and title words the scenarios pick from """
+
+    def __init__(self, rng, size=1000):
+        ids = list(Product.objects.filter(inventory__gt=0).order_by('id').values_list('id', flat=True))
+        if not ids:
+            raise ValueError('there are no products in stock, run generate_dataset first')
+        self.products = sorted(rng.sample(ids, min(size, len(ids))))
+        self.pages = math.ceil(Product.objects.count() / DefaultPagination.page_size)
+        self.collections = list(Collection.objects.order_by('id').values_list('id', flat=True))
+        titles = Product.objects.filter(pk__in=self.products).order_by('id').values_list('title', flat=True)
+        self.words = sorted({word for title in titles for word in title.lower().split() if word.isalpha()}) \
+            or ['tea']
+
+
+def mix_sessions(rng, mix):
+    """ an endless run of sessions, the same one for the same seed and data """
+    catalog = Catalog(rng)
+    names, weights = zip(*MIXES[mix].items())
+    while True:
+        (name,) = rng.choices(names, weights)
+        yield SCENARIOS[name](rng, catalog)
+
+
+def trace_sessions(path, repeat=False):
+    """ the trace as one session, replayed again and again with repeat """
+    with open(path, encoding='utf-8') as file:
+        session = [json.loads(line) for line in file if line.strip()]
+    return itertools.repeat(session) if repeat else iter([session])
+
+
+def user_tokens():
+    """ access tokens of the users the authenticated requests are made as """
+    tokens = {}
+    for role, username in USERS.items():
+        user, created = get_user_model().objects.get_or_create(
+            username=username, defaults={'email': f'{username}@example.com', 'is_staff': role == 'staff'})
+        tokens[role] = str(AccessToken.for_user(user))
+    return tokens
+
+
+def fill(value, saved):
+    """ the {name} placeholders of a path or body replaced with the saved values """
+    if isinstance(value, str):
+        return value.format_map(saved)
+    if isinstance(value, dict):
+        return {key: fill(item, saved) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill(item, saved) for item in value]
+    return value
+
+
+def endpoint(method, path):
+    """ the method and url name of a request, so every product detail lands in one bucket """
+    try:
+        return f'{method} {resolve(urlsplit(path).path).view_name}'
+    except Resolver404:
+        return f'{method} {urlsplit(path).path}'
+
+
+def parse_json(content):
+    try:
+        return json.loads(content)
+    except ValueError:
+        return None
+
+
+class LocalClient:
+    """ requests through the django test client in this process, with their queries counted """
+
+    def __init__(self):
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method, path, body, token):
+        headers = {'HTTP_AUTHORIZATION': f'JWT {token}'} if token else {}
+        data = '' if body is None else json.dumps(body)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = self.client.generic(method, path, data, 'application/json', **headers)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            elapsed = time.perf_counter() - start
+        sql = sum(float(query['time']) for query in queries.captured_queries)
+        return response.status_code, parse_json(content), elapsed, len(queries), sql
+
+
+class HttpClient:
+    """ requests over http to a server at a base url, with the queries it reports in Server-Timing
+    (core.metrics) """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, body, token):
+        headers = {'Authorization': f'JWT {token}'} if token else {}
+        start = time.perf_counter()
+        response = self.session.request(method, self.url + path, json=body, headers=headers)
+        elapsed = time.perf_counter() - start
+        queries, sql = sql_timing(response.headers.get('Server-Timing', ''))
+        return response.status_code, parse_json(response.content), elapsed, queries, sql
+
+
+def sql_timing(header):
+    """ the queries and seconds of the sql entry of a Server-Timing header """
+    match = SQL_TIMING.search(header)
+    if match is None:
+        return None, None
+    return int(match['queries']), float(match['duration']) / 1000
+
+
+def run(client, sessions, tokens, count=None, warmup=0, record=None):
+    """ sends the requests of the sessions until `count` of them are timed, after `warmup` untimed
+    ones. Returns the samples as (endpoint, status, seconds, queries, sql seconds) and the wall time
+    of the timed requests. A session stops early when a value it needs was never saved """
+    samples = []
+    sent = 0
+    start = time.perf_counter()
+    for session in sessions:
+        saved = {}
+        for line in session:
+            if count is not None and len(samples) >= count:
+                return samples, time.perf_counter() - start
+            if record is not None:
+                record.write(json.dumps(line) + '\n')
+            try:
+                path, body = fill(line['path'], saved), fill(line.get('body'), saved)
+            except KeyError:
+                break
+            method = line.get('method', 'GET').upper()
+            status, data, elapsed, queries, sql = client.request(method, path, body, tokens.get(line.get('user')))
+            for name, key in line.get('save', {}).items():
+                if isinstance(data, dict) and key in data:
+                    saved[name] = data[key]
+            sent += 1
+            if sent == warmup:
+                start = time.perf_counter()
+            elif sent > warmup:
+                samples.append((line.get('name') or endpoint(method, path), status, elapsed, queries, sql))
+    return samples, time.perf_counter() - start
+
+
+def percentile(values, percent):
+    """ nearest rank of sorted values """
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def summarize(samples, seconds):
+    latencies = sorted(sample[2] for sample in samples)
+    queries = [sample[3] for sample in samples if sample[3] is not None]
+    sql = [sample[4] for sample in samples if sample[4] is not None]
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample[1])] = statuses.get(str(sample[1]), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample[1] >= 400),
+        'statuses': dict(sorted(statuses.items())),
+        'throughput': round(len(samples) / seconds, 2) if seconds else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+        'sql_ms_mean': round(sum(sql) / len(sql) * 1000, 3) if sql else None,
+    }
+
+
+def report(samples, seconds):
+    """ the summary of every endpoint and of all the requests together """
+    endpoints = {}
+    for sample in samples:
+        endpoints.setdefault(sample[0], []).append(sample)
+    return {
+        'duration_s': round(seconds, 3),
+        'total': summarize(samples, seconds),
+        'endpoints': {name: summarize(endpoints[name], seconds) for name in sorted(endpoints)},
+    }
+
+
+def compare(previous, current):
+    """ (endpoint, p95 before, p95 after, queries before, queries after) of the endpoints of both runs """
+    rows = []
+    for name, summary in [('total', current['total']), *current['endpoints'].items()]:
+        before = previous['total'] if name == 'total' else previous['endpoints'].get(name)
+        if before is not None:
+            rows.append((name, before['p95_ms'], summary['p95_ms'], before['queries_mean'], summary['queries_mean']))
+    return rows
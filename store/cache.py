@@ -0,0 +1,85 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+CACHE_PREFIX = 'store'
+TAG_TIMEOUT = None  # tag versions must outlive every entry that depends on them
+
+
+def tag_key(tag):
+    return f'{CACHE_PREFIX}:tag:{tag}'
+
+
+def get_tag_versions(tags):
+    """ returns the current version of each tag. A missing version is started at the current time so
+    that an evicted tag can never bring back entries cached under an older version """
+    keys = [tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=TAG_TIMEOUT)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(tags):
+    for tag in tags:
+        try:
+            cache.incr(tag_key(tag))
+        except ValueError:
+            cache.set(tag_key(tag), time.time_ns(), timeout=TAG_TIMEOUT)
+
+
+def invalidate(*tags):
+    """ bumps the version of every tag, orphaning all the cached responses built from them.
+    Inside a transaction the tags are bumped again once it commits: until then other connections
+    still read the old rows, and would cache them under the first bump's version """
+    bump(tags)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: bump(tags))
+
+
+def normalize_query(query_params):
+    """ sorts the query params (and their values) and drops empty ones so equivalent urls share an entry """
+    items = sorted((key, value) for key, values in query_params.lists() for value in values if value != '')
+    return urlencode(items)
+
+
+class CachedResponseMixin:
+    """ caches the serialized data of list and retrieve responses.
+    Views name the tags their responses depend on in get_cache_tags(), and store.signals
+    invalidates those tags whenever the underlying rows change """
+    cache_timeout = 60 * 15
+
+    def get_cache_tags(self):
+        raise NotImplementedError('CachedResponseMixin views must define get_cache_tags()')
+
+    def get_cache_timeout(self):
+        return self.cache_timeout
+
+    def get_cache_key(self, request):
+        tags = self.get_cache_tags()
+        versions = get_tag_versions(tags)
+        kwargs = sorted(self.kwargs.items())
+        fingerprint = f'{request.get_host()}{request.path}|{normalize_query(request.query_params)}|{kwargs}|{versions}'
+        return f'{CACHE_PREFIX}:response:{self.basename}:{self.action}:' \
+               f'{hashlib.md5(fingerprint.encode()).hexdigest()}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout=self.get_cache_timeout())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,260 @@
+""" optional storage of live carts outside the database.
+
+With settings.STORE_CART_STORE naming a CartStore class, the cart item endpoints read and write
+{product_id: quantity} maps in the store, and the rows in store_cartitem are only written when a
+cart is flushed: at checkout, or by the periodic flush_carts task for carts changed since the last
+flush. Cart rows themselves are still created in the database so checkout and the abandoned cart
+purge work the same in both modes. Stored cart items use the product id as their id """
+import threading
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import MAX_CART_QUANTITY, Cart, CartItem, Product
+from .pricing import with_prices
+
+
+class CartStore:
+    """ the interface of a cart store, every method takes the cart id as a string """
+
+    def exists(self, cart_id):
+        raise NotImplementedError
+
+    def load(self, cart_id, quantities):
+        """ seeds the store with a cart's items from the database, unless it already holds the cart """
+        raise NotImplementedError
+
+    def items(self, cart_id):
+        """ returns {product_id: quantity} """
+        raise NotImplementedError
+
+    def add(self, cart_id, quantities):
+        """ adds {product_id: quantity} and returns the new quantities of those products """
+        raise NotImplementedError
+
+    def set(self, cart_id, product_id, quantity):
+        raise NotImplementedError
+
+    def remove(self, cart_id, product_id):
+        """ returns whether the product was in the cart """
+        raise NotImplementedError
+
+    def delete(self, cart_id):
+        raise NotImplementedError
+
+    def pop_dirty(self, count):
+        """ takes up to count ids of carts changed since they were last flushed """
+        raise NotImplementedError
+
+    def mark_dirty(self, cart_ids):
+        """ puts carts back for the next flush, after their flush failed """
+        raise NotImplementedError
+
+
+class RedisCartStore(CartStore):
+    """ keeps each cart as a hash of product id -> quantity that expires after settings.CART_TTL
+    without writes, plus a set of the carts waiting for a flush """
+    prefix = 'store:cart'
+    # an always present field so loaded empty carts still exist
+    marker = '_'
+
+    def __init__(self, client=None):
+        if client is None:
+            from django_redis import get_redis_connection
+            client = get_redis_connection('default')
+        self.client = client
+        self.ttl = int(settings.CART_TTL.total_seconds())
+
+    def key(self, cart_id):
+        return f'{self.prefix}:{cart_id}'
+
+    @property
+    def dirty_key(self):
+        return f'{self.prefix}:dirty'
+
+    def exists(self, cart_id):
+        return bool(self.client.exists(self.key(cart_id)))
+
+    def load(self, cart_id, quantities):
+        key = self.key(cart_id)
+        if self.client.hsetnx(key, self.marker, 1):
+            pipe = self.client.pipeline()
+            if quantities:
+                pipe.hset(key, mapping=quantities)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def items(self, cart_id):
+        return {int(field): int(value) for field, value in self.client.hgetall(self.key(cart_id)).items()
+                if field != self.marker.encode()}
+
+    def changed(self, pipe, cart_id):
+        pipe.hset(self.key(cart_id), self.marker, 1)
+        pipe.expire(self.key(cart_id), self.ttl)
+        pipe.sadd(self.dirty_key, cart_id)
+
+    def add(self, cart_id, quantities):
+        pipe = self.client.pipeline()
+        for product_id, quantity in quantities.items():
+            pipe.hincrby(self.key(cart_id), product_id, quantity)
+        self.changed(pipe, cart_id)
+        results = dict(zip(quantities, pipe.execute()))
+        # a quantity the database column can't hold would fail every later flush of the cart
+        capped = {product_id: MAX_CART_QUANTITY for product_id, quantity in results.items()
+                  if quantity > MAX_CART_QUANTITY}
+        if capped:
+            self.client.hset(self.key(cart_id), mapping=capped)
+            results.update(capped)
+        return results
+
+    def set(self, cart_id, product_id, quantity):
+        pipe = self.client.pipeline()
+        pipe.hset(self.key(cart_id), product_id, quantity)
+        self.changed(pipe, cart_id)
+        pipe.execute()
+
+    def remove(self, cart_id, product_id):
+        pipe = self.client.pipeline()
+        pipe.hdel(self.key(cart_id), product_id)
+        self.changed(pipe, cart_id)
+        return bool(pipe.execute()[0])
+
+    def delete(self, cart_id):
+        pipe = self.client.pipeline()
+        pipe.delete(self.key(cart_id))
+        pipe.srem(self.dirty_key, cart_id)
+        pipe.execute()
+
+    def pop_dirty(self, count):
+        return [cart_id.decode() for cart_id in self.client.spop(self.dirty_key, count) or []]
+
+    def mark_dirty(self, cart_ids):
+        if cart_ids:
+            self.client.sadd(self.dirty_key, *cart_ids)
+
+
+class InMemoryCartStore(CartStore):
+    """ a process local store with the same behaviour as RedisCartStore, for tests and development """
+
+    def __init__(self):
+        self.carts = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def exists(self, cart_id):
+        return cart_id in self.carts
+
+    def load(self, cart_id, quantities):
+        with self.lock:
+            self.carts.setdefault(cart_id, dict(quantities))
+
+    def items(self, cart_id):
+        return dict(self.carts.get(cart_id, {}))
+
+    def add(self, cart_id, quantities):
+        with self.lock:
+            cart = self.carts.setdefault(cart_id, {})
+            for product_id, quantity in quantities.items():
+                cart[product_id] = min(cart.get(product_id, 0) + quantity, MAX_CART_QUANTITY)
+            self.dirty.add(cart_id)
+            return {product_id: cart[product_id] for product_id in quantities}
+
+    def set(self, cart_id, product_id, quantity):
+        with self.lock:
+            self.carts.setdefault(cart_id, {})[product_id] = quantity
+            self.dirty.add(cart_id)
+
+    def remove(self, cart_id, product_id):
+        with self.lock:
+            self.dirty.add(cart_id)
+            return self.carts.setdefault(cart_id, {}).pop(product_id, None) is not None
+
+    def delete(self, cart_id):
+        with self.lock:
+            self.carts.pop(cart_id, None)
+            self.dirty.discard(cart_id)
+
+    def pop_dirty(self, count):
+        with self.lock:
+            cart_ids = [self.dirty.pop() for _ in range(min(count, len(self.dirty)))]
+        return cart_ids
+
+    def mark_dirty(self, cart_ids):
+        with self.lock:
+            self.dirty.update(cart_ids)
+
+
+_store = None
+
+
+def get_cart_store():
+    """ returns the configured cart store, or None when carts live in the database """
+    global _store
+    path = getattr(settings, 'STORE_CART_STORE', None)
+    if path is None:
+        return None
+    if _store is None:
+        _store = import_string(path)()
+    return _store
+
+
+def reset_cart_store():
+    global _store
+    _store = None
+
+
+def load_cart(store, cart_id):
+    """ makes sure the store holds the cart and returns its normalized id, or None when there is no such cart """
+    try:
+        cart_id = str(Cart._meta.pk.to_python(cart_id))
+    except ValidationError:
+        return None
+    if store.exists(cart_id):
+        return cart_id
+    if not Cart.objects.filter(pk=cart_id).exists():
+        return None
+    store.load(cart_id, dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity')))
+    return cart_id
+
+
+def stored_cart_items(store, cart_id, product_ids=None):
+    """ builds priced, unsaved CartItem objects for the stored items with one product query """
+    quantities = store.items(str(cart_id))
+    if product_ids is not None:
+        quantities = {product_id: quantities[product_id] for product_id in product_ids if product_id in quantities}
+    products = with_prices(Product.objects.only('id', 'title', 'description', 'unit_price')).in_bulk(quantities.keys())
+    cart_items = []
+    for product_id, quantity in sorted(quantities.items()):
+        if product_id not in products:
+            continue
+        item = CartItem(id=product_id, cart_id=cart_id, product=products[product_id], quantity=quantity)
+        item.effective_price = item.product.effective_price
+        item.price = quantity * item.effective_price
+        cart_items.append(item)
+    return cart_items
+
+
+class StoredCart:
+    """ quacks like an annotated Cart for CartSerializer and CartSummarySerializer """
+
+    def __init__(self, cart_id, cart_items):
+        self.id = cart_id
+        self.cart_items = cart_items
+        self.total_price = sum((item.price for item in cart_items), 0)
+        self.item_count = sum(item.quantity for item in cart_items)
+
+
+def flush_cart(store, cart_id):
+    """ writes a stored cart's items to store_cartitem, returns False if the cart no longer exists """
+    cart_id = str(cart_id)
+    if not store.exists(cart_id):
+        return False
+    quantities = store.items(cart_id)
+    with transaction.atomic():
+        if not Cart.objects.filter(pk=cart_id).update(last_activity=timezone.now()):
+            store.delete(cart_id)
+            return False
+        CartItem.objects.filter(cart_id=cart_id).exclude(product_id__in=quantities.keys()).delete()
+        CartItem.objects.set_quantities(cart_id, quantities)
+    return True
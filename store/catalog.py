@@ -0,0 +1,180 @@
+""" streaming import and export of products as CSV or NDJSON files.
+
+A file holds one product per row (or line) with the FIELDS below, `collection` being the
+collection id. Imports upsert on slug, a batch at a time inside one transaction: on postgres each
+batch is COPYed into a temporary table and merged with INSERT ... ON CONFLICT, elsewhere it goes
+through bulk_create/bulk_update. Exports stream the rows from iterator(chunk_size=...), so neither
+side ever holds the whole file or table in memory """
+import csv
+import io
+import json
+import os
+from decimal import Decimal
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from .cache import invalidate
+from .models import Collection, Product
+from .search import reset_search_backend
+
+FIELDS = ['slug', 'title', 'description', 'unit_price', 'inventory', 'collection']
+COLUMNS = ['slug', 'title', 'description', 'unit_price', 'inventory', 'collection_id']
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+IMPORT_TABLE = 'store_product_import'
+# the columns an INSERT has to fill that an import doesn't carry, the database has no defaults
+COUNTERS = ['reviews_count', 'ratings_count', 'ratings_total']
+
+
+def guess_format(name, default='csv'):
+    return EXTENSIONS.get(os.path.splitext(name or '')[1].lower(), default)
+
+
+def read_rows(stream, format):
+    """ yields (line number, row dict) from a text stream """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        missing = set(FIELDS) - set(reader.fieldnames or [])
+        if missing:
+            raise ValidationError(f'line 1: missing columns {sorted(missing)}')
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line, parse_float=Decimal)
+        except ValueError as error:
+            raise ValidationError(f'line {number}: {error}')
+        if not isinstance(row, dict):
+            raise ValidationError(f'line {number}: expected an object')
+        yield number, row
+
+
+def clean_row(number, row, collection_ids):
+    """ the column values of a row, checked by the model fields """
+    values = {}
+    for name, column in zip(FIELDS, COLUMNS):
+        value = row.get(name)
+        try:
+            if name == 'collection':
+                value = int(value)
+                if value not in collection_ids:
+                    raise ValidationError(f'collection {value} does not exist')
+            else:
+                value = Product._meta.get_field(name).clean(value, None)
+        except (TypeError, ValueError, ValidationError) as error:
+            messages = error.messages if isinstance(error, ValidationError) else [str(error)]
+            raise ValidationError(f'line {number}: {name}: {" ".join(messages)}')
+        values[column] = value
+    return values
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def copy_batch(products, now):
+    """ merges a batch through a COPY into the temporary import table, rows that didn't change
+    are left alone. Returns (created, updated) """
+    table = connection.ops.quote_name(Product._meta.db_table)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([product[column] for column in COLUMNS] for product in products)
+    buffer.seek(0)
+    columns = ', '.join(COLUMNS)
+    changed = ' OR '.join(f'{table}.{column} IS DISTINCT FROM EXCLUDED.{column}' for column in COLUMNS[1:])
+    with connection.cursor() as cursor:
+        cursor.execute(f'TRUNCATE {IMPORT_TABLE}')
+        cursor.copy_expert(f'COPY {IMPORT_TABLE} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}, last_update, {", ".join(COUNTERS)}) '
+            f'SELECT {columns}, %s, {", ".join("0" for _ in COUNTERS)} FROM {IMPORT_TABLE} '
+            f'ON CONFLICT (slug) DO UPDATE SET '
+            f'{", ".join(f"{column} = EXCLUDED.{column}" for column in COLUMNS[1:])}, last_update = EXCLUDED.last_update '
+            f'WHERE {changed} RETURNING xmax = 0', [now])
+        inserted = [created for (created,) in cursor.fetchall()]
+    return inserted.count(True), inserted.count(False)
+
+
+def save_batch(products, now):
+    """ the same merge with bulk_create and bulk_update, for databases without COPY """
+    existing = Product.objects.only('id', *COLUMNS).in_bulk([product['slug'] for product in products],
+                                                            field_name='slug')
+    created, updated = [], []
+    for values in products:
+        product = existing.get(values['slug'])
+        if product is None:
+            created.append(Product(**values, last_update=now))
+        elif any(getattr(product, column) != value for column, value in values.items()):
+            for column, value in values.items():
+                setattr(product, column, value)
+            product.last_update = now
+            updated.append(product)
+    Product.objects.bulk_create(created)
+    Product.objects.bulk_update(updated, COLUMNS[1:] + ['last_update'])
+    return len(created), len(updated)
+
+
+def import_products(rows, batch_size=1000, use_copy=None):
+    """ upserts the (line number, row) pairs of read_rows() by slug, all or nothing. A slug repeated
+    in the file takes its last row. Returns the number of products created, updated and unchanged.
+    Bulk writes skip the model signals, so the collection counts, search index and cached
+    responses are brought up to date afterwards """
+    if use_copy is None:
+        use_copy = connection.vendor == 'postgresql'
+    collection_ids = set(Collection.objects.values_list('id', flat=True))
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+    now = timezone.now()
+    with transaction.atomic():
+        if use_copy:
+            with connection.cursor() as cursor:
+                # the product column types, without the constraints and defaults. It is still there
+                # when the import runs inside an outer transaction that imported before
+                cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {IMPORT_TABLE} ON COMMIT DROP AS '
+                               f'SELECT {", ".join(COLUMNS)} FROM {connection.ops.quote_name(Product._meta.db_table)} '
+                               f'WITH NO DATA')
+        write = copy_batch if use_copy else save_batch
+        for batch in batches(rows, batch_size):
+            products = {}
+            for number, row in batch:
+                values = clean_row(number, row, collection_ids)
+                products[values['slug']] = values
+            created, updated = write(list(products.values()), now)
+            counts['created'] += created
+            counts['updated'] += updated
+            counts['unchanged'] += len(products) - created - updated
+        if counts['created'] or counts['updated']:
+            call_command('reconcile_collection_counts', stdout=io.StringIO())
+            transaction.on_commit(catalog_changed)
+    return counts
+
+
+def catalog_changed():
+    reset_search_backend()
+    invalidate('catalog', 'products', 'collections')
+
+
+class Echo:
+    """ a file whose write() hands back the line, for csv.writer in a generator """
+
+    def write(self, value):
+        return value
+
+
+def export_lines(queryset, format, chunk_size=2000):
+    """ yields the products of a queryset as the lines of a file, in id order """
+    rows = queryset.order_by('id').values_list(*COLUMNS).iterator(chunk_size=chunk_size)
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+        return
+    for row in rows:
+        yield json.dumps(dict(zip(FIELDS, row)), cls=DjangoJSONEncoder) + '\n'
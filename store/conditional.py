@@ -0,0 +1,89 @@
+import hashlib
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+from django.db.models.functions import Now
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from .cache import CachedResponseMixin
+from .models import Product, Promotion
+
+
+def touch_products(product_ids):
+    """ moves last_update of products whose representation changed without saving them """
+    if product_ids:
+        Product.objects.filter(id__in=product_ids).update(last_update=Now())
+
+
+def promotion_schedule():
+    """ the last time a promotion started or ended, and the next time one will. Promotion edits
+    touch their products, this covers the prices that change on their own when a scheduled
+    promotion starts or ends """
+    now = Now()
+    changes = Promotion.objects.aggregate(started=Max('starts_at', filter=Q(starts_at__lte=now)),
+                                          ended=Max('ends_at', filter=Q(ends_at__lte=now)),
+                                          starts=Min('starts_at', filter=Q(starts_at__gt=now)),
+                                          ends=Min('ends_at', filter=Q(ends_at__gt=now)))
+    return latest(changes['started'], changes['ended']), earliest(changes['starts'], changes['ends'])
+
+
+def latest(*datetimes):
+    datetimes = [value for value in datetimes if value is not None]
+    return max(datetimes) if datetimes else None
+
+
+def earliest(*datetimes):
+    datetimes = [value for value in datetimes if value is not None]
+    return min(datetimes) if datetimes else None
+
+
+def aggregate_validators(queryset):
+    """ the row count and newest last_update of a queryset, from one aggregate query """
+    state = queryset.order_by().aggregate(count=Count('id'), last_update=Max('last_update'))
+    return [state['count'], state['last_update']], state['last_update']
+
+
+class ConditionalGetMixin:
+    """ answers list and retrieve requests with 304 Not Modified when the client's If-None-Match or
+    If-Modified-Since still holds, before anything is serialized (or read from the response cache).
+
+    Views return (fingerprint, last_modified) from get_validators(): a few values that change
+    whenever the response would, read with a small query instead of rendering the body. The strong
+    ETag hashes them together with the url and media type, so every representation has its own.
+
+    Placed before CachedResponseMixin, the validators are cached next to the response under the
+    same tag versions, so repeated polls don't query the database until the tags are invalidated """
+
+    def get_validators(self):
+        raise NotImplementedError('ConditionalGetMixin views must define get_validators()')
+
+    def get_cached_validators(self, request):
+        if not isinstance(self, CachedResponseMixin):
+            return self.get_validators()
+        key = f'{self.get_cache_key(request)}:validators'
+        validators = cache.get(key)
+        if validators is None:
+            validators = self.get_validators()
+            cache.set(key, validators, timeout=self.get_cache_timeout())
+        return validators
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        fingerprint, last_modified = self.get_cached_validators(request)
+        state = repr([request.get_full_path(), request.accepted_media_type, fingerprint])
+        etag = quote_etag(hashlib.md5(state.encode()).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is not None:
+            return response
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
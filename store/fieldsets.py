@@ -0,0 +1,46 @@
+from rest_framework import serializers
+from rest_framework.serializers import ListSerializer
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+def parse_names(value):
+    return [name for name in (part.strip() for part in value.split(',')) if name]
+
+
+def selected_fields(request, available):
+    """ the names in `available` kept by the ?fields= and ?omit= params of a read request, in their
+    original order, or None when the request doesn't ask for a sparse fieldset """
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return None
+    fields = request.query_params.get(FIELDS_PARAM)
+    omit = request.query_params.get(OMIT_PARAM)
+    if not fields and not omit:
+        return None
+    requested = parse_names(fields) if fields else list(available)
+    omitted = parse_names(omit) if omit else []
+    unknown = [name for name in requested + omitted if name not in available]
+    if unknown:
+        raise serializers.ValidationError({FIELDS_PARAM: f'Unknown fields {unknown}'})
+    return [name for name in available if name in requested and name not in omitted]
+
+
+class DynamicFieldsMixin:
+    """ lets GET requests pick the fields of a serializer with ?fields=a,b or drop some with ?omit=c.
+    Only the serializer the view renders is trimmed, nested serializers keep all their fields """
+
+    def is_root_serializer(self):
+        if self.parent is None:
+            return True
+        return isinstance(self.parent, ListSerializer) and self.parent.parent is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.is_root_serializer():
+            return fields
+        names = selected_fields(self.context.get('request'), list(fields))
+        if names is not None:
+            for name in set(fields) - set(names):
+                fields.pop(name)
+        return fields
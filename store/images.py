@@ -0,0 +1,77 @@
+""" resized copies of product images, made by the generate_image_derivatives task.
+
+Every size in settings.STORE_IMAGE_SIZES is saved next to the original, once in the original's
+format (JPEG for anything but PNG) and once as WebP, and recorded on ProductImage.derivatives as
+{size: {'width': ..., mime type: file name}}. Clients get them as srcset strings per mime type.
+The names hold the original's content hash and the target width, so copies of a shared file
+(store.storage) are shared as well """
+import os
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+from .storage import is_blob_name
+
+FORMATS = {'JPEG': ('image/jpeg', 'jpg'), 'PNG': ('image/png', 'png'), 'WEBP': ('image/webp', 'webp')}
+SAVE_OPTIONS = {'JPEG': {'quality': 85, 'optimize': True}, 'PNG': {'optimize': True}, 'WEBP': {'quality': 80}}
+
+
+def derivative_name(name, width, extension):
+    root, _ = os.path.splitext(name)
+    return f'{root}.{width}w.{extension}'
+
+
+def encode(image, format):
+    if format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format=format, **SAVE_OPTIONS[format])
+    return ContentFile(buffer.getvalue())
+
+
+def make_derivatives(field_file):
+    """ saves the resized copies of an image file and returns their description for
+    ProductImage.derivatives, images are never scaled up """
+    storage = field_file.storage
+    with field_file.open('rb'):
+        original = Image.open(field_file)
+        original.load()
+    format = 'PNG' if original.format == 'PNG' else 'JPEG'
+    derivatives = {}
+    for size, width in sorted(settings.STORE_IMAGE_SIZES.items(), key=lambda item: item[1]):
+        resized = original.copy()
+        resized.thumbnail((width, width * 10), Image.LANCZOS)
+        derivative = {'width': resized.width}
+        for output in (format, 'WEBP'):
+            mime, extension = FORMATS[output]
+            name = derivative_name(field_file.name, width, extension)
+            # content-addressed copies are never rewritten, see store.storage.BlobStorage
+            if storage.exists(name) and not is_blob_name(name):
+                storage.delete(name)
+            derivative[mime] = storage.save(name, encode(resized, output))
+        derivatives[size] = derivative
+    return derivatives
+
+
+def derivative_files(derivatives):
+    return [name for derivative in (derivatives or {}).values()
+            for key, name in derivative.items() if key != 'width']
+
+
+def delete_files(storage, names):
+    for name in names:
+        storage.delete(name)
+
+
+def srcset(derivatives, storage, request=None):
+    """ {mime type: 'url 150w, url 600w'} for the derivatives of an image, {} until they are made """
+    sources = {}
+    for derivative in sorted((derivatives or {}).values(), key=lambda derivative: derivative['width']):
+        for key, name in derivative.items():
+            if key == 'width':
+                continue
+            url = storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            sources.setdefault(key, []).append(f'{url} {derivative["width"]}w')
+    return {mime: ', '.join(sources[mime]) for mime in sorted(sources)}
@@ -0,0 +1,23 @@
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Now
+from .models import Product
+
+
+def reserve_inventory(quantities):
+    """ takes {product_id: quantity} out of stock inside the caller's transaction.
+
+    The product rows are locked in id order so two checkouts sharing products always queue on the
+    same first row instead of deadlocking, then every line is decremented by one set-based UPDATE.
+    Nothing is changed when a line is short, the ids of the short products are returned instead """
+    product_ids = sorted(quantities)
+    stock = dict(Product.objects.select_for_update().filter(id__in=product_ids)
+                 .order_by('id').values_list('id', 'inventory'))
+    short = [product_id for product_id in product_ids if stock.get(product_id, 0) < quantities[product_id]]
+    if short:
+        return short
+
+    decrement = Case(*[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+                     output_field=IntegerField())
+    # this skips the post_save signals, callers refresh the catalog cache (see store.outbox)
+    Product.objects.filter(id__in=product_ids).update(inventory=F('inventory') - decrement, last_update=Now())
+    return []
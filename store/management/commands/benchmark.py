@@ -0,0 +1,131 @@
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+from contextlib import ExitStack
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from store import benchmark
+
+CACHES = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'dummy': 'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Replays a traffic mix or a trace against the store api and reports the latency, throughput and ' \
+           'queries of every endpoint. Load a dataset with generate_dataset first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mix', choices=list(benchmark.MIXES), default='mixed',
+                            help='the scenarios to replay and their weights, see store.benchmark.MIXES')
+        parser.add_argument('--trace', help='a jsonl file of requests to replay instead of a mix')
+        parser.add_argument('--requests', type=int,
+                            help='number of requests to time, 1000 for a mix and one pass of a trace by default')
+        parser.add_argument('--warmup', type=int,
+                            help='number of untimed requests first, 50 for a mix and none for a trace by default')
+        parser.add_argument('--seed', type=int, default=0, help='picks the sessions of a mix')
+        parser.add_argument('--url', help='base url of a running server, by default the requests go through '
+                                          'the django handler in this process, where their queries are counted')
+        parser.add_argument('--cache', choices=['default', *CACHES], default='default',
+                            help='the cache backend of a local run')
+        parser.add_argument('--commit', action='store_true',
+                            help='keep the rows written by a local run, they are rolled back by default')
+        parser.add_argument('--output', help='the json file of the results, benchmarks/<mix>-<time>.json by default')
+        parser.add_argument('--record', help='also write the requests sent as a trace file')
+        parser.add_argument('--compare', help='the results file of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        trace = options['trace']
+        count = options['requests'] if options['requests'] is not None or trace else 1000
+        warmup = options['warmup'] if options['warmup'] is not None else (0 if trace else 50)
+        local = not options['url']
+
+        # timings of a local run are taken as in production, without the DEBUG bookkeeping or the
+        # query detector
+        overrides = {'DEBUG': False, 'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+                     'QUERY_DETECTOR_MODE': None}
+        if options['cache'] != 'default':
+            overrides['CACHES'] = {'default': {'BACKEND': CACHES[options['cache']]}}
+
+        started_at = timezone.now()
+        with ExitStack() as stack:
+            if local:
+                stack.enter_context(override_settings(**overrides))
+            if local and not options['commit']:
+                stack.enter_context(transaction.atomic())
+            if trace:
+                sessions = benchmark.trace_sessions(trace, repeat=count is not None)
+            else:
+                try:
+                    sessions = benchmark.mix_sessions(random.Random(options['seed']), options['mix'])
+                    sessions = itertools.chain([next(sessions)], sessions)
+                except ValueError as error:
+                    raise CommandError(error)
+            client = benchmark.LocalClient() if local else benchmark.HttpClient(options['url'])
+            record = stack.enter_context(open(options['record'], 'w', encoding='utf-8')) \
+                if options['record'] else None
+            samples, seconds = benchmark.run(client, sessions, benchmark.user_tokens(), count, warmup, record)
+            if local and not options['commit']:
+                transaction.set_rollback(True)
+        if not samples:
+            raise CommandError('no request was timed')
+
+        results = {
+            'name': os.path.basename(trace) if trace else options['mix'],
+            'started_at': started_at.isoformat(),
+            'seed': None if trace else options['seed'],
+            'warmup': warmup,
+            'target': options['url'] or 'local',
+            'cache': options['cache'],
+            'environment': {
+                'commit': git_commit(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            **benchmark.report(samples, seconds),
+        }
+        output = options['output'] or os.path.join(
+            'benchmarks', f'{results["name"]}-{started_at.strftime("%Y%m%d-%H%M%S")}.json')
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+        self.write_table(results)
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                self.write_comparison(benchmark.compare(json.load(file), results))
+        self.stdout.write(f'Results written to {output}')
+
+    def write_table(self, results):
+        self.stdout.write(f'{"endpoint":<44} {"n":>6} {"err":>5} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+                          f'{"queries":>7}')
+        for name, summary in [*results['endpoints'].items(), ('total', results['total'])]:
+            queries = '-' if summary['queries_mean'] is None else f'{summary["queries_mean"]:.1f}'
+            self.stdout.write(f'{name:<44} {summary["requests"]:>6} {summary["errors"]:>5} '
+                              f'{summary["p50_ms"]:>8.2f} {summary["p95_ms"]:>8.2f} {summary["p99_ms"]:>8.2f} '
+                              f'{queries:>7}')
+        self.stdout.write(f'{results["total"]["throughput"]} requests/s over {results["duration_s"]}s')
+
+    def write_comparison(self, rows):
+        self.stdout.write(f'{"endpoint":<44} {"p95 ms before":>14} {"after":>8} {"change":>8} {"queries":>12}')
+        for name, before, after, queries_before, queries_after in rows:
+            change = f'{(after - before) / before * 100:+.1f}%' if before else '-'
+            self.stdout.write(f'{name:<44} {before:>14.2f} {after:>8.2f} {change:>8} '
+                              f'{str(queries_before):>5} -> {str(queries_after):<5}')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from store import catalog
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Streams every product to a csv or ndjson file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='the file to write, stdout by default')
+        parser.add_argument('--format', choices=list(catalog.FORMATS),
+                            help='the file format, guessed from the extension by default')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='number of products fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or catalog.guess_format(path)
+        lines = catalog.export_lines(Product.objects.all(), file_format, options['chunk_size'])
+        if path == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            file.writelines(lines)
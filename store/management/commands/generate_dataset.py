@@ -0,0 +1,375 @@
+import csv
+import json
+import random
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from io import BytesIO, StringIO
+from uuid import UUID
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F, JSONField
+from django.utils import timezone
+from PIL import Image
+from likes.models import LikedItem
+from store.cache import invalidate
+from store.models import Address, Cart, CartItem, Collection, Customer, ImageBlob, Order, OrderItem, Product, \
+    ProductImage, Promotion, Review
+from store.storage import blob_name, content_hash
+from tags.models import Tag, TaggedItem
+
+# row counts at --scale 1, each can be set on its own with --<name>
+COUNTS = {
+    'collections': 100,
+    'promotions': 50,
+    'products': 10_000,
+    'image_files': 10,
+    'users': 1_000,
+    'orders': 5_000,
+    'carts': 1_000,
+    'reviews': 20_000,
+    'tags': 200,
+    'tagged_items': 20_000,
+    'likes': 50_000,
+}
+ITEMS_PER_ORDER = 5
+ITEMS_PER_CART = 3
+IMAGES_PER_PRODUCT = 1
+# most reviews are good ones
+RATINGS = [1, 2, 3, 4, 5]
+RATING_WEIGHTS = [5, 7, 15, 33, 40]
+PASSWORD = 'loadtest'
+NULL = '\\N'
+
+WORDS = ['amber', 'basil', 'cedar', 'crisp', 'delta', 'ember', 'fresh', 'garden', 'golden', 'harbor', 'honey',
+         'island', 'jade', 'lemon', 'maple', 'meadow', 'mint', 'north', 'olive', 'orchid', 'pearl', 'pepper',
+         'prairie', 'river', 'rustic', 'sage', 'silver', 'spice', 'stone', 'summit', 'sunny', 'valley', 'velvet',
+         'willow', 'wild', 'classic', 'organic', 'premium', 'mini', 'family', 'bread', 'coffee', 'tea', 'soap',
+         'brush', 'candle', 'pasta', 'sauce', 'cookie', 'notebook', 'pencil', 'shampoo', 'towel', 'toy', 'leash']
+FIRST_NAMES = ['Ada', 'Ben', 'Chioma', 'Dan', 'Efe', 'Fatima', 'Grace', 'Harry', 'Ife', 'Jon', 'Kemi', 'Lara',
+               'Musa', 'Nia', 'Obi', 'Priya', 'Quinn', 'Rita', 'Sam', 'Tolu', 'Uche', 'Vera', 'Wale', 'Yemi', 'Zara']
+LAST_NAMES = ['Adams', 'Bello', 'Chen', 'Diaz', 'Eze', 'Fox', 'Garcia', 'Hughes', 'Ibe', 'Jones', 'Khan', 'Lopez',
+              'Mensah', 'Nwosu', 'Okafor', 'Patel', 'Reyes', 'Smith', 'Taylor', 'Usman', 'Wright', 'Young']
+CITIES = ['Lagos', 'Abuja', 'London', 'Nairobi', 'Accra', 'Toronto', 'Berlin', 'Austin', 'Lisbon', 'Cairo']
+
+
+def words(rng, low, high):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def chunks(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """ lets bulk_create keep the generated values of auto_now and auto_now_add fields, COPY never
+    looks at them """
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def model_field(model, name):
+    return model._meta.get_field(name)
+
+
+def column_default(field):
+    value = field.get_default()
+    return json.dumps(value) if isinstance(field, JSONField) else value
+
+
+class Command(BaseCommand):
+    help = 'Generates a reproducible synthetic dataset for load testing with batched bulk inserts. The same ' \
+           '--seed, counts and --date give the same rows, apart from the generated ids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scale', type=float, default=1,
+                            help='multiplies every count, --scale 100 makes 1M products and 100k users')
+        for name, count in COUNTS.items():
+            parser.add_argument(f'--{name.replace("_", "-")}', type=int, dest=name,
+                                help=f'defaults to {count} times the scale')
+        parser.add_argument('--date', type=datetime.fromisoformat,
+                            help='the day the timestamps count back from, today by default')
+        parser.add_argument('--batch-size', type=int, default=5000, help='number of rows per insert')
+
+    def handle(self, *args, **options):
+        self.seed = options['seed']
+        self.batch_size = options['batch_size']
+        self.counts = {name: options[name] if options[name] is not None else round(count * options['scale'])
+                       for name, count in COUNTS.items()}
+        day = (options['date'] or timezone.now()).date()
+        self.now = timezone.make_aware(datetime.combine(day, time()))
+        # every name is prefixed by the seed, so datasets of different seeds can share a database
+        self.prefix = f'gen{self.seed}'
+        if get_user_model().objects.filter(username__startswith=f'{self.prefix}-').exists():
+            raise CommandError(f'The dataset of seed {self.seed} was already generated')
+        self.product_type = ContentType.objects.get_for_model(Product)
+
+        with explicit_timestamps(model_field(Collection, 'last_update'), model_field(Product, 'last_update'),
+                                 model_field(Order, 'placed_at'), model_field(Cart, 'created_at'),
+                                 model_field(Review, 'date')):
+            for step in (self.collections, self.promotions, self.products, self.images, self.users,
+                         self.orders, self.carts, self.reviews, self.tags, self.likes):
+                step()
+
+        # bulk inserts skip the signals that keep these current
+        call_command('reconcile_collection_counts', stdout=StringIO())
+        invalidate('catalog', 'products', 'collections')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.stdout.write(self.style.SUCCESS(f'Generated the dataset of seed {self.seed}'))
+
+    def random(self, name):
+        """ one generator per model, so changing one count leaves the rows of the others alone """
+        return random.Random(f'{self.seed}:{name}')
+
+    def before(self, rng, days):
+        return self.now - timedelta(seconds=rng.randrange(days * 86400))
+
+    def insert(self, model, columns, rows, report=True):
+        """ inserts the tuples of `columns` values in batches and returns their ids, the other columns
+        get their defaults. Postgres gets the rows with COPY and the ids from the sequence up front,
+        instead of building a model instance per row """
+        fields = {field.attname: field for field in model._meta.concrete_fields}
+        pk = model._meta.pk
+        allocate = pk.attname not in columns
+        others = [field for name, field in fields.items() if name not in columns and field is not pk]
+        defaults = tuple(column_default(field) for field in others)
+        ids, count = array('q'), 0
+        for batch in chunks(rows, self.batch_size):
+            count += len(batch)
+            if connection.vendor != 'postgresql':
+                objects = model.objects.bulk_create([model(**dict(zip(columns, row))) for row in batch])
+                ids.extend(obj.pk for obj in objects if allocate)
+                continue
+            names = [fields[name].column for name in columns] + [field.column for field in others]
+            if allocate:
+                batch_ids = self.next_ids(model, len(batch))
+                ids.extend(batch_ids)
+                names.insert(0, pk.column)
+                batch = ((batch_id, *row) for batch_id, row in zip(batch_ids, batch))
+            buffer = StringIO()
+            csv.writer(buffer).writerows([NULL if value is None else value for value in (*row, *defaults)]
+                                         for row in batch)
+            buffer.seek(0)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(f'COPY {connection.ops.quote_name(model._meta.db_table)} '
+                                   f'({", ".join(connection.ops.quote_name(name) for name in names)}) '
+                                   f"FROM STDIN WITH (FORMAT csv, NULL '{NULL}')", buffer)
+        if report:
+            self.stdout.write(f'{model._meta.label}: {count}')
+        return ids
+
+    def next_ids(self, model, count):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                           [connection.ops.quote_name(model._meta.db_table), model._meta.pk.column, count])
+            return [row[0] for row in cursor.fetchall()]
+
+    def collections(self):
+        rng = self.random('collections')
+        self.collection_ids = self.insert(Collection, ['title', 'last_update'], (
+            (words(rng, 1, 2).title(), self.before(rng, 365)) for _ in range(self.counts['collections'])))
+
+    def promotions(self):
+        rng = self.random('promotions')
+
+        def promotion():
+            starts_at = self.before(rng, 60) if rng.random() < 0.5 else None
+            ends_at = self.now + timedelta(days=rng.randint(-10, 60)) if rng.random() < 0.5 else None
+            return words(rng, 2, 4), rng.randint(5, 50), starts_at, ends_at
+        self.promotion_ids = self.insert(Promotion, ['description', 'discount', 'starts_at', 'ends_at'],
+                                         (promotion() for _ in range(self.counts['promotions'])))
+
+    def products(self):
+        rng = self.random('products')
+        # prices in cents, order items copy them
+        self.prices = array('q')
+        self.plan_reviews()
+
+        def product(index):
+            cents = rng.randint(100, 99999)
+            self.prices.append(cents)
+            reviews, total = self.review_counts[index], self.rating_totals[index]
+            average = (Decimal(total) / reviews).quantize(Decimal('0.01'), ROUND_HALF_UP) if reviews else None
+            return (words(rng, 2, 4).title(), f'{self.prefix}-{index}', words(rng, 8, 20), Decimal(cents) / 100,
+                    rng.randint(0, 500), rng.choice(self.collection_ids), self.before(rng, 365),
+                    reviews, reviews, total, average)
+        self.product_ids = self.insert(
+            Product, ['title', 'slug', 'description', 'unit_price', 'inventory', 'collection_id', 'last_update',
+                      'reviews_count', 'ratings_count', 'ratings_total', 'rating_average'],
+            (product(index) for index in range(self.counts['products'])))
+
+        if self.promotion_ids:
+            self.insert(Product.promotions.through, ['product_id', 'promotion_id'],
+                        ((product_id, rng.choice(self.promotion_ids))
+                         for product_id in self.product_ids if rng.random() < 0.1))
+
+    def images(self):
+        """ a few image files shared by all the products, like the variants of one catalog photo """
+        rng = self.random('images')
+        storage = model_field(ProductImage, 'image').storage
+        names = []
+        for _ in range(self.counts['image_files']):
+            buffer = BytesIO()
+            color = tuple(rng.randrange(256) for _ in range(3))
+            Image.new('RGB', (800, 800), color).save(buffer, format='JPEG')
+            content = ContentFile(buffer.getvalue())
+            names.append(storage.save(blob_name(content_hash(content), '.jpg'), content))
+        if not names:
+            return
+        refs = dict.fromkeys(names, 0)
+
+        def image(product_id):
+            name = rng.choice(names)
+            refs[name] += 1
+            return product_id, name
+        self.insert(ProductImage, ['product_id', 'image'],
+                    (image(product_id) for product_id in self.product_ids
+                     for _ in range(rng.randint(0, 2 * IMAGES_PER_PRODUCT))))
+        for name, count in refs.items():
+            ImageBlob.objects.get_or_create(name=name)
+            ImageBlob.objects.filter(name=name).update(refs=F('refs') + count, released_at=None)
+
+    def users(self):
+        rng = self.random('users')
+        # hashing is slow on purpose, every user shares one hash of PASSWORD
+        password = make_password(PASSWORD)
+
+        def user(index):
+            return (f'{self.prefix}-{index}', f'{self.prefix}-{index}@example.com', password,
+                    rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), self.before(rng, 3 * 365))
+        self.user_ids = self.insert(get_user_model(),
+                                    ['username', 'email', 'password', 'first_name', 'last_name', 'date_joined'],
+                                    (user(index) for index in range(self.counts['users'])))
+
+        # the signal that adds a customer to every new user doesn't run for bulk inserts
+        memberships = [Customer.MEMBERSHIP_BRONZE] * 6 + [Customer.MEMBERSHIP_SILVER] * 3 + [Customer.MEMBERSHIP_GOLD]
+        self.customer_ids = self.insert(Customer, ['user_id', 'phone', 'membership', 'birth_date'], (
+            (user_id, f'+1555{rng.randrange(10 ** 7):07}', rng.choice(memberships),
+             (self.now - timedelta(days=rng.randint(18 * 365, 80 * 365))).date())
+            for user_id in self.user_ids))
+        self.insert(Address, ['customer_id', 'street', 'city'], (
+            (customer_id, f'{rng.randint(1, 999)} {rng.choice(WORDS).title()} St', rng.choice(CITIES))
+            for customer_id in self.customer_ids))
+
+    def sample_products(self, rng, average):
+        count = min(rng.randint(1, 2 * average - 1), len(self.product_ids))
+        return rng.sample(range(len(self.product_ids)), count)
+
+    def orders(self):
+        if not self.customer_ids or not self.product_ids:
+            return
+        rng = self.random('orders')
+        statuses = [Order.PAYMENT_STATUS_COMPLETE] * 16 + [Order.PAYMENT_STATUS_PENDING] * 3 + \
+            [Order.PAYMENT_STATUS_FAILED]
+        orders, items = 0, 0
+        # the items of a batch of orders are made first, the orders store their totals
+        for numbers in chunks(range(self.counts['orders']), self.batch_size):
+            batch, lines = [], []
+            for _ in numbers:
+                order_lines = [(self.product_ids[index], rng.randint(1, 5), self.prices[index])
+                               for index in self.sample_products(rng, ITEMS_PER_ORDER)]
+                batch.append((rng.choice(self.customer_ids), rng.choice(statuses), self.before(rng, 365),
+                              Decimal(sum(quantity * cents for _, quantity, cents in order_lines)) / 100,
+                              sum(quantity for _, quantity, _ in order_lines)))
+                lines.append(order_lines)
+            order_ids = self.insert(Order, ['customer_id', 'payment_status', 'placed_at', 'total_amount', 'item_count'],
+                                    batch, report=False)
+            order_items = [(order_id, product_id, quantity, Decimal(cents) / 100)
+                           for order_id, order_lines in zip(order_ids, lines)
+                           for product_id, quantity, cents in order_lines]
+            self.insert(OrderItem, ['order_id', 'product_id', 'quantity', 'unit_price'], order_items, report=False)
+            orders += len(batch)
+            items += len(order_items)
+        self.stdout.write(f'{Order._meta.label}: {orders}')
+        self.stdout.write(f'{OrderItem._meta.label}: {items}')
+
+    def carts(self):
+        if not self.product_ids:
+            return
+        rng = self.random('carts')
+        for numbers in chunks(range(self.counts['carts']), self.batch_size):
+            carts, items = [], []
+            for _ in numbers:
+                cart_id = UUID(int=rng.getrandbits(128), version=4)
+                created_at = self.before(rng, 30)
+                carts.append((cart_id, created_at, created_at + (self.now - created_at) * rng.random()))
+                items += [(cart_id, self.product_ids[index], rng.randint(1, 5))
+                          for index in self.sample_products(rng, ITEMS_PER_CART)]
+            self.insert(Cart, ['id', 'created_at', 'last_activity'], carts, report=False)
+            self.insert(CartItem, ['cart_id', 'product_id', 'quantity'], items, report=False)
+        self.stdout.write(f'{Cart._meta.label}: {self.counts["carts"]}')
+
+    def plan_reviews(self):
+        """ picks the product and rating of every review before the products are written, so each
+        product row carries its review counters """
+        rng = self.random('review-ratings')
+        products = self.counts['products']
+        count = self.counts['reviews'] if products else 0
+        self.review_products = array('q', (rng.randrange(products) for _ in range(count)))
+        self.review_ratings = array('b', rng.choices(RATINGS, RATING_WEIGHTS, k=count))
+        self.review_counts, self.rating_totals = array('q', [0]) * products, array('q', [0]) * products
+        for index, rating in zip(self.review_products, self.review_ratings):
+            self.review_counts[index] += 1
+            self.rating_totals[index] += rating
+
+    def reviews(self):
+        if not self.product_ids:
+            return
+        rng = self.random('reviews')
+        self.insert(Review, ['product_id', 'rating', 'name', 'description', 'date'], (
+            (self.product_ids[index], rating, rng.choice(FIRST_NAMES), words(rng, 5, 30),
+             self.before(rng, 365).date())
+            for index, rating in zip(self.review_products, self.review_ratings)))
+
+    def object_ids(self, model):
+        """ the product ids that fit the object_id column of a generic relation """
+        low, high = connection.ops.integer_field_range(model_field(model, 'object_id').get_internal_type())
+        return array('q', (product_id for product_id in self.product_ids if high is None or product_id <= high))
+
+    def tags(self):
+        rng = self.random('tags')
+        tag_ids = self.insert(Tag, ['label'], ((f'{rng.choice(WORDS)}-{index}',) for index in range(self.counts['tags'])))
+        object_ids = self.object_ids(TaggedItem)
+        if not tag_ids or not object_ids:
+            return
+        self.insert(TaggedItem, ['tag_id', 'content_type_id', 'object_id'], (
+            (rng.choice(tag_ids), self.product_type.id, rng.choice(object_ids))
+            for _ in range(self.counts['tagged_items'])))
+
+    def likes(self):
+        object_ids = self.object_ids(LikedItem)
+        if not self.user_ids or not object_ids:
+            return
+        rng = self.random('likes')
+        average = max(1, self.counts['likes'] // len(self.user_ids))
+
+        # a user likes a product at most once
+        def liked_items():
+            for user_id in self.user_ids:
+                count = min(rng.randint(0, 2 * average), len(object_ids))
+                for index in rng.sample(range(len(object_ids)), count):
+                    yield user_id, self.product_type.id, object_ids[index]
+        self.insert(LikedItem, ['user_id', 'content_type_id', 'object_id'], liked_items())
@@ -0,0 +1,29 @@
+import sys
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from store import catalog
+
+
+class Command(BaseCommand):
+    help = 'Upserts products by slug from a csv or ndjson file, streamed in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="the file to import, - reads stdin")
+        parser.add_argument('--format', choices=list(catalog.FORMATS),
+                            help='the file format, guessed from the extension by default')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='number of products written per statement')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or catalog.guess_format(path)
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            counts = catalog.import_products(catalog.read_rows(stream, file_format), options['batch_size'])
+        except ValidationError as error:
+            raise CommandError(' '.join(error.messages))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(self.style.SUCCESS(
+            'Created {created}, updated {updated} and left {unchanged} products unchanged'.format(**counts)))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Now
+from store.cache import invalidate
+from store.models import Collection, Product
+
+
+class Command(BaseCommand):
+    help = 'Backfills or repairs the stored products_count of collections from their products'
+
+    def handle(self, *args, **options):
+        counts = Product.objects.filter(collection_id=OuterRef('pk')).order_by() \
+            .values('collection_id').annotate(count=Count('id')).values('count')
+        products_count = Coalesce(Subquery(counts), Value(0))
+        repaired = Collection.objects.alias(expected=products_count) \
+            .filter(~Q(products_count=F('expected'))) \
+            .update(products_count=products_count, last_update=Now())
+        if repaired:
+            invalidate('collections')
+        self.stdout.write(self.style.SUCCESS(f'Repaired the product counts of {repaired} collections'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from store.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = 'Backfills or repairs the stored total_amount and item_count of orders from their order items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='number of order ids updated per statement')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        items = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+        total_amount = Coalesce(
+            Subquery(items.annotate(total=Sum(F('quantity') * F('unit_price'))).values('total')),
+            Value(0), output_field=DecimalField(max_digits=10, decimal_places=2))
+        item_count = Coalesce(
+            Subquery(items.annotate(count=Sum('quantity')).values('count')),
+            Value(0), output_field=IntegerField())
+
+        last_id = Order.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        repaired = 0
+        # short id-range batches keep each update's row locks brief
+        for start in range(0, last_id + 1, batch_size):
+            with transaction.atomic():
+                repaired += Order.objects \
+                    .filter(id__gte=start, id__lt=start + batch_size) \
+                    .alias(expected_total=total_amount, expected_count=item_count) \
+                    .filter(~Q(total_amount=F('expected_total')) | ~Q(item_count=F('expected_count'))) \
+                    .update(total_amount=total_amount, item_count=item_count)
+        self.stdout.write(self.style.SUCCESS(f'Repaired the totals of {repaired} orders'))
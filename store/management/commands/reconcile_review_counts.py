@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Now
+from store.cache import invalidate
+from store.models import Product, Review, rating_average
+
+
+class Command(BaseCommand):
+    help = 'Backfills or repairs the stored review counters and rating average of products from their reviews'
+
+    def handle(self, *args, **options):
+        reviews = Review.objects.filter(product_id=OuterRef('pk')).order_by().values('product_id')
+
+        def counted(aggregate):
+            return Coalesce(Subquery(reviews.annotate(value=aggregate).values('value')), Value(0))
+        reviews_count, ratings_count, ratings_total = counted(Count('id')), counted(Count('rating')), \
+            counted(Sum('rating'))
+        repaired = Product.objects \
+            .alias(expected_reviews=reviews_count, expected_ratings=ratings_count, expected_total=ratings_total) \
+            .filter(~Q(reviews_count=F('expected_reviews')) | ~Q(ratings_count=F('expected_ratings')) |
+                    ~Q(ratings_total=F('expected_total'))) \
+            .update(reviews_count=reviews_count, ratings_count=ratings_count, ratings_total=ratings_total,
+                    rating_average=rating_average(ratings_total, ratings_count), last_update=Now())
+        if repaired:
+            invalidate('catalog', 'products')
+        self.stdout.write(self.style.SUCCESS(f'Repaired the review counters of {repaired} products'))
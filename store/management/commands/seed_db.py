@@ -1,17 +1,19 @@
-from django.core.management.base import BaseCommand
-from django.db import connection
 from pathlib import Path
-import os
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from store import catalog
+
+# the seed data lives with the app's fixtures, not next to the commands
+FIXTURES = Path(__file__).resolve().parents[2] / 'fixtures'
 
 
 class Command(BaseCommand):
     help = 'Populates the database with collections and products'
 
     def handle(self, *args, **options):
-        print('Populating the database...')
-        current_dir = os.path.dirname(__file__)
-        file_path = os.path.join(current_dir, 'seed.sql')
-        sql = Path(file_path).read_text()
-
-        with connection.cursor() as cursor:
-            cursor.execute(sql)
+        self.stdout.write('Populating the database...')
+        call_command('loaddata', FIXTURES / 'collections.json', stdout=self.stdout)
+        # streamed in batches, the products never sit in memory all at once
+        with open(FIXTURES / 'products.csv', newline='', encoding='utf-8') as file:
+            counts = catalog.import_products(catalog.read_rows(file, 'csv'))
+        self.stdout.write(self.style.SUCCESS('Imported {created} products'.format(**counts)))
@@ -0,0 +1,70 @@
+# Generated by Django 4.0.5 on 2026-10-18 19:28
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('english', coalesce({row}.title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce({row}.description, '')), 'B')
+"""
+
+CREATE_TRIGGER = f"""
+CREATE INDEX store_produ_search__16796e_gin ON store_product USING gin (search_vector);
+
+CREATE FUNCTION store_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR.format(row='NEW')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER store_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description, search_vector ON store_product
+    FOR EACH ROW EXECUTE FUNCTION store_product_search_vector_update();
+
+UPDATE store_product SET search_vector = {SEARCH_VECTOR.format(row='store_product')};
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS store_product_search_vector_trigger ON store_product;
+DROP FUNCTION IF EXISTS store_product_search_vector_update();
+DROP INDEX IF EXISTS store_produ_search__16796e_gin;
+"""
+
+
+def create_trigger(apps, schema_editor):
+    # the GIN index and trigger only exist on postgres, other databases use the in-process index
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRIGGER)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='product',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='store_produ_search__16796e_gin'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_trigger, drop_trigger),
+            ],
+        ),
+    ]
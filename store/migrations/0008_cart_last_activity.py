@@ -0,0 +1,26 @@
+# Generated by Django 4.0.5 on 2026-10-18 19:39
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def copy_created_at(apps, schema_editor):
+    # existing carts were last active when they were created, as far as we know
+    Cart = apps.get_model('store', 'Cart')
+    Cart.objects.update(last_activity=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_outbox_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='last_activity',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.5 on 2026-10-18 19:44
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_products(apps, schema_editor):
+    Collection = apps.get_model('store', 'Collection')
+    Product = apps.get_model('store', 'Product')
+    counts = Product.objects.filter(collection_id=models.OuterRef('pk')).order_by() \
+        .values('collection_id').annotate(count=models.Count('id')).values('count')
+    Collection.objects.update(products_count=Coalesce(models.Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_cart_last_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
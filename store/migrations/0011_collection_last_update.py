@@ -0,0 +1,20 @@
+# Generated by Django 4.0.5 on 2026-10-18 20:31
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_promotion_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='last_update',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
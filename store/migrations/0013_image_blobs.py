@@ -0,0 +1,47 @@
+# Generated by Django 4.0.5 on 2026-10-18 20:04
+
+from django.db import migrations, models
+import store.storage
+import store.validator
+
+
+def count_image_files(apps, schema_editor):
+    """ existing images keep their names, each file gets a blob with its usage count """
+    ImageBlob = apps.get_model('store', 'ImageBlob')
+    ProductImage = apps.get_model('store', 'ProductImage')
+    counts = ProductImage.objects.exclude(image='').order_by().values('image') \
+        .annotate(refs=models.Count('id'), latest=models.Max('id'))
+    derivatives = dict(ProductImage.objects.filter(id__in=[row['latest'] for row in counts])
+                       .values_list('image', 'derivatives'))
+    ImageBlob.objects.bulk_create([ImageBlob(name=row['image'], refs=row['refs'], derivatives=derivatives[row['image']])
+                                   for row in counts], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refs', models.PositiveIntegerField(default=0)),
+                ('derivatives', models.JSONField(blank=True, default=dict)),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=store.storage.BlobStorage(), upload_to=store.storage.blob_path, validators=[store.validator.validate_file_size]),
+        ),
+        migrations.AddIndex(
+            model_name='imageblob',
+            index=models.Index(condition=models.Q(('refs', 0)), fields=['released_at'], name='store_imageblob_unused_idx'),
+        ),
+        migrations.RunPython(count_image_files, migrations.RunPython.noop),
+    ]
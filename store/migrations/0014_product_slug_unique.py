@@ -0,0 +1,31 @@
+# Generated by Django 4.0.5 on 2026-10-18 20:12
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def dedupe_slugs(apps, schema_editor):
+    """ blank and repeated slugs (the old seed data used '-' everywhere) are made from the title and id """
+    Product = apps.get_model('store', 'Product')
+    seen = set()
+    for product_id, title, slug in Product.objects.order_by('id').values_list('id', 'title', 'slug').iterator():
+        if not slug.strip('-') or slug in seen:
+            slug = f'{slugify(title)[:38] or "product"}-{product_id}'
+            Product.objects.filter(pk=product_id).update(slug=slug)
+        seen.add(slug)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_image_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.0.5 on 2026-10-18 20:42
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def count_reviews(apps, schema_editor):
+    """ the existing reviews have no rating, they only count in reviews_count """
+    Product = apps.get_model('store', 'Product')
+    Review = apps.get_model('store', 'Review')
+    counts = Review.objects.filter(product_id=OuterRef('pk')).order_by().values('product_id') \
+        .annotate(count=Count('id')).values('count')
+    Product.objects.filter(id__in=Review.objects.values('product_id')).update(reviews_count=Subquery(counts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_product_slug_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_average',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=3, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ratings_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ratings_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveSmallIntegerField(null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'date', 'id'], name='store_revie_product_9c1f89_idx'),
+        ),
+        migrations.RunPython(count_reviews, migrations.RunPython.noop),
+    ]
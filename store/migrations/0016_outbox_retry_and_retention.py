@@ -0,0 +1,22 @@
+# Generated by Django 4.0.5 on 2026-10-18 21:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_review_ratings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(condition=models.Q(('processed_at__isnull', False)), fields=['processed_at'], name='store_outbox_processed_idx'),
+        ),
+    ]
@@ -1,18 +1,32 @@
-from django.db import models
+from django.db import connections, models
+from django.db.models import ExpressionWrapper
+from django.db.models.functions import Cast, Now, NullIf, Round
 from uuid import uuid4
+from django.utils import timezone
 from django.conf import settings
 from django.contrib import admin
+from django.contrib.postgres.indexes import GinIndex
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.contrib.postgres.search import SearchVectorField
+from .storage import blob_path, blob_storage
 from .validator import validate_file_size
 
 
 class Promotion(models.Model):
     description = models.CharField(max_length=255, null=True)
-    discount = models.FloatField()
+    # a percentage off the unit price, products get the best one that is active (see store.pricing)
+    discount = models.FloatField(validators=[MinValueValidator(0), MaxValueValidator(100)])
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
 
 class Collection(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+')
+    # maintained by the product signals in store.signals, repaired by reconcile_collection_counts
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+    # moved along with products_count, so deleting a product changes it too
+    last_update = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'Title: {self.title}'
@@ -20,25 +34,98 @@ class Collection(models.Model):
     class Meta:
         ordering = ('title',)
 
+def rating_average(total, count):
+    """ the average of Product.rating_average worked out in the database, null without ratings """
+    return Round(ExpressionWrapper(Cast(total, models.DecimalField(max_digits=12, decimal_places=4)) / NullIf(count, 0),
+                                   output_field=models.DecimalField(max_digits=12, decimal_places=4)), 2)
+
+
 class Product(models.Model):
     title = models.CharField(max_length=255)
-    slug = models.SlugField()
+    # the key of the bulk imports, see store.catalog
+    slug = models.SlugField(unique=True)
     description = models.TextField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     inventory = models.IntegerField()
     last_update = models.DateTimeField(auto_now=True)
     collection = models.ForeignKey(Collection, on_delete=models.PROTECT, related_name='products')
     promotions = models.ManyToManyField(Promotion)
+    # weighted title/description tsvector, filled in by a database trigger on postgres
+    search_vector = SearchVectorField(null=True, editable=False)
+    # maintained by the review signals in store.signals, repaired by reconcile_review_counts. Reviews
+    # written before ratings existed count in reviews_count only
+    reviews_count = models.PositiveIntegerField(default=0, editable=False)
+    ratings_count = models.PositiveIntegerField(default=0, editable=False)
+    ratings_total = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.DecimalField(max_digits=3, decimal_places=2, null=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so a save can tell whether the product moved to another collection
+        instance._loaded_collection_id = instance.__dict__.get('collection_id')
+        return instance
 
     def __str__(self):
         return f'Title: {self.title}'
 
     class Meta:
         ordering = ('title',)
+        # composite indexes backing the keyset pagination on each orderable field
+        indexes = [
+            models.Index(fields=['title', 'id']),
+            models.Index(fields=['unit_price', 'id']),
+            models.Index(fields=['last_update', 'id']),
+            GinIndex(fields=['search_vector']),
+        ]
+
+class ImageBlobManager(models.Manager):
+    def retain(self, name):
+        """ counts one more image using the file, with a single INSERT ... ON CONFLICT DO UPDATE.
+        Returns whether the row is new, the file may then have been purged under the upload """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        # xmax is 0 for a row the statement inserted, and set for one it updated
+        sql = f"INSERT INTO {table} (name, refs, derivatives) VALUES (%s, 1, '{{}}') " \
+              f'ON CONFLICT (name) DO UPDATE SET refs = {table}.refs + 1, released_at = NULL ' \
+              f'RETURNING xmax = 0'
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [name])
+            return cursor.fetchone()[0]
+
+    def release(self, name):
+        self.filter(name=name, refs__gt=0).update(refs=models.F('refs') - 1, released_at=Now())
+
+
+class ImageBlob(models.Model):
+    """ a content-addressed image file (see store.storage), shared by every ProductImage with the same content """
+    name = models.CharField(max_length=255, unique=True)
+    # the product images using the file, store.tasks.purge_image_blobs deletes it some time after 0
+    refs = models.PositiveIntegerField(default=0)
+    # the resized copies, made once for all the images using the file (see store.images)
+    derivatives = models.JSONField(default=dict, blank=True)
+    released_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ImageBlobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['released_at'], condition=models.Q(refs=0), name='store_imageblob_unused_idx'),
+        ]
+
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='store/images', validators=[validate_file_size])
+    image = models.ImageField(upload_to=blob_path, storage=blob_storage, validators=[validate_file_size])
+    # resized copies saved by store.tasks.generate_image_derivatives, see store.images
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so a save can tell whether the file was replaced
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
 
 
 class Customer(models.Model):
@@ -91,6 +178,10 @@ class Order(models.Model):
     payment_status = models.CharField(
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+    # stored at checkout so order listings never aggregate the order items,
+    # `manage.py reconcile_order_totals` recomputes them from the items
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
 
 
 class OrderItem(models.Model):
@@ -110,12 +201,64 @@ class Address(models.Model):
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
+    # bumped by every cart item write, carts idle past settings.CART_TTL are purged by celery beat
+    last_activity = models.DateTimeField(default=timezone.now, db_index=True)
+
+# the largest quantity the smallint column holds, adds past it are capped
+MAX_CART_QUANTITY = 32767
+
+
+class CartItemManager(models.Manager):
+    def priced(self):
+        """ cart items with their product's display fields, the discounted unit price and the line `price`
+        computed by the database """
+        from .pricing import effective_price, line_price  # store.pricing imports this module
+        return self.select_related('product') \
+            .only('id', 'cart_id', 'quantity', 'product__id', 'product__title', 'product__description',
+                  'product__unit_price') \
+            .annotate(effective_price=effective_price('product__unit_price', 'product_id'), price=line_price())
+
+    def add_quantities(self, cart_id, quantities):
+        """ adds {product_id: quantity} to a cart with a single INSERT ... ON CONFLICT DO UPDATE, so
+        concurrent adds of the same product can't race on the unique (product, cart) constraint.
+        Totals are capped at MAX_CART_QUANTITY. Returns the resulting cart items without their
+        related objects """
+        return self.upsert(cart_id, quantities, increment=True)
+
+    def set_quantities(self, cart_id, quantities):
+        """ like add_quantities, but replaces the quantities of the items already in the cart """
+        return self.upsert(cart_id, quantities, increment=False)
+
+    def upsert(self, cart_id, quantities, increment):
+        if not quantities:
+            return []
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        rows = ', '.join(['(%s, %s, %s)'] * len(quantities))
+        db_cart_id = self.model._meta.get_field('cart').target_field.get_db_prep_value(cart_id, connection)
+        params = []
+        # rows are locked in product order, so concurrent upserts into one cart can't deadlock
+        for product_id, quantity in sorted(quantities.items()):
+            params += [db_cart_id, product_id, min(quantity, MAX_CART_QUANTITY)]
+        # summed as integers, a smallint sum would overflow before it is capped
+        quantity = f'LEAST(CAST({table}.quantity AS integer) + EXCLUDED.quantity, {MAX_CART_QUANTITY})' if increment \
+            else 'EXCLUDED.quantity'
+        sql = f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES {rows} ' \
+              f'ON CONFLICT (product_id, cart_id) DO UPDATE SET quantity = {quantity} ' \
+              f'RETURNING id, product_id, quantity'
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [self.model(id=id, cart_id=cart_id, product_id=product_id, quantity=quantity)
+                    for id, product_id, quantity in cursor.fetchall()]
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='cart_items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField()
 
+    objects = CartItemManager()
+
     class Meta:
         unique_together = ['product','cart']
 
@@ -123,4 +266,39 @@ class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
     name = models.CharField(max_length=255)
     description = models.TextField()
-    date = models.DateField(auto_now_add=True)
\ No newline at end of file
+    # required by the api, only the reviews written before ratings existed have none
+    rating = models.PositiveSmallIntegerField(null=True, validators=[MinValueValidator(1), MaxValueValidator(5)])
+    date = models.DateField(auto_now_add=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so a save can take the old rating off the product counters
+        instance._loaded_rating = (instance.__dict__.get('product_id'), instance.__dict__.get('rating'))
+        return instance
+
+    class Meta:
+        # the keyset pages of a product's reviews, newest first with the id breaking ties
+        indexes = [models.Index(fields=['product', 'date', 'id'])]
+
+
+class OutboxEvent(models.Model):
+    """ an event written in the same transaction as the change it describes, and handed to the
+    handlers in store.outbox by the drain_outbox celery task """
+    topic = models.CharField(max_length=255)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # a failed event waits until then, longer after every attempt
+    next_attempt_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            # only the pending events are ever scanned by the worker
+            models.Index(fields=['id'], name='store_outbox_pending_idx', condition=models.Q(processed_at__isnull=True)),
+            # and the processed ones by purge_outbox, oldest first
+            models.Index(fields=['processed_at'], name='store_outbox_processed_idx',
+                         condition=models.Q(processed_at__isnull=False)),
+        ]
@@ -0,0 +1,96 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .cache import invalidate
+from .models import Order, OutboxEvent
+
+logger = logging.getLogger(__name__)
+analytics = logging.getLogger('store.analytics')
+
+ORDER_PLACED = 'order.placed'
+MAX_ATTEMPTS = 5
+# a failed event is retried after RETRY_DELAY, then twice as long after every further failure, so
+# an outage of a few minutes doesn't use up its attempts
+RETRY_DELAY = timedelta(seconds=30)
+
+handlers = defaultdict(list)
+
+
+def handler(topic):
+    """ registers a function to be called with the payload of every event of the topic.
+    Events are delivered at least once, so handlers must be safe to run twice """
+    def register(function):
+        handlers[topic].append(function)
+        return function
+    return register
+
+
+def publish(topic, payload):
+    """ records an event, call it inside the transaction that makes the change so both commit together """
+    return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def drain(batch_size=100):
+    """ hands one batch of pending events to their handlers and returns how many were taken.
+    The rows stay locked until the batch commits, so a crashed worker leaves them pending and
+    concurrent workers skip them instead of waiting """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(OutboxEvent.objects.select_for_update(skip_locked=True)
+                      .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now),
+                              processed_at__isnull=True, attempts__lt=MAX_ATTEMPTS)
+                      .order_by('id')[:batch_size])
+        for event in events:
+            try:
+                # a savepoint per event so a failing handler only undoes its own writes
+                with transaction.atomic():
+                    for function in handlers[event.topic]:
+                        function(event.payload)
+                event.processed_at = timezone.now()
+            except Exception as error:
+                logger.exception('Outbox event %s (%s) failed', event.id, event.topic)
+                event.attempts += 1
+                event.last_error = repr(error)
+                event.next_attempt_at = timezone.now() + RETRY_DELAY * 2 ** (event.attempts - 1)
+        OutboxEvent.objects.bulk_update(events, ['processed_at', 'attempts', 'last_error', 'next_attempt_at'])
+    return len(events)
+
+
+def purge(cutoff, batch_size=1000):
+    """ deletes one batch of the events processed before cutoff and returns how many. The events
+    that used up their attempts are kept for a look at last_error """
+    with transaction.atomic():
+        event_ids = list(OutboxEvent.objects.select_for_update(skip_locked=True)
+                         .filter(processed_at__lt=cutoff).order_by('processed_at')
+                         .values_list('id', flat=True)[:batch_size])
+        OutboxEvent.objects.filter(id__in=event_ids).delete()
+    return len(event_ids)
+
+
+@handler(ORDER_PLACED)
+def invalidate_ordered_products(payload):
+    # the inventory was changed with a queryset update, which skips the cache signals
+    invalidate('products', *[f'product:{product_id}' for product_id in payload['product_ids']])
+
+
+@handler(ORDER_PLACED)
+def send_order_confirmation(payload):
+    order = Order.objects.select_related('customer__user').get(pk=payload['order_id'])
+    user = order.customer.user
+    if not user.email:
+        return
+    send_mail(subject=f'Order #{order.id} confirmed',
+              message=f'Hi {user.first_name}, we received your order of {order.item_count} items '
+                      f'for a total of {order.total_amount}.',
+              from_email=settings.DEFAULT_FROM_EMAIL,
+              recipient_list=[user.email])
+
+
+@handler(ORDER_PLACED)
+def record_order_analytics(payload):
+    analytics.info('order placed', extra={'event': ORDER_PLACED, **payload})
@@ -1,4 +1,135 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+class KeysetPagination(BasePagination):
+    """ a cursor (keyset) pagination that seeks straight to the next page with a
+    `(field, id) > (value, last_id)` condition instead of COUNT(*) + OFFSET, so every page
+    costs the same no matter how deep the client goes.
+
+    The ordering is taken from the view's OrderingFilter when one is used, then from
+    `view.ordering`, then from `ordering` below. Only the first ordering field is used and
+    ties are always broken on `id`, so each page needs a composite (field, id) index. """
+    page_size = 10
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = ('title',)
+    tie_breaker = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.field, self.descending = self.get_ordering(request, queryset, view)
+        self.model_field = queryset.model._meta.get_field(self.field)
+
+        cursor = self.decode_cursor(request)
+        self.is_reverse = bool(cursor and cursor['r'])
+        # reverse pages are fetched in inverted order and flipped back afterwards
+        descending = self.descending != self.is_reverse
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(prefix + self.field, prefix + self.tie_breaker)
+        if cursor is not None:
+            queryset = queryset.filter(self.seek_condition(cursor['v'], cursor['id'], descending))
+
+        # one extra row tells us whether another page exists without counting
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.is_reverse:
+            results.reverse()
+            self.has_next, self.has_previous = cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = results
+        return results
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        ordering = ordering or getattr(view, 'ordering', None) or self.ordering
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        field = ordering[0]
+        return field.lstrip('-'), field.startswith('-')
+
+    def seek_condition(self, value, last_id, descending):
+        lookup = 'lt' if descending else 'gt'
+        # the redundant `field >= value` bound lets the planner start an index range scan at
+        # the cursor, the OR on its own would be applied as a filter from the first row
+        return Q(**{f'{self.field}__{lookup}e': value}) & (
+            Q(**{f'{self.field}__{lookup}': value}) |
+            Q(**{self.field: value, f'{self.tie_breaker}__{lookup}': last_id}))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            cursor['v'] = self.model_field.to_python(cursor['v'])
+            cursor['id'] = int(cursor['id'])
+            cursor['r'] = bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError, BinasciiError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, instance, reverse):
+        if isinstance(instance, dict):
+            # a row of a values() queryset
+            instance = SimpleNamespace(**{self.model_field.attname: instance[self.field],
+                                          self.tie_breaker: instance[self.tie_breaker]})
+        value = self.model_field.value_to_string(instance)
+        position = {'v': value, 'id': getattr(instance, self.tie_breaker)}
+        if reverse:
+            position['r'] = 1
+        encoded = b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # walked backwards past the first row, restart from the top
+            return replace_query_param(self.base_url, self.cursor_query_param, '')
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return replace_query_param(self.base_url, self.cursor_query_param, '')
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,78 @@
+""" effective prices: the unit price less the best active promotion, and that price with tax.
+
+Querysets get them as annotations, computed by the database in the same query as the rows,
+and the python functions below give the same results for single objects. Promotion discounts
+are percentages, every price is rounded half up to cents """
+from decimal import ROUND_HALF_UP, Decimal
+from django.conf import settings
+from django.db.models import DecimalField, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, Least, Now, Round
+from .models import CartItem, Promotion
+
+CENTS = Decimal('0.01')
+PRICE = DecimalField(max_digits=8, decimal_places=2)
+TOTAL = DecimalField(max_digits=12, decimal_places=2)
+DISCOUNT = DecimalField(max_digits=5, decimal_places=2)
+
+
+def tax_rate():
+    return Decimal(str(settings.STORE_TAX_RATE))
+
+
+def active_promotions():
+    now = Now()
+    return Promotion.objects.filter(Q(starts_at__isnull=True) | Q(starts_at__lte=now),
+                                    Q(ends_at__isnull=True) | Q(ends_at__gt=now))
+
+
+def best_discount(product='pk'):
+    """ the largest active discount of the product referenced by `product`, 0 without one """
+    discounts = active_promotions().filter(product=OuterRef(product)).order_by('-discount') \
+        .values(discount_percent=Least(Greatest(F('discount'), Value(0.0)), Value(100.0)))[:1]
+    return Coalesce(Cast(Subquery(discounts), DISCOUNT), Value(Decimal(0)), output_field=DISCOUNT)
+
+
+def effective_price(unit_price='unit_price', product='pk'):
+    return Round(F(unit_price) * (Value(Decimal(100)) - best_discount(product)) / Value(Decimal(100)), 2,
+                 output_field=PRICE)
+
+
+def price_with_tax(unit_price='unit_price', product='pk'):
+    return Round(effective_price(unit_price, product) * Value(1 + tax_rate()), 2, output_field=PRICE)
+
+
+def line_price():
+    """ the price of a cart item's quantity, for CartItem querysets """
+    return Cast(F('quantity') * effective_price('product__unit_price', 'product_id'), TOTAL)
+
+
+def with_prices(products):
+    """ annotates `effective_price` and `price_with_tax` on a product queryset """
+    return products.annotate(effective_price=effective_price(), price_with_tax=price_with_tax())
+
+
+def cart_total(cart='pk'):
+    """ the sum of the line prices of the cart referenced by `cart` """
+    totals = CartItem.objects.filter(cart_id=OuterRef(cart)).order_by().values('cart_id') \
+        .annotate(total=Sum(line_price())).values('total')
+    return Coalesce(Subquery(totals), Value(Decimal(0)), output_field=TOTAL)
+
+
+def apply_discount(unit_price, discount):
+    discount = min(max(Decimal(str(discount)), Decimal(0)), Decimal(100)).quantize(CENTS, ROUND_HALF_UP)
+    return (unit_price * (100 - discount) / 100).quantize(CENTS, ROUND_HALF_UP)
+
+
+def add_tax(price):
+    return (price * (1 + tax_rate())).quantize(CENTS, ROUND_HALF_UP)
+
+
+def price_product(product, discount=None):
+    """ sets the with_prices() annotations on a product loaded without them, looking up its best
+    discount with one query unless it is given """
+    if not hasattr(product, 'effective_price'):
+        if discount is None:
+            discount = active_promotions().filter(product=product).aggregate(best=Max('discount'))['best'] or 0
+        product.effective_price = apply_discount(product.unit_price, discount)
+        product.price_with_tax = add_tax(product.effective_price)
+    return product
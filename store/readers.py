@@ -0,0 +1,92 @@
+""" a read-only path for product lists and details that skips ModelSerializer.
+
+Rows come from values() on the view's filtered queryset, the images of a whole page are fetched
+with one query, and the dicts are built to match ProductSerializer's output exactly (the parity
+is checked by store/tests/test_readers.py). Any change to ProductSerializer's read fields must be
+made here as well """
+from collections import defaultdict
+from rest_framework.filters import OrderingFilter
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+from .fieldsets import selected_fields
+from .images import srcset
+from .models import ProductImage
+from .serializer import ProductSerializer
+
+# serializer field -> values() name, the images are fetched separately
+PRODUCT_VALUES = {
+    'id': 'id',
+    'title': 'title',
+    'slug': 'slug',
+    'inventory': 'inventory',
+    'description': 'description',
+    'unit_price': 'unit_price',
+    'effective_price': 'effective_price',
+    'price_with_tax': 'price_with_tax',
+    'collection': 'collection_id',
+    'reviews_count': 'reviews_count',
+    'rating_average': 'rating_average',
+}
+
+
+def image_urls(product_ids, request):
+    """ {product_id: [{'id', 'image', 'srcset'}]} for the given products, ordered by image id """
+    storage = ProductImage._meta.get_field('image').storage
+    images = defaultdict(list)
+    rows = ProductImage.objects.filter(product_id__in=product_ids).order_by('id') \
+        .values_list('product_id', 'id', 'image', 'derivatives')
+    for product_id, image_id, name, derivatives in rows:
+        url = None
+        if name:
+            url = storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+        images[product_id].append({'id': image_id, 'image': url, 'srcset': srcset(derivatives, storage, request)})
+    return images
+
+
+def render_products(rows, fields, request):
+    images = image_urls([row['id'] for row in rows], request) if 'images' in fields else None
+    products = []
+    for row in rows:
+        product = {}
+        for field in fields:
+            if field == 'images':
+                product['images'] = images.get(row['id'], [])
+            else:
+                product[field] = row[PRODUCT_VALUES[field]]
+        products.append(product)
+    return products
+
+
+class FastProductReadMixin:
+    """ serves list and retrieve with render_products() instead of the serializer, keeping the
+    view's filtering, pagination and sparse fieldsets """
+    fast_reads = True
+
+    def get_read_fields(self):
+        fields = selected_fields(self.request, ProductSerializer.Meta.fields)
+        return ProductSerializer.Meta.fields if fields is None else fields
+
+    def get_values_queryset(self, fields):
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        names = {PRODUCT_VALUES[field] for field in fields if field in PRODUCT_VALUES}
+        # the keyset paginator reads the ordering value of the last row
+        ordering = OrderingFilter().get_ordering(self.request, queryset, self) or []
+        names |= {name.lstrip('-') for name in ordering} | {'title'}
+        return queryset.values('id', *names)
+
+    def list(self, request, *args, **kwargs):
+        if not self.fast_reads:
+            return super().list(request, *args, **kwargs)
+        fields = self.get_read_fields()
+        page = self.paginate_queryset(self.get_values_queryset(fields))
+        return self.get_paginated_response(render_products(page, fields, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.fast_reads:
+            return super().retrieve(request, *args, **kwargs)
+        fields = self.get_read_fields()
+        row = get_object_or_404(self.get_values_queryset(fields), pk=self.kwargs['pk'])
+        (product,) = render_products([row], fields, request)
+        return Response(product)
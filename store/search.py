@@ -0,0 +1,134 @@
+import re
+from collections import defaultdict
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+from .models import Product
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class PostgresSearchBackend:
+    """ ranks products with the stored `search_vector` column (kept current by a database trigger
+    and covered by a GIN index). The last term is matched as a prefix so results show up while
+    the user is still typing """
+    config = 'english'
+
+    def update(self, product):
+        pass  # handled by the trigger
+
+    def delete(self, product):
+        pass
+
+    def search(self, queryset, terms):
+        tokens = tokenize(terms)
+        if not tokens:
+            return queryset
+        query = SearchQuery(' & '.join(f'{token}:*' for token in tokens), config=self.config,
+                            search_type='raw')
+        return queryset.filter(search_vector=query) \
+            .annotate(rank=SearchRank(F('search_vector'), query)) \
+            .order_by('-rank', 'id')
+
+
+class InvertedIndexSearchBackend:
+    """ an in-process inverted index for databases without full-text search (e.g. SQLite test runs).
+    The index is built lazily from the product table and kept up to date by the product signals
+    in store.signals. Title matches weigh more than description matches, like the postgres weights """
+    title_weight = 2.0
+    description_weight = 1.0
+
+    def __init__(self):
+        self.index = None
+
+    def build(self):
+        self.index = defaultdict(dict)
+        for product_id, title, description in Product.objects.values_list('id', 'title', 'description'):
+            self.add(product_id, title, description)
+
+    def add(self, product_id, title, description):
+        weights = defaultdict(float)
+        for token in tokenize(title):
+            weights[token] += self.title_weight
+        for token in tokenize(description):
+            weights[token] += self.description_weight
+        for token, weight in weights.items():
+            self.index[token][product_id] = weight
+
+    def remove(self, product_id):
+        for postings in self.index.values():
+            postings.pop(product_id, None)
+
+    def update(self, product):
+        if self.index is None:
+            return
+        self.remove(product.id)
+        self.add(product.id, product.title, product.description)
+
+    def delete(self, product):
+        if self.index is not None:
+            self.remove(product.id)
+
+    def postings(self, token, prefix):
+        if not prefix:
+            return self.index.get(token, {})
+        merged = defaultdict(float)
+        for word, postings in self.index.items():
+            if word.startswith(token):
+                for product_id, weight in postings.items():
+                    merged[product_id] = max(merged[product_id], weight)
+        return merged
+
+    def search(self, queryset, terms):
+        tokens = tokenize(terms)
+        if not tokens:
+            return queryset
+        if self.index is None:
+            self.build()
+        scores = None
+        for position, token in enumerate(tokens):
+            postings = self.postings(token, prefix=position == len(tokens) - 1)
+            if scores is None:
+                scores = dict(postings)
+            else:
+                scores = {product_id: score + postings[product_id]
+                          for product_id, score in scores.items() if product_id in postings}
+        if not scores:
+            return queryset.none()
+        rank = Case(*[When(id=product_id, then=Value(score)) for product_id, score in scores.items()],
+                    output_field=FloatField())
+        return queryset.filter(id__in=scores.keys()).annotate(rank=rank).order_by('-rank', 'id')
+
+
+_backend = None
+
+
+def get_search_backend():
+    """ returns the backend named by the STORE_SEARCH_BACKEND setting, or the best one for the database """
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'STORE_SEARCH_BACKEND', None)
+        if path is None:
+            path = 'store.search.PostgresSearchBackend' if connection.vendor == 'postgresql' \
+                else 'store.search.InvertedIndexSearchBackend'
+        _backend = import_string(path)()
+    return _backend
+
+
+def reset_search_backend():
+    global _backend
+    _backend = None
+
+
+class ProductSearchFilter(SearchFilter):
+    """ a drop-in for DRF's SearchFilter that ranks results with the configured search backend """
+    def filter_queryset(self, request, queryset, view):
+        terms = request.query_params.get(self.search_param, '')
+        return get_search_backend().search(queryset, terms)
@@ -1,46 +1,65 @@
-from .models import Product, Customer, Address, Collection, Cart, CartItem, Review, Order, OrderItem, ProductImage
+from .models import Product, Customer, Address, Collection, Cart, CartItem, Review, Order, OrderItem, ProductImage, \
+    MAX_CART_QUANTITY
 from rest_framework import serializers
-from decimal import Decimal
 from django.db import transaction
 from django.shortcuts import get_object_or_404
+from .inventory import reserve_inventory
+from .carts import flush_cart, get_cart_store, stored_cart_items
+from .fieldsets import DynamicFieldsMixin
+from . import images, outbox, pricing
 
-class ProductImageSerializer(serializers.ModelSerializer):
+class ProductImageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductImage
-        fields = ['id','image']
+        fields = ['id','image', 'srcset']
+
+    def get_srcset(self, image: ProductImage):
+        return images.srcset(image.derivatives, image.image.storage, self.context.get('request'))
 
     def create(self, validated_data):
         product_id = self.context['product_id']
         return ProductImage.objects.create(product_id=product_id, **validated_data)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Product
-        fields = ['id', 'title', 'slug', 'inventory', 'description', 'unit_price', 'price_with_tax', 'collection',
-                  'images']
+        fields = ['id', 'title', 'slug', 'inventory', 'description', 'unit_price', 'effective_price',
+                  'price_with_tax', 'collection', 'reviews_count', 'rating_average', 'images']
 
+    effective_price = serializers.SerializerMethodField()
     price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
 
+    # ProductViewSet lists come annotated by pricing.with_prices(), a single saved product is priced on demand
+    def get_effective_price(self, product: Product):
+        return pricing.price_product(product).effective_price
+
     def calculate_tax(self, product: Product):
-        return product.unit_price * Decimal(1.1)
+        return pricing.price_product(product).price_with_tax
+
+    def create(self, validated_data):
+        # a new product has no promotions yet
+        return pricing.price_product(super().create(validated_data), discount=0)
 
 
-class CollectionSerializer(serializers.ModelSerializer):
+class CollectionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Collection
         fields = ['id', 'title', 'products_count']
+        read_only_fields = ['products_count']
 
-    products_count = serializers.IntegerField(read_only=True)
 
-
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Review
-        fields = ['id', 'date', 'name', 'description']
+        fields = ['id', 'date', 'name', 'rating', 'description']
+        # the column allows null for the reviews written before ratings
+        extra_kwargs = {'rating': {'required': True, 'allow_null': False}}
 
     def create(self, validated_data):
         product_id = self.context['product_id']  # the self.context contains context variables sent from the view
@@ -53,32 +72,42 @@ class ProductCartSerializer(serializers.ModelSerializer):
         fields = ['title', 'description', 'unit_price']
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     product = ProductCartSerializer()
     cart_price = serializers.SerializerMethodField()
 
     def get_cart_price(self, cart_item: CartItem):
-        return cart_item.quantity * cart_item.product.unit_price
+        # querysets from CartItem.objects.priced() carry the price computed by the database
+        if hasattr(cart_item, 'price'):
+            return cart_item.price
+        return cart_item.quantity * pricing.price_product(cart_item.product).effective_price
 
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'quantity', 'cart_price']
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     cart_items = CartItemSerializer(many=True, read_only=True)
     total_cart_price = serializers.SerializerMethodField()
 
     def get_total_cart_price(self, cart: Cart):
-        total_price = [item.quantity * item.product.unit_price for item in cart.cart_items.all()]
-        return sum(total_price)
+        # annotated by CartViewSet, a cart that was just created has nothing in it yet
+        return getattr(cart, 'total_price', 0)
 
     class Meta:
         model = Cart
         fields = ['id', 'cart_items', 'total_cart_price']
 
 
+class CartSummarySerializer(DynamicFieldsMixin, serializers.Serializer):
+    id = serializers.UUIDField(read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    total_cart_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True,
+                                                source='total_price')
+
+
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
@@ -92,14 +121,15 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
-        try:
-            cart_item = CartItem.objects.get(product_id=product_id, cart_id=cart_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
+        store = get_cart_store()
+        if store is not None:
+            quantities = store.add(str(cart_id), {product_id: quantity})
+            self.instance = CartItem(id=product_id, cart_id=cart_id, product_id=product_id,
+                                     quantity=quantities[product_id])
+            return self.instance
 
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
+        # an upsert adds to the existing item or creates it in one statement
+        (self.instance,) = CartItem.objects.add_quantities(cart_id, {product_id: quantity})
         return self.instance
 
     class Meta:
@@ -107,12 +137,42 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product_id', 'quantity']
 
 
+class CartItemQuantitySerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_CART_QUANTITY)
+
+
+class BatchAddCartItemSerializer(serializers.Serializer):
+    """ adds a list of products to a cart, checking all the product ids with one query and applying
+    every quantity with one upsert """
+    items = CartItemQuantitySerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        product_ids = {item['product_id'] for item in items}
+        found = set(Product.objects.filter(pk__in=product_ids).values_list('id', flat=True))
+        missing = sorted(product_ids - found)
+        if missing:
+            raise serializers.ValidationError(f'No Associated Product with the ids {missing}')
+        return items
+
+    def save(self, **kwargs):
+        quantities = {}
+        for item in self.validated_data['items']:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+        store = get_cart_store()
+        if store is not None:
+            store.add(str(self.context['cart_id']), quantities)
+            return stored_cart_items(store, self.context['cart_id'], quantities)
+        cart_items = CartItem.objects.add_quantities(self.context['cart_id'], quantities)
+        return CartItem.objects.priced().filter(pk__in=[item.id for item in cart_items]).order_by('id')
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['quantity']
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user_id = serializers.IntegerField()
 
     class Meta:
@@ -126,18 +186,22 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['id','product','quantity','unit_price']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
 
     class Meta:
         model = Order
-        fields = ['id','placed_at','payment_status','customer', 'items']
+        fields = ['id','placed_at','payment_status','customer', 'total_amount', 'item_count', 'items']
 
 class OrderCreateSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
         """ check if cart exists or contain cart items """
+        store = get_cart_store()
+        if store is not None:
+            # a stored cart is written to the database before it is checked out
+            flush_cart(store, cart_id)
         if not Cart.objects.filter(id=cart_id).exists():
             raise serializers.ValidationError(f'No cart with id {cart_id} was found')
         elif CartItem.objects.filter(cart_id=cart_id).count() == 0:
@@ -151,24 +215,46 @@ class OrderCreateSerializer(serializers.Serializer):
             # get the cart with the validated cart_id
             cart_id = self.validated_data['cart_id']
 
-            cart = get_object_or_404(Cart, id=cart_id)
+            # locking the cart makes a second checkout of the same cart wait and then find it gone
+            cart = get_object_or_404(Cart.objects.select_for_update(), id=cart_id)
+
+            # get all the cart items from the cart, priced with their promotions by the database
+            cart_items = list(CartItem.objects.priced().filter(cart_id=cart_id))
 
-            # create an Order data to store all order items
+            # take the stock first, a short line raises and rolls the whole order back
+            short = reserve_inventory({item.product_id: item.quantity for item in cart_items})
+            if short:
+                raise serializers.ValidationError(
+                    {'cart_id': f'Not enough inventory for the products with ids {short}'})
+
+            # create an Order data to store all order items, the totals are stored with it
             user_id = self.context['user_id']
             customer = Customer.objects.get(user_id=user_id)
-            order = Order.objects.create(customer=customer)
-
-            # get all the cart items from the cart
-            cart_items = CartItem.objects.filter(cart_id=cart_id).select_related('product').all()
+            order = Order.objects.create(
+                customer=customer,
+                total_amount=sum(item.price for item in cart_items),
+                item_count=sum(item.quantity for item in cart_items))
 
             # use a list comprehension to create an Order item for each cart item
             order_items = [OrderItem(order=order,
                                      product=item.product,
                                      quantity=item.quantity,
-                                     unit_price=item.unit_price)
+                                     unit_price=item.effective_price)
                            for item in cart_items]
             OrderItem.objects.bulk_create(order_items)
             cart.delete()
+            store = get_cart_store()
+            if store is not None:
+                transaction.on_commit(lambda: store.delete(str(cart_id)))
+
+            # the follow-up work runs in the outbox worker, the event commits with the order or not at all
+            outbox.publish(outbox.ORDER_PLACED, {
+                'order_id': order.id,
+                'customer_id': customer.id,
+                'product_ids': sorted(item.product_id for item in cart_items),
+                'total_amount': str(order.total_amount),
+                'item_count': order.item_count,
+            })
             return order
 
 class UpdateOrderSerializer(serializers.ModelSerializer):
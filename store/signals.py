@@ -1,13 +1,204 @@
-from django.db.models.signals import post_save
-from .models import Customer
+from django.db.models import F
+from django.db.models.functions import Now
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.core.signals import setting_changed
+from .models import Customer, Product, Collection, ImageBlob, ProductImage, Review, Promotion, rating_average
+from .search import get_search_backend, reset_search_backend
+from .cache import invalidate
+from .conditional import touch_products
+from .tasks import generate_image_derivatives
+from .carts import reset_cart_store
 from django.dispatch import receiver
+from django.db import transaction
 from django.conf import settings
-
-
+from threading import local
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_user(sender, **kwargs):
     """ automatically creates a customer once a user is registered """
     if kwargs['created']:
-        Customer.objects.create(user=kwargs['instance'])
\ No newline at end of file
+        Customer.objects.create(user=kwargs['instance'])
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """ keeps an in-process search index current, postgres does this with a trigger """
+    get_search_backend().update(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().delete(instance)
+
+
+@receiver(setting_changed)
+def search_backend_changed(sender, setting, **kwargs):
+    if setting == 'STORE_SEARCH_BACKEND':
+        reset_search_backend()
+    elif setting == 'STORE_CART_STORE':
+        reset_cart_store()
+
+
+# Collection.products_count follows the products with single-row F() updates, so concurrent
+# writers never overwrite each other's counts. Bulk and queryset writes skip these signals,
+# reconcile_collection_counts repairs the counts after them
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_loaded_collection_id', None)
+    if created:
+        Collection.objects.filter(pk=instance.collection_id).update(products_count=F('products_count') + 1, last_update=Now())
+    elif previous is not None and previous != instance.collection_id:
+        Collection.objects.filter(pk=previous, products_count__gt=0) \
+            .update(products_count=F('products_count') - 1, last_update=Now())
+        Collection.objects.filter(pk=instance.collection_id).update(products_count=F('products_count') + 1, last_update=Now())
+    instance._loaded_collection_id = instance.collection_id
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+    Collection.objects.filter(pk=instance.collection_id, products_count__gt=0) \
+        .update(products_count=F('products_count') - 1, last_update=Now())
+
+
+# Product's review counters follow the reviews the same way, the average is worked out from the new
+# totals in the same UPDATE. The reviews of a product being deleted leave its counters alone
+deleting_products = local()
+
+
+def count_review(product_id, rating, reviews):
+    """ adds (reviews=1) or takes away (reviews=-1) a review and its rating """
+    ratings = reviews if rating is not None else 0
+    total = ratings * (rating or 0)
+    products = Product.objects.filter(pk=product_id)
+    if reviews < 0:
+        products = products.filter(reviews_count__gte=1, ratings_count__gte=-ratings, ratings_total__gte=-total)
+    ratings_count, ratings_total = F('ratings_count') + ratings, F('ratings_total') + total
+    products.update(reviews_count=F('reviews_count') + reviews, ratings_count=ratings_count,
+                    ratings_total=ratings_total, rating_average=rating_average(ratings_total, ratings_count),
+                    last_update=Now())
+
+
+@receiver(post_save, sender=Review)
+def count_saved_review(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = (instance.product_id, instance.rating)
+    previous = getattr(instance, '_loaded_rating', None)
+    if created:
+        count_review(*current, reviews=1)
+    elif previous is not None and previous != current:
+        count_review(*previous, reviews=-1)
+        count_review(*current, reviews=1)
+    instance._loaded_rating = current
+
+
+@receiver(pre_delete, sender=Product)
+def start_product_delete(sender, instance, **kwargs):
+    deleting_products.ids = getattr(deleting_products, 'ids', set()) | {instance.id}
+
+
+@receiver(post_delete, sender=Product)
+def finish_product_delete(sender, instance, **kwargs):
+    deleting_products.ids.discard(instance.id)
+
+
+@receiver(post_delete, sender=Review)
+def count_deleted_review(sender, instance, **kwargs):
+    if instance.product_id not in getattr(deleting_products, 'ids', ()):
+        count_review(instance.product_id, instance.rating, reviews=-1)
+
+
+@receiver(pre_save, sender=ProductImage)
+def keep_uploaded_image(sender, instance, raw=False, **kwargs):
+    """ the field forgets the uploaded content once it is saved, restore_image_file may need it """
+    instance._uploaded_image = None if raw or instance.image._committed else instance.image.file
+
+
+def restore_image_file(instance):
+    """ the upload skips writing a file that already exists, and purge_image_blobs may have deleted
+    it since. The uploaded content is still at hand to write it again """
+    content = getattr(instance, '_uploaded_image', None)
+    storage = instance.image.storage
+    if content is not None and not storage.exists(instance.image.name):
+        content.seek(0)
+        storage.save(instance.image.name, content)
+
+
+# every product image holds a reference on its content-addressed file (store.storage), released
+# once the delete or replacement commits. The resized copies are made by celery after the upload commits
+@receiver(post_save, sender=ProductImage)
+def retain_image_file(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    name = instance.image.name or None
+    previous = None if created else getattr(instance, '_loaded_image', None) or None
+    if name != previous:
+        if name is not None:
+            if ImageBlob.objects.retain(name):
+                restore_image_file(instance)
+            transaction.on_commit(lambda: generate_image_derivatives.delay(instance.id))
+        if previous is not None:
+            transaction.on_commit(lambda: ImageBlob.objects.release(previous))
+    instance._loaded_image = name
+
+
+@receiver(post_delete, sender=ProductImage)
+def release_image_file(sender, instance, **kwargs):
+    name = instance.image.name
+    if name:
+        transaction.on_commit(lambda: ImageBlob.objects.release(name))
+
+
+# invalidation of the cached catalog responses, see store.cache
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    # collections are included because they show a product count
+    invalidate('products', f'product:{instance.id}', 'collections')
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_collection(sender, instance, **kwargs):
+    invalidate('collections')
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_product_image(sender, instance, **kwargs):
+    invalidate('products', f'product:{instance.product_id}')
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review(sender, instance, **kwargs):
+    # the products show their review counters
+    invalidate(f'reviews:{instance.product_id}', 'products', f'product:{instance.product_id}')
+
+
+# promotions are looked up before delete, the collector removes the product links first
+@receiver(post_save, sender=Promotion)
+@receiver(pre_delete, sender=Promotion)
+def invalidate_promotion(sender, instance, **kwargs):
+    product_ids = list(Product.objects.filter(promotions=instance).values_list('id', flat=True))
+    invalidate('products', *[f'product:{product_id}' for product_id in product_ids])
+    touch_products(product_ids)
+
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_product_promotions(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # a clear sends no pk_set, the promotion's products are looked up before they are unlinked
+        instance._cleared_product_ids = list(instance.product_set.values_list('id', flat=True))
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance is a promotion, pk_set holds product ids
+        product_ids = instance.__dict__.pop('_cleared_product_ids', []) if pk_set is None else pk_set
+    else:
+        product_ids = [instance.id]
+    invalidate('products', *[f'product:{product_id}' for product_id in product_ids])
+    touch_products(product_ids)
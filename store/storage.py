@@ -0,0 +1,92 @@
+""" content-addressed storage of product images.
+
+Uploads are hashed while they stream in (the handlers below, see settings.FILE_UPLOAD_HANDLERS)
+and saved as store/images/<first two hex digits>/<sha256>.<ext>, so identical images share one
+file and one url. ImageBlob counts the ProductImage rows using each file and
+store.tasks.purge_image_blobs removes the files nobody uses. The content behind such a name never
+changes, which is why it can be served as immutable """
+import hashlib
+import os
+import re
+from uuid import uuid4
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+BLOB_DIRECTORY = 'store/images'
+# originals and their resized copies (store.images) share the hash prefix
+BLOB_NAME = re.compile(rf'^{BLOB_DIRECTORY}/[0-9a-f]{{2}}/[0-9a-f]{{64}}\.')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def is_blob_name(name):
+    return bool(BLOB_NAME.match(name or ''))
+
+
+class HashingUploadMixin:
+    """ sets `sha256` on the uploaded file from the chunks as they are received """
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # the memory handler passes large files on to the next handler, which hashes them
+        if getattr(self, 'activated', True):
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def content_hash(file):
+    """ the sha256 of a file, read again only when it didn't come through the upload handlers """
+    digest = getattr(file, 'sha256', None)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        for chunk in file.chunks():
+            sha256.update(chunk)
+        digest = file.sha256 = sha256.hexdigest()
+    return digest
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_DIRECTORY}/{digest[:2]}/{digest}{extension.lower()}'
+
+
+def blob_path(instance, filename):
+    """ upload_to of ProductImage.image """
+    return blob_name(content_hash(instance.image.file), os.path.splitext(filename)[1])
+
+
+class BlobStorage(FileSystemStorage):
+    """ saving content under a name that already exists is a no-op instead of a renamed copy """
+
+    def get_available_name(self, name, max_length=None):
+        if is_blob_name(name):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not is_blob_name(name):
+            return super()._save(name, content)
+        if self.exists(name):
+            return name
+        # written aside and renamed into place, so concurrent uploads of one image never collide
+        temporary = super()._save(f'{name}.{uuid4().hex}.part', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+blob_storage = BlobStorage()
@@ -1,5 +1,18 @@
+import logging
+from datetime import timedelta
 from celery import shared_task
+from django.conf import settings
 from django.core.mail import send_mail
+from django.db import transaction
+from django.utils import timezone
+from . import outbox
+from .carts import flush_cart, get_cart_store
+from .models import Cart, ImageBlob, ProductImage
+from .cache import invalidate
+from .conditional import touch_products
+from . import images
+
+logger = logging.getLogger(__name__)
 
 @shared_task
 def send_mail(subject, message, sender, to):
@@ -7,3 +20,127 @@ def send_mail(subject, message, sender, to):
     reset email"""
     send_mail(subject=subject, message=message, from_email=sender,
               recipient_list=to)
+
+
+@shared_task
+def drain_outbox(batch_size=100, max_batches=50):
+    """ processes pending outbox events in batches, scheduled by celery beat """
+    processed = 0
+    for _ in range(max_batches):
+        count = outbox.drain(batch_size)
+        processed += count
+        if count < batch_size:
+            break
+    return processed
+
+
+@shared_task
+def purge_outbox(batch_size=1000):
+    """ deletes the outbox events processed longer than settings.OUTBOX_RETENTION ago, in batches
+    of short transactions, scheduled by celery beat """
+    cutoff = timezone.now() - settings.OUTBOX_RETENTION
+    purged = 0
+    while True:
+        count = outbox.purge(cutoff, batch_size)
+        purged += count
+        if count < batch_size:
+            break
+    logger.info('Purged %s processed outbox events', purged)
+    return purged
+
+
+@shared_task
+def purge_abandoned_carts(batch_size=1000):
+    """ deletes the carts (and their items) idle for longer than settings.CART_TTL.
+    Each batch is its own short transaction over at most batch_size carts, and carts that are
+    locked by a running checkout or cart update are skipped until the next run """
+    cutoff = timezone.now() - settings.CART_TTL
+    purged = {'carts': 0, 'cart_items': 0}
+    while True:
+        with transaction.atomic():
+            cart_ids = list(Cart.objects.select_for_update(skip_locked=True)
+                            .filter(last_activity__lt=cutoff)
+                            .order_by('last_activity').values_list('id', flat=True)[:batch_size])
+            if not cart_ids:
+                break
+            _, deleted = Cart.objects.filter(id__in=cart_ids).delete()
+        purged['carts'] += deleted.get('store.Cart', 0)
+        purged['cart_items'] += deleted.get('store.CartItem', 0)
+        if len(cart_ids) < batch_size:
+            break
+    logger.info('Purged %(carts)s abandoned carts and %(cart_items)s cart items', purged)
+    return purged
+
+
+@shared_task
+def flush_carts(batch_size=500):
+    """ writes the carts changed in the cart store since the last run to the database. A no-op when
+    carts live in the database. A cart whose flush fails is put back for the next run """
+    store = get_cart_store()
+    if store is None:
+        return 0
+    flushed = 0
+    failed = []
+    try:
+        while True:
+            cart_ids = store.pop_dirty(batch_size)
+            for cart_id in cart_ids:
+                try:
+                    flushed += flush_cart(store, cart_id)
+                except Exception:
+                    logger.exception('Flushing cart %s failed', cart_id)
+                    failed.append(cart_id)
+            if len(cart_ids) < batch_size:
+                break
+    finally:
+        # only after the run, or the same carts would be popped and fail again in this one
+        store.mark_dirty(failed)
+    return flushed
+
+
+@shared_task
+def generate_image_derivatives(image_id):
+    """ makes the resized copies of a product image after it is uploaded or replaced """
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is None or not image.image:
+        return None
+    name = image.image.name
+    # the copies belong to the file, so only the first image with this content makes them
+    derivatives = ImageBlob.objects.filter(name=name).values_list('derivatives', flat=True).first()
+    if not derivatives:
+        derivatives = images.make_derivatives(image.image)
+        ImageBlob.objects.filter(name=name).update(derivatives=derivatives)
+    # a replaced or deleted image keeps its row unchanged, its own task covers the new file
+    if not ProductImage.objects.filter(pk=image_id, image=name).update(derivatives=derivatives):
+        return None
+    invalidate('products', f'product:{image.product_id}')
+    touch_products([image.product_id])
+    return derivatives
+
+
+@shared_task
+def purge_image_blobs(grace_seconds=None, batch_size=100):
+    """ deletes the image files (and their resized copies) no product image has used for
+    settings.STORE_IMAGE_BLOB_GRACE, scheduled by celery beat. The grace period lets an upload of
+    the same content take a released file back before it is gone """
+    grace = settings.STORE_IMAGE_BLOB_GRACE if grace_seconds is None else timedelta(seconds=grace_seconds)
+    cutoff = timezone.now() - grace
+    storage = ProductImage._meta.get_field('image').storage
+    purged = 0
+    while True:
+        with transaction.atomic():
+            blobs = list(ImageBlob.objects.select_for_update(skip_locked=True)
+                         .filter(refs=0, released_at__lt=cutoff)
+                         .order_by('released_at').values_list('id', 'name', 'derivatives')[:batch_size])
+            if not blobs:
+                break
+            ImageBlob.objects.filter(id__in=[blob_id for blob_id, _, _ in blobs]).delete()
+            # deleted under the row locks: an upload retaining one of these files waits for the
+            # commit, finds no row and writes its file again (store.signals.restore_image_file)
+            for _, name, derivatives in blobs:
+                images.delete_files(storage, [name, *images.derivative_files(derivatives)])
+        purged += len(blobs)
+        if len(blobs) < batch_size:
+            break
+    logger.info('Purged %s unused image files', purged)
+    return purged
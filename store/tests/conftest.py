@@ -1,6 +1,9 @@
 import pytest
+from model_bakery import baker
 from rest_framework.test import APIClient
+from django.conf import settings as django_settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 
 
 """ defines a reusable fixture to run pytest without having to repeatedly call the api client function in the tests """
@@ -12,4 +15,26 @@ def api_client():
 def authenticate(api_client):
     def authenticate_user(is_staff=False):
         return api_client.force_authenticate(user=User(is_staff=is_staff))
-    return authenticate_user
\ No newline at end of file
+    return authenticate_user
+
+@pytest.fixture
+def login(api_client):
+    """ like authenticate, with a user saved to the database """
+    def login_user(is_staff=False):
+        user = baker.make(django_settings.AUTH_USER_MODEL, is_staff=is_staff)
+        api_client.force_authenticate(user=user)
+        return user
+    return login_user
+
+@pytest.fixture(autouse=True)
+def locmem_cache(settings):
+    """ the tests run against a local memory cache instead of redis, emptied after every test """
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    yield
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def query_detector(settings):
+    """ an api request running the same query over and over fails the test, see core.querydetector """
+    settings.QUERY_DETECTOR_MODE = 'raise'
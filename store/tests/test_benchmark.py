@@ -0,0 +1,98 @@
+import json
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+import pytest
+from model_bakery import baker
+from store import benchmark
+from store.models import Cart, Collection, Order, Product
+
+
+@pytest.fixture
+def catalog():
+    collection = baker.make(Collection)
+    return baker.make(Product, collection=collection, inventory=100, title='golden tea', _quantity=5)
+
+
+def run_benchmark(tmp_path, *args, name='results.json'):
+    out = StringIO()
+    call_command('benchmark', '--output', str(tmp_path / name), *args, stdout=out)
+    with open(tmp_path / name) as file:
+        return json.load(file), out.getvalue()
+
+
+@pytest.mark.django_db
+class TestBenchmark:
+    @pytest.mark.parametrize('mix', list(benchmark.MIXES))
+    def test_mixes_run_without_errors(self, tmp_path, catalog, mix):
+        results, out = run_benchmark(tmp_path, '--mix', mix, '--requests', '40', '--warmup', '5')
+
+        assert results['total']['requests'] == 40
+        assert results['total']['errors'] == 0, results['endpoints']
+        assert all(summary['queries_mean'] is not None for summary in results['endpoints'].values())
+        assert 'requests/s' in out
+
+    def test_writes_are_rolled_back(self, tmp_path, catalog):
+        run_benchmark(tmp_path, '--mix', 'checkout', '--requests', '12', '--warmup', '0')
+
+        assert not Cart.objects.exists() and not Order.objects.exists()
+        assert Product.objects.filter(inventory=100).count() == 5
+
+    def test_endpoints_are_grouped_by_url_name(self, tmp_path, catalog):
+        results, _ = run_benchmark(tmp_path, '--mix', 'browse', '--requests', '12', '--warmup', '0')
+
+        assert set(results['endpoints']) == {'GET store:collection-list', 'GET store:products-list',
+                                             'GET store:products-detail', 'GET store:product-image-list',
+                                             'GET store:products-review-list'}
+        assert results['endpoints']['GET store:products-list']['requests'] == 4
+
+    def test_the_same_seed_sends_the_same_requests(self, tmp_path, catalog):
+        for name in ('first', 'second'):
+            run_benchmark(tmp_path, '--requests', '30', '--seed', '3', '--record', str(tmp_path / f'{name}.jsonl'))
+
+        assert (tmp_path / 'first.jsonl').read_text() == (tmp_path / 'second.jsonl').read_text()
+
+    def test_trace_replay(self, tmp_path, catalog):
+        trace = tmp_path / 'trace.jsonl'
+        trace.write_text('\n'.join(json.dumps(line) for line in [
+            {'method': 'POST', 'path': '/store/carts/', 'save': {'cart': 'id'}},
+            {'method': 'POST', 'path': '/store/carts/{cart}/items/', 'body': {'product_id': catalog[0].id, 'quantity': 2}},
+            {'path': '/store/carts/{cart}/summary/', 'name': 'mini cart'},
+            {'method': 'POST', 'path': '/store/orders/', 'body': {'cart_id': '{cart}'}, 'user': 'customer'},
+        ]))
+
+        results, _ = run_benchmark(tmp_path, '--trace', str(trace))
+
+        assert results['name'] == 'trace.jsonl'
+        assert results['total']['statuses'] == {'200': 1, '201': 3}
+        assert results['endpoints']['mini cart']['requests'] == 1
+
+    def test_compare(self, tmp_path, catalog):
+        run_benchmark(tmp_path, '--requests', '20', name='before.json')
+
+        _, out = run_benchmark(tmp_path, '--requests', '20', '--compare', str(tmp_path / 'before.json'))
+
+        assert 'p95 ms before' in out
+
+    def test_no_products(self, tmp_path):
+        with pytest.raises(CommandError, match='generate_dataset'):
+            run_benchmark(tmp_path)
+
+
+def test_percentile_is_the_nearest_rank():
+    values = list(range(1, 101))
+
+    assert [benchmark.percentile(values, percent) for percent in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    assert benchmark.percentile([7], 99) == 7
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+class TestStoreBenchmark:
+    def test_mixed_traffic(self, tmp_path):
+        call_command('generate_dataset', '--scale', '0.1', stdout=StringIO())
+
+        results, out = run_benchmark(tmp_path, '--requests', '2000')
+        print(out)
+
+        assert results['total']['errors'] == 0
@@ -0,0 +1,107 @@
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from store.cache import get_tag_versions, invalidate
+from store.models import Collection, Product, ProductImage, Promotion, Review
+
+
+@pytest.mark.django_db
+class TestCatalogCache:
+    def test_repeated_product_list_is_served_from_cache(self, api_client, django_assert_num_queries):
+        baker.make(Product, _quantity=3)
+        first = api_client.get('/store/products/')
+
+        with django_assert_num_queries(0):
+            second = api_client.get('/store/products/')
+
+        assert second.status_code == status.HTTP_200_OK
+        assert second.data == first.data
+
+    def test_query_params_are_normalized(self, api_client, django_assert_num_queries):
+        baker.make(Product, _quantity=3)
+        api_client.get('/store/products/?ordering=unit_price&page=1')
+
+        with django_assert_num_queries(0):
+            api_client.get('/store/products/?page=1&ordering=unit_price&search=')
+
+    def test_tags_are_bumped_again_when_the_transaction_commits(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            invalidate('products')
+            # what another connection caches now is built from the rows before the commit
+            before_commit = get_tag_versions(['products'])
+
+        assert get_tag_versions(['products']) != before_commit
+
+    def test_product_save_invalidates_list_and_detail(self, api_client):
+        product = baker.make(Product, title='before')
+        api_client.get('/store/products/')
+        api_client.get(f'/store/products/{product.id}/')
+
+        product.title = 'after'
+        product.save()
+
+        assert api_client.get('/store/products/').data['results'][0]['title'] == 'after'
+        assert api_client.get(f'/store/products/{product.id}/').data['title'] == 'after'
+
+    def test_product_change_only_invalidates_its_own_detail(self, api_client, django_assert_num_queries):
+        product, other = baker.make(Product, _quantity=2)
+        api_client.get(f'/store/products/{other.id}/')
+
+        product.save()
+
+        with django_assert_num_queries(0):
+            api_client.get(f'/store/products/{other.id}/')
+
+    def test_new_product_invalidates_collection_count(self, api_client):
+        collection = baker.make(Collection)
+        api_client.get(f'/store/collections/{collection.id}/')
+
+        baker.make(Product, collection=collection)
+
+        assert api_client.get(f'/store/collections/{collection.id}/').data['products_count'] == 1
+
+    def test_image_and_review_changes_invalidate_nested_routes(self, api_client):
+        product = baker.make(Product)
+        api_client.get(f'/store/products/{product.id}/images/')
+        api_client.get(f'/store/products/{product.id}/reviews/')
+        api_client.get(f'/store/products/{product.id}/')
+
+        baker.make(ProductImage, product=product)
+        baker.make(Review, product=product, rating=4)
+
+        assert len(api_client.get(f'/store/products/{product.id}/images/').data) == 1
+        assert len(api_client.get(f'/store/products/{product.id}/reviews/').data['results']) == 1
+        assert api_client.get(f'/store/products/{product.id}/').data['reviews_count'] == 1
+
+    def test_promotion_changes_invalidate_linked_products(self, api_client):
+        product = baker.make(Product)
+        promotion = baker.make(Promotion)
+        api_client.get(f'/store/products/{product.id}/')
+
+        product.promotions.add(promotion)
+
+        with CaptureQueriesContext(connection) as queries:
+            api_client.get(f'/store/products/{product.id}/')
+        assert len(queries) > 0
+
+    def test_clearing_a_promotion_invalidates_its_products(self, api_client):
+        product = baker.make(Product, unit_price=Decimal('10.00'))
+        promotion = baker.make(Promotion, discount=50)
+        product.promotions.add(promotion)
+        assert api_client.get(f'/store/products/{product.id}/').data['effective_price'] == Decimal('5.00')
+
+        promotion.product_set.clear()
+
+        assert api_client.get(f'/store/products/{product.id}/').data['effective_price'] == Decimal('10.00')
+
+    def test_padded_pk_is_cached_under_the_product(self, api_client):
+        product = baker.make(Product, title='before')
+        api_client.get(f'/store/products/0{product.id}/')
+
+        product.title = 'after'
+        product.save()
+
+        assert api_client.get(f'/store/products/0{product.id}/').data['title'] == 'after'
@@ -0,0 +1,280 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings as django_settings
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from store.models import MAX_CART_QUANTITY, Cart, CartItem, Product
+from store.carts import get_cart_store
+from store.tasks import flush_carts, purge_abandoned_carts
+
+
+@pytest.mark.django_db
+class TestBatchAddCartItems:
+    def test_adds_new_and_existing_products(self, api_client):
+        cart = baker.make(Cart)
+        existing, new = baker.make(Product, _quantity=2)
+        baker.make(CartItem, cart=cart, product=existing, quantity=2)
+
+        response = api_client.post(f'/store/carts/{cart.id}/items/batch/', {'items': [
+            {'product_id': existing.id, 'quantity': 3},
+            {'product_id': new.id, 'quantity': 1},
+            {'product_id': new.id, 'quantity': 1},
+        ]}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        quantities = dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity'))
+        assert quantities == {existing.id: 5, new.id: 2}
+        assert {item['product']['title'] for item in response.data} == {existing.title, new.title}
+
+    def test_unknown_products_reject_the_whole_batch(self, api_client):
+        cart = baker.make(Cart)
+        product = baker.make(Product)
+
+        response = api_client.post(f'/store/carts/{cart.id}/items/batch/', {'items': [
+            {'product_id': product.id, 'quantity': 1},
+            {'product_id': product.id + 1000, 'quantity': 1},
+        ]}, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not CartItem.objects.filter(cart=cart).exists()
+
+    @pytest.mark.parametrize('cart_id', ['00000000-0000-0000-0000-000000000000', 'abc'])
+    def test_unknown_cart_404(self, api_client, cart_id):
+        product = baker.make(Product)
+        response = api_client.post(f'/store/carts/{cart_id}/items/batch/',
+                                   {'items': [{'product_id': product.id, 'quantity': 1}]}, format='json')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_single_add_upserts(self, api_client):
+        cart = baker.make(Cart)
+        product = baker.make(Product)
+        api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': product.id, 'quantity': 1})
+
+        response = api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': product.id, 'quantity': 2})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['quantity'] == 3
+        assert CartItem.objects.get(cart=cart).quantity == 3
+
+    def test_quantities_are_capped_at_the_column_size(self, api_client):
+        cart = baker.make(Cart)
+        existing, new = baker.make(Product, _quantity=2)
+        baker.make(CartItem, cart=cart, product=existing, quantity=MAX_CART_QUANTITY - 10)
+
+        single = api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': existing.id, 'quantity': 100})
+        batch = api_client.post(f'/store/carts/{cart.id}/items/batch/', {'items': [
+            {'product_id': new.id, 'quantity': MAX_CART_QUANTITY},
+            {'product_id': new.id, 'quantity': MAX_CART_QUANTITY},
+            {'product_id': existing.id, 'quantity': 1},
+        ]}, format='json')
+
+        assert (single.status_code, batch.status_code) == (status.HTTP_201_CREATED, status.HTTP_200_OK)
+        assert set(CartItem.objects.filter(cart=cart).values_list('quantity', flat=True)) == {MAX_CART_QUANTITY}
+
+
+@pytest.mark.django_db
+class TestCartPricing:
+    @pytest.fixture
+    def cart(self):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=baker.make(Product, unit_price=Decimal('2.50')), quantity=2)
+        baker.make(CartItem, cart=cart, product=baker.make(Product, unit_price=Decimal('1.25')), quantity=4)
+        return cart
+
+    def test_cart_prices(self, api_client, cart):
+        response = api_client.get(f'/store/carts/{cart.id}/')
+
+        assert response.data['total_cart_price'] == Decimal('10.00')
+        assert sorted(item['cart_price'] for item in response.data['cart_items']) == [Decimal('5.00'), Decimal('5.00')]
+
+    def test_new_cart_is_empty(self, api_client):
+        response = api_client.post('/store/carts/')
+        assert response.data['cart_items'] == []
+        assert response.data['total_cart_price'] == 0
+
+    def test_summary(self, api_client, cart, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            response = api_client.get(f'/store/carts/{cart.id}/summary/')
+
+        assert response.data == {'id': str(cart.id), 'item_count': 6, 'total_cart_price': Decimal('10.00')}
+
+    def test_empty_cart_summary(self, api_client):
+        cart = baker.make(Cart)
+        response = api_client.get(f'/store/carts/{cart.id}/summary/')
+        assert response.data['item_count'] == 0
+        assert response.data['total_cart_price'] == Decimal('0.00')
+
+    def test_unknown_cart_summary_404(self, api_client):
+        response = api_client.get('/store/carts/00000000-0000-0000-0000-000000000000/summary/')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestAbandonedCartPurge:
+    def test_purges_only_idle_carts(self, settings):
+        settings.CART_TTL = timedelta(days=7)
+        idle = baker.make(Cart, last_activity=timezone.now() - timedelta(days=8), _quantity=3)
+        active = baker.make(Cart)
+        for cart in idle + [active]:
+            baker.make(CartItem, cart=cart, quantity=1)
+
+        purged = purge_abandoned_carts(batch_size=2)
+
+        assert purged == {'carts': 3, 'cart_items': 3}
+        assert list(Cart.objects.values_list('id', flat=True)) == [active.id]
+        assert CartItem.objects.count() == 1
+
+    def test_cart_item_writes_keep_the_cart_alive(self, api_client):
+        cart = baker.make(Cart, last_activity=timezone.now() - timedelta(days=30))
+        product = baker.make(Product)
+
+        api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': product.id, 'quantity': 1})
+
+        cart.refresh_from_db()
+        assert timezone.now() - cart.last_activity < timedelta(minutes=1)
+
+
+@pytest.mark.django_db
+class TestStoredCarts:
+    @pytest.fixture(autouse=True)
+    def cart_store(self, settings):
+        settings.STORE_CART_STORE = 'store.carts.InMemoryCartStore'
+        return get_cart_store()
+
+    @pytest.fixture
+    def products(self):
+        return [baker.make(Product, unit_price=Decimal('2.50'), inventory=10),
+                baker.make(Product, unit_price=Decimal('4.00'), inventory=10)]
+
+    def test_item_writes_stay_out_of_the_database(self, api_client, products):
+        cart_id = api_client.post('/store/carts/').data['id']
+        first, second = products
+
+        with CaptureQueriesContext(connection) as context:
+            api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': first.id, 'quantity': 2})
+            api_client.post(f'/store/carts/{cart_id}/items/batch/', {'items': [
+                {'product_id': first.id, 'quantity': 1}, {'product_id': second.id, 'quantity': 1}]}, format='json')
+            api_client.patch(f'/store/carts/{cart_id}/items/{second.id}/', {'quantity': 4})
+
+        assert all(query['sql'].startswith('SELECT') for query in context.captured_queries)
+        assert not CartItem.objects.filter(cart_id=cart_id).exists()
+        response = api_client.get(f'/store/carts/{cart_id}/')
+        assert [(item['id'], item['quantity']) for item in response.data['cart_items']] == \
+            [(first.id, 3), (second.id, 4)]
+        assert response.data['total_cart_price'] == Decimal('23.50')
+
+    def test_reads_match_the_database_mode(self, api_client, products, settings):
+        cart = baker.make(Cart)
+        for product in products:
+            baker.make(CartItem, cart=cart, product=product, quantity=2)
+
+        stored = api_client.get(f'/store/carts/{cart.id}/').data
+        stored_summary = api_client.get(f'/store/carts/{cart.id}/summary/').data
+        settings.STORE_CART_STORE = None
+        database = api_client.get(f'/store/carts/{cart.id}/').data
+        database_summary = api_client.get(f'/store/carts/{cart.id}/summary/').data
+
+        assert stored['total_cart_price'] == database['total_cart_price']
+        assert stored_summary == database_summary
+        assert [(item['product'], item['quantity'], item['cart_price']) for item in stored['cart_items']] == \
+            [(item['product'], item['quantity'], item['cart_price']) for item in database['cart_items']]
+
+    def test_remove_and_unknown_items(self, api_client, products, cart_store):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=products[0], quantity=1)
+
+        assert api_client.delete(f'/store/carts/{cart.id}/items/{products[0].id}/').status_code == \
+            status.HTTP_204_NO_CONTENT
+        assert api_client.get(f'/store/carts/{cart.id}/items/{products[0].id}/').status_code == \
+            status.HTTP_404_NOT_FOUND
+        assert api_client.get(f'/store/carts/{cart.id}/items/').data == []
+        assert api_client.get('/store/carts/00000000-0000-0000-0000-000000000000/items/').status_code == \
+            status.HTTP_404_NOT_FOUND
+
+    def test_flush_writes_changed_carts(self, api_client, products, cart_store):
+        cart = baker.make(Cart, last_activity=timezone.now() - timedelta(days=1))
+        baker.make(CartItem, cart=cart, product=products[0], quantity=1)
+        api_client.delete(f'/store/carts/{cart.id}/items/{products[0].id}/')
+        api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': products[1].id, 'quantity': 3})
+
+        assert flush_carts() == 1
+
+        assert dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity')) == {products[1].id: 3}
+        cart.refresh_from_db()
+        assert cart.last_activity > timezone.now() - timedelta(minutes=1)
+        assert flush_carts() == 0
+
+    def test_flush_drops_carts_deleted_from_the_database(self, api_client, products, cart_store):
+        cart = baker.make(Cart)
+        api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': products[0].id, 'quantity': 1})
+        Cart.objects.filter(pk=cart.pk).delete()
+
+        assert flush_carts() == 0
+        assert not cart_store.exists(str(cart.id))
+
+    def test_checkout_materializes_the_cart(self, api_client, products, cart_store,
+                                           django_capture_on_commit_callbacks):
+        user = baker.make(django_settings.AUTH_USER_MODEL)
+        api_client.force_authenticate(user=user)
+        cart_id = str(api_client.post('/store/carts/').data['id'])
+        api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': products[0].id, 'quantity': 2})
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post('/store/orders/', {'cart_id': cart_id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['total_amount'] == Decimal('5.00')
+        assert not Cart.objects.filter(pk=cart_id).exists()
+        assert not cart_store.exists(cart_id)
+
+    def test_deleting_the_cart_drops_it_from_the_store(self, api_client, cart_store):
+        cart_id = str(api_client.post('/store/carts/').data['id'])
+
+        api_client.delete(f'/store/carts/{cart_id}/')
+
+        assert not cart_store.exists(cart_id)
+
+    def test_failed_flush_is_retried(self, api_client, products, monkeypatch):
+        cart = baker.make(Cart)
+        api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': products[0].id, 'quantity': 2})
+
+        def fail(cart_id, quantities):
+            raise DatabaseError('down')
+
+        with monkeypatch.context() as patch:
+            patch.setattr(CartItem.objects, 'set_quantities', fail)
+            assert flush_carts() == 0
+
+        assert flush_carts() == 1
+        assert CartItem.objects.get(cart=cart).quantity == 2
+
+    def test_carts_the_store_no_longer_holds_are_not_counted(self, cart_store):
+        cart_store.mark_dirty([str(baker.make(Cart).id)])
+
+        assert flush_carts() == 0
+
+    def test_stored_quantities_are_capped(self, api_client, products):
+        cart_id = api_client.post('/store/carts/').data['id']
+        for _ in range(2):
+            response = api_client.post(f'/store/carts/{cart_id}/items/',
+                                       {'product_id': products[0].id, 'quantity': MAX_CART_QUANTITY})
+
+        assert response.data['quantity'] == MAX_CART_QUANTITY
+        assert flush_carts() == 1
+        assert CartItem.objects.get(cart_id=cart_id).quantity == MAX_CART_QUANTITY
+
+    def test_any_spelling_of_the_cart_id_adds_to_the_same_cart(self, api_client, products):
+        cart_id = str(api_client.post('/store/carts/').data['id'])
+        api_client.post(f'/store/carts/{cart_id.upper()}/items/', {'product_id': products[0].id, 'quantity': 1})
+        api_client.post(f'/store/carts/{cart_id.replace("-", "")}/items/batch/', {'items': [
+            {'product_id': products[1].id, 'quantity': 2}]}, format='json')
+
+        response = api_client.get(f'/store/carts/{cart_id}/items/')
+
+        assert [(item['id'], item['quantity']) for item in response.data] == [(products[0].id, 1), (products[1].id, 2)]
+        assert flush_carts() == 1
+        assert CartItem.objects.filter(cart_id=cart_id).count() == 2
@@ -0,0 +1,161 @@
+import csv
+import json
+from decimal import Decimal
+from io import StringIO
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from store import catalog
+from store.models import Collection, Product
+
+
+def csv_file(rows, fields=catalog.FIELDS):
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fields)
+    writer.writeheader()
+    writer.writerows(rows)
+    buffer.seek(0)
+    return buffer
+
+
+def product_row(collection, slug='tea', **values):
+    return {'slug': slug, 'title': slug.title(), 'description': f'about {slug}', 'unit_price': '9.99',
+            'inventory': 10, 'collection': collection.id, **values}
+
+
+def import_csv(rows, **kwargs):
+    return catalog.import_products(catalog.read_rows(csv_file(rows), 'csv'), **kwargs)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('use_copy', [True, False])
+class TestImportProducts:
+    def test_upserts_on_slug(self, use_copy):
+        collection = baker.make(Collection)
+        baker.make(Product, slug='tea', title='Old', collection=collection)
+
+        counts = import_csv([product_row(collection, 'tea', unit_price='4.50'), product_row(collection, 'coffee')],
+                            batch_size=1, use_copy=use_copy)
+
+        assert counts == {'created': 1, 'updated': 1, 'unchanged': 0}
+        tea = Product.objects.get(slug='tea')
+        assert (tea.title, tea.unit_price) == ('Tea', Decimal('4.50'))
+        assert Product.objects.filter(slug='coffee', collection=collection).exists()
+        collection.refresh_from_db()
+        assert collection.products_count == 2
+
+    def test_unchanged_rows_are_not_written(self, use_copy):
+        collection = baker.make(Collection)
+        import_csv([product_row(collection)], use_copy=use_copy)
+        last_update = Product.objects.get().last_update
+
+        counts = import_csv([product_row(collection)], use_copy=use_copy)
+
+        assert counts == {'created': 0, 'updated': 0, 'unchanged': 1}
+        assert Product.objects.get().last_update == last_update
+
+    def test_the_last_row_of_a_slug_wins(self, use_copy):
+        collection = baker.make(Collection)
+
+        import_csv([product_row(collection, inventory=1), product_row(collection, inventory=2)], use_copy=use_copy)
+
+        assert Product.objects.get().inventory == 2
+
+    def test_an_invalid_row_imports_nothing(self, use_copy):
+        collection = baker.make(Collection)
+        rows = [product_row(collection, 'tea'), product_row(collection, 'coffee', unit_price='cheap')]
+
+        with pytest.raises(ValidationError, match='line 3: unit_price'):
+            import_csv(rows, batch_size=1, use_copy=use_copy)
+
+        assert not Product.objects.exists()
+
+    def test_unknown_collection(self, use_copy):
+        with pytest.raises(ValidationError, match='line 2: collection: collection 0 does not exist'):
+            import_csv([product_row(Collection(id=0))], use_copy=use_copy)
+
+
+@pytest.mark.django_db
+class TestFiles:
+    def test_ndjson_import(self):
+        collection = baker.make(Collection)
+        lines = StringIO(json.dumps(product_row(collection)) + '\n\n' + '{"slug": 1}\n')
+
+        with pytest.raises(ValidationError, match='line 3: title'):
+            catalog.import_products(catalog.read_rows(lines, 'ndjson'))
+
+    def test_missing_csv_columns(self):
+        with pytest.raises(ValidationError, match="missing columns \\['collection'\\]"):
+            list(catalog.read_rows(csv_file([], catalog.FIELDS[:-1]), 'csv'))
+
+    @pytest.mark.parametrize('file_format', list(catalog.FORMATS))
+    def test_export_round_trips(self, file_format):
+        collection = baker.make(Collection)
+        import_csv([product_row(collection, 'tea'), product_row(collection, 'coffee', unit_price='12.00')])
+
+        exported = StringIO(''.join(catalog.export_lines(Product.objects.all(), file_format, chunk_size=1)))
+
+        assert catalog.import_products(catalog.read_rows(exported, file_format)) == \
+            {'created': 0, 'updated': 0, 'unchanged': 2}
+
+    def test_commands(self, tmp_path):
+        collection = baker.make(Collection)
+        path = tmp_path / 'products.ndjson'
+        path.write_text(json.dumps(product_row(collection)) + '\n')
+        out = StringIO()
+
+        call_command('import_products', str(path), stdout=out)
+        call_command('export_products', stdout=out)
+
+        assert 'Created 1, updated 0' in out.getvalue()
+        assert out.getvalue().endswith(f'tea,Tea,about tea,9.99,10,{collection.id}\r\n')
+
+    def test_seed_db(self):
+        call_command('seed_db', stdout=StringIO())
+
+        assert Product.objects.count() == 1000
+        assert sum(Collection.objects.values_list('products_count', flat=True)) == 1000
+
+
+@pytest.mark.django_db
+class TestCatalogApi:
+    def test_only_staff(self, api_client, authenticate):
+        authenticate()
+
+        assert api_client.get('/store/products/export/').status_code == status.HTTP_403_FORBIDDEN
+        assert api_client.post('/store/products/import/').status_code == status.HTTP_403_FORBIDDEN
+
+    def test_export_streams_the_filtered_products(self, api_client, authenticate):
+        authenticate(is_staff=True)
+        collection, other = baker.make(Collection, _quantity=2)
+        import_csv([product_row(collection, 'tea'), product_row(other, 'coffee')])
+
+        response = api_client.get(f'/store/products/export/?type=ndjson&collection_id={collection.id}')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.streaming and response['Content-Type'] == 'application/x-ndjson'
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        assert [row['slug'] for row in rows] == ['tea']
+
+    def test_import_upload(self, api_client, authenticate):
+        authenticate(is_staff=True)
+        collection = baker.make(Collection)
+        upload = SimpleUploadedFile('products.csv', csv_file([product_row(collection)]).getvalue().encode())
+
+        response = api_client.post('/store/products/import/', {'file': upload}, format='multipart')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {'created': 1, 'updated': 0, 'unchanged': 0}
+        assert Product.objects.filter(slug='tea', collection=collection).exists()
+
+    def test_import_errors(self, api_client, authenticate):
+        authenticate(is_staff=True)
+        upload = SimpleUploadedFile('products.ndjson', b'not json\n')
+
+        response = api_client.post('/store/products/import/', {'file': upload}, format='multipart')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['Error'][0].startswith('line 1:')
@@ -1,8 +1,10 @@
+from io import StringIO
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from rest_framework import status
 import pytest
 from model_bakery import baker
-from store.models import Collection
+from store.models import Collection, Product
 
 @pytest.fixture
 def collection(api_client):
@@ -47,4 +49,72 @@ class TestRetrieveCollection:
         }
 
 
+@pytest.mark.django_db
+class TestProductsCount:
+    def count(self, collection):
+        collection.refresh_from_db()
+        return collection.products_count
+
+    def test_follows_created_moved_and_deleted_products(self):
+        first, second = baker.make(Collection, _quantity=2)
+        products = baker.make(Product, collection=first, _quantity=3)
+        assert (self.count(first), self.count(second)) == (3, 0)
+
+        product = Product.objects.get(pk=products[0].pk)
+        product.collection = second
+        product.save()
+        product.title = 'renamed'
+        product.save()
+        assert (self.count(first), self.count(second)) == (2, 1)
+
+        product.delete()
+        assert (self.count(first), self.count(second)) == (2, 0)
+
+    def test_moving_out_of_a_drifted_count_of_zero(self):
+        first, second = baker.make(Collection, _quantity=2)
+        product = Product.objects.get(pk=baker.make(Product, collection=first).pk)
+        Collection.objects.filter(pk=first.pk).update(products_count=0)
+
+        product.collection = second
+        product.save()
+
+        assert (self.count(first), self.count(second)) == (0, 1)
+
+    def test_api_reads_the_stored_count(self, api_client, django_assert_num_queries):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=2)
+
+        # the ETag validator and the collection
+        with django_assert_num_queries(2):
+            response = api_client.get(f'/store/collections/{collection.id}/')
+
+        assert response.data['products_count'] == 2
+
+    def test_collection_with_products_cannot_be_deleted(self, api_client, authenticate):
+        authenticate(is_staff=True)
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection)
+
+        response = api_client.delete(f'/store/collections/{collection.id}/')
+
+        assert response.status_code == status.HTTP_405_METHOD_NOT_ALLOWED
+
+    def test_reconcile_command_repairs_counts(self):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=2)
+        Collection.objects.update(products_count=7)
+        Product.objects.bulk_create([baker.prepare(Product, collection=collection)])
+
+        call_command('reconcile_collection_counts', stdout=StringIO())
+
+        assert self.count(collection) == 3
+
+    def test_reconcile_command_invalidates_cached_collections(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection)
+        Collection.objects.update(products_count=7)
+        api_client.get('/store/collections/')
+
+        call_command('reconcile_collection_counts', stdout=StringIO())
 
+        assert api_client.get('/store/collections/').data[0]['products_count'] == 1
@@ -0,0 +1,120 @@
+from datetime import timedelta
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from store.models import Collection, Product, ProductImage, Promotion
+
+
+@pytest.mark.django_db
+class TestConditionalProductGets:
+    def test_unchanged_product_304_without_queries(self, api_client, django_assert_num_queries):
+        product = baker.make(Product)
+        url = f'/store/products/{product.id}/'
+        response = api_client.get(url)
+        assert response['ETag'].startswith('"') and response['Last-Modified']
+
+        with django_assert_num_queries(0):
+            not_modified = api_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        assert not_modified.status_code == status.HTTP_304_NOT_MODIFIED
+        assert not_modified.content == b''
+
+    def test_changes_move_the_etag(self, api_client, authenticate):
+        product = baker.make(Product)
+        url = f'/store/products/{product.id}/'
+        etags = [api_client.get(url)['ETag']]
+
+        product.title = 'renamed'
+        product.save()
+        etags.append(api_client.get(url)['ETag'])
+        product.promotions.add(baker.make(Promotion, discount=10))
+        etags.append(api_client.get(url)['ETag'])
+        authenticate(is_staff=True)
+        baker.make(ProductImage, product=product)
+        api_client.delete(f'/store/products/{product.id}/images/{product.images.get().id}/')
+        etags.append(api_client.get(url)['ETag'])
+
+        assert len(set(etags)) == len(etags)
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=etags[0]).status_code == status.HTTP_200_OK
+
+    def test_representations_have_their_own_etags(self, api_client):
+        product = baker.make(Product)
+
+        full = api_client.get(f'/store/products/{product.id}/')
+        sparse = api_client.get(f'/store/products/{product.id}/?fields=id')
+
+        assert full['ETag'] != sparse['ETag']
+
+    def test_list_deletion_moves_last_modified(self, api_client):
+        collection = baker.make(Collection)
+        products = baker.make(Product, collection=collection, _quantity=2)
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        Product.objects.update(last_update=an_hour_ago)
+        Collection.objects.update(last_update=an_hour_ago)
+        response = api_client.get('/store/products/')
+        assert response['Last-Modified'] == http_date(int(an_hour_ago.timestamp()))
+        assert api_client.get('/store/products/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']) \
+            .status_code == status.HTTP_304_NOT_MODIFIED
+
+        products[0].delete()
+
+        assert api_client.get('/store/products/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']) \
+            .status_code == status.HTTP_200_OK
+        assert api_client.get('/store/products/', HTTP_IF_NONE_MATCH=response['ETag']) \
+            .status_code == status.HTTP_200_OK
+
+    def test_cached_until_the_next_promotion_starts(self, api_client, monkeypatch):
+        product = baker.make(Product)
+        product.promotions.add(baker.make(Promotion, discount=10, starts_at=timezone.now() + timedelta(seconds=30)))
+        timeouts = []
+        set_cached = cache.set
+        monkeypatch.setattr(cache, 'set', lambda key, value, timeout=None: timeouts.append(timeout)
+                            or set_cached(key, value, timeout))
+
+        api_client.get(f'/store/products/{product.id}/')
+        api_client.get('/store/products/')
+
+        assert len(timeouts) == 4 and all(0 < timeout <= 30 for timeout in timeouts)
+
+    def test_missing_product_404(self, api_client):
+        assert api_client.get('/store/products/0/').status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestConditionalCollectionAndImageGets:
+    def test_collections(self, api_client):
+        collection = baker.make(Collection)
+        detail = api_client.get(f'/store/collections/{collection.id}/')
+        listing = api_client.get('/store/collections/')
+
+        baker.make(Product, collection=collection)
+
+        assert api_client.get(f'/store/collections/{collection.id}/', HTTP_IF_NONE_MATCH=detail['ETag']) \
+            .status_code == status.HTTP_200_OK
+        assert api_client.get('/store/collections/', HTTP_IF_NONE_MATCH=listing['ETag']) \
+            .status_code == status.HTTP_200_OK
+
+    def test_images(self, api_client, authenticate):
+        product = baker.make(Product)
+        url = f'/store/products/{product.id}/images/'
+        response = api_client.get(url)
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == \
+            status.HTTP_304_NOT_MODIFIED
+
+        authenticate(is_staff=True)
+        image = baker.make(ProductImage, product=product)
+        api_client.delete(f'{url}{image.id}/')
+
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == status.HTTP_200_OK
+
+    @pytest.mark.parametrize('method, url', [('get', '/store/products/abc/'), ('get', '/store/collections/abc/'),
+                                             ('get', '/store/products/abc/images/'),
+                                             ('get', '/store/products/abc/images/1/'),
+                                             ('delete', '/store/products/abc/')])
+    def test_pks_that_are_not_numbers_404(self, api_client, authenticate, method, url):
+        authenticate(is_staff=True)
+
+        assert getattr(api_client, method)(url).status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,84 @@
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count, Sum
+import pytest
+from likes.models import LikedItem
+from store.models import Cart, Collection, Customer, ImageBlob, Order, OrderItem, Product, ProductImage, Review
+from tags.models import TaggedItem
+
+COUNTS = ['--collections', '3', '--promotions', '2', '--products', '40', '--image-files', '2', '--users', '5',
+          '--orders', '12', '--carts', '4', '--reviews', '10', '--tags', '3', '--tagged-items', '8',
+          '--likes', '10', '--batch-size', '7']
+
+
+@pytest.fixture(autouse=True)
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+
+def generate(*args):
+    call_command('generate_dataset', *COUNTS, '--date', '2024-06-01', *args, stdout=StringIO())
+
+
+def snapshot():
+    """ the generated rows without their ids """
+    slugs = dict(Product.objects.values_list('id', 'slug'))
+    return {
+        'products': list(Product.objects.order_by('slug').values_list('slug', 'title', 'unit_price', 'collection__title',
+                                                                       'last_update')),
+        'orders': list(Order.objects.order_by('placed_at').values_list('customer__user__username', 'placed_at',
+                                                                        'total_amount', 'item_count')),
+        'likes': sorted((username, slugs[object_id])
+                        for username, object_id in LikedItem.objects.values_list('user__username', 'object_id')),
+        'carts': list(Cart.objects.order_by('id').values_list('id', 'last_activity')),
+    }
+
+
+@pytest.mark.django_db
+class TestGenerateDataset:
+    def test_counts(self):
+        generate()
+
+        assert Product.objects.count() == 40
+        assert Customer.objects.filter(user__username__startswith='gen0-').count() == 5
+        assert Order.objects.count() == 12 and Cart.objects.count() == 4
+        assert Review.objects.count() == 10 and TaggedItem.objects.count() == 8
+        assert get_user_model().objects.get(username='gen0-0').check_password('loadtest')
+
+    def test_the_same_seed_gives_the_same_rows(self):
+        generate('--seed', '7')
+        first = snapshot()
+        for model in (OrderItem, Order, Cart, Product, Collection, LikedItem, get_user_model()):
+            model.objects.all().delete()
+
+        generate('--seed', '7')
+
+        assert snapshot() == first
+        assert first['products'][0][0].startswith('gen7-')
+
+    def test_another_seed_adds_another_dataset(self):
+        generate()
+        first = snapshot()
+
+        generate('--seed', '1')
+
+        assert Product.objects.count() == 80
+        assert snapshot()['products'] != first['products']
+        with pytest.raises(CommandError):
+            generate()
+
+    def test_stored_counters_match_the_rows(self):
+        generate()
+
+        for collection in Collection.objects.annotate(count=Count('products')):
+            assert collection.products_count == collection.count
+        for order in Order.objects.annotate(count=Sum('items__quantity')):
+            assert order.item_count == order.count
+        assert sum(ImageBlob.objects.values_list('refs', flat=True)) == ProductImage.objects.count()
+        out = StringIO()
+        call_command('reconcile_review_counts', stdout=out)
+        assert 'counters of 0 products' in out.getvalue()
+        assert sum(Product.objects.values_list('reviews_count', flat=True)) == Review.objects.count() == 10
+        assert LikedItem.objects.values('user', 'object_id').distinct().count() == LikedItem.objects.count()
@@ -0,0 +1,85 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from store.models import Cart, CartItem, Collection, Product, ProductImage, Review
+
+
+@pytest.mark.django_db
+class TestProductFieldsets:
+    @pytest.fixture
+    def products(self):
+        products = baker.make(Product, _quantity=3)
+        for product in products:
+            baker.make(ProductImage, product=product)
+        return products
+
+    def test_fields_trim_the_payload_and_the_query(self, api_client, products):
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.get('/store/products/?fields=id,title,unit_price')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert all(list(item) == ['id', 'title', 'unit_price'] for item in response.data['results'])
+        # the three ETag validators, the count and the page, without the images prefetch or the
+        # promotion subqueries
+        assert len(context.captured_queries) == 5
+        page_sql = context.captured_queries[-1]['sql']
+        assert '"description"' not in page_sql and 'store_promotion' not in page_sql
+
+    def test_omit(self, api_client, products):
+        response = api_client.get(f'/store/products/{products[0].id}/?omit=images,description')
+
+        assert 'images' not in response.data and 'description' not in response.data
+        assert response.data['price_with_tax'] is not None
+
+    def test_prices_are_kept_when_asked_for(self, api_client, products):
+        response = api_client.get(f'/store/products/{products[0].id}/?fields=price_with_tax')
+
+        assert list(response.data) == ['price_with_tax']
+        assert response.data['price_with_tax'] > 0
+
+    def test_keyset_pages_load_the_ordering_column(self, api_client, products, django_assert_num_queries):
+        # the three ETag validators and the page
+        with django_assert_num_queries(4):
+            response = api_client.get('/store/products/?cursor=&ordering=-unit_price&fields=id')
+
+        assert [item['id'] for item in response.data['results']] == \
+            [product.id for product in sorted(products, key=lambda product: (-product.unit_price, product.id))]
+
+    def test_unknown_fields_400(self, api_client, products):
+        response = api_client.get('/store/products/?fields=id,password')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_writes_ignore_fieldsets(self, api_client, authenticate):
+        authenticate(is_staff=True)
+        collection = baker.make(Collection)
+
+        response = api_client.post('/store/products/?fields=id', {
+            'title': 'a', 'slug': 'a', 'inventory': 1, 'description': 'a', 'unit_price': 1,
+            'collection': collection.id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['title'] == 'a'
+
+
+@pytest.mark.django_db
+class TestOtherFieldsets:
+    def test_collections_and_reviews(self, api_client):
+        collection = baker.make(Collection)
+        product = baker.make(Product, collection=collection)
+        baker.make(Review, product=product)
+
+        assert api_client.get('/store/collections/?fields=title').data == [{'title': collection.title}]
+        assert list(api_client.get(f'/store/products/{product.id}/reviews/?omit=description').data['results'][0]) == \
+            ['id', 'date', 'name', 'rating']
+
+    def test_nested_serializers_keep_their_fields(self, api_client):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1)
+
+        response = api_client.get(f'/store/carts/{cart.id}/?fields=cart_items')
+
+        assert list(response.data) == ['cart_items']
+        assert list(response.data['cart_items'][0]) == ['id', 'product', 'quantity', 'cart_price']
@@ -0,0 +1,209 @@
+import hashlib
+from io import BytesIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory
+from PIL import Image
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from storefront.celery import celery
+from store import images
+from store.models import ImageBlob, Product, ProductImage
+from store.storage import IMMUTABLE, BlobStorage
+from store.tasks import generate_image_derivatives, purge_image_blobs
+from store.views import serve_media
+
+
+def image_bytes(size=(1200, 800), format='JPEG', color='teal'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def upload(name='photo.jpg', size=(1200, 800), format='JPEG', color='teal'):
+    return SimpleUploadedFile(name, image_bytes(size, format, color), content_type=f'image/{format.lower()}')
+
+
+@pytest.fixture(autouse=True)
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    return tmp_path
+
+
+@pytest.fixture
+def eager_tasks():
+    celery.conf.task_always_eager = True
+    yield
+    celery.conf.task_always_eager = False
+
+
+@pytest.mark.django_db
+class TestImageDerivatives:
+    def test_upload_queues_the_derivatives(self, api_client, authenticate, eager_tasks, media,
+                                           django_capture_on_commit_callbacks):
+        authenticate(is_staff=True)
+        product = baker.make(Product)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(f'/store/products/{product.id}/images/', {'image': upload()},
+                                       format='multipart')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['srcset'] == {}
+        image = ProductImage.objects.get()
+        assert {size: derivative['width'] for size, derivative in image.derivatives.items()} == \
+            {'thumbnail': 150, 'medium': 600}
+        for derivative in image.derivatives.values():
+            assert Image.open(media / derivative['image/jpeg']).format == 'JPEG'
+            assert Image.open(media / derivative['image/webp']).format == 'WEBP'
+        srcset = api_client.get(f'/store/products/{product.id}/images/{image.id}/').data['srcset']
+        assert list(srcset) == ['image/jpeg', 'image/webp']
+        assert srcset['image/webp'].endswith('.600w.webp 600w')
+        assert '.150w.webp 150w, ' in srcset['image/webp']
+
+    def test_small_images_are_not_scaled_up_and_keep_png(self, media):
+        image = baker.make(ProductImage, image=upload('icon.png', size=(100, 40), format='PNG'))
+
+        derivatives = generate_image_derivatives(image.id)
+
+        assert [derivative['width'] for derivative in derivatives.values()] == [100, 100]
+        assert Image.open(media / derivatives['thumbnail']['image/png']).size == (100, 40)
+
+    def test_product_payload_includes_the_srcset(self, api_client):
+        image = baker.make(ProductImage, image=upload())
+        generate_image_derivatives(image.id)
+
+        response = api_client.get(f'/store/products/{image.product_id}/')
+
+        assert response.data['images'][0]['srcset']['image/jpeg'].startswith('http://testserver/media/')
+
+    def test_deleting_the_image_removes_the_derivatives(self, api_client, authenticate, eager_tasks, media,
+                                                        django_capture_on_commit_callbacks):
+        authenticate(is_staff=True)
+        image = baker.make(ProductImage, image=upload())
+        names = [name for derivative in generate_image_derivatives(image.id).values()
+                 for key, name in derivative.items() if key != 'width']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.delete(f'/store/products/{image.product_id}/images/{image.id}/')
+        purge_image_blobs(grace_seconds=0)
+
+        assert names and not any((media / name).exists() for name in names)
+        assert not (media / image.image.name).exists()
+
+    def test_upload_cap_setting(self, api_client, authenticate, settings):
+        authenticate(is_staff=True)
+        settings.STORE_IMAGE_MAX_UPLOAD_KB = 1
+        product = baker.make(Product)
+
+        response = api_client.post(f'/store/products/{product.id}/images/', {'image': upload()}, format='multipart')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestContentAddressedImages:
+    def post_image(self, api_client, product, file):
+        response = api_client.post(f'/store/products/{product.id}/images/', {'image': file}, format='multipart')
+        assert response.status_code == status.HTTP_201_CREATED
+        return ProductImage.objects.get(pk=response.data['id'])
+
+    @pytest.mark.parametrize('max_memory_size', [2621440, 1])
+    def test_uploads_are_stored_by_their_hash(self, api_client, authenticate, settings, media, max_memory_size):
+        # a 1 byte limit streams the upload to a temporary file instead of memory
+        settings.FILE_UPLOAD_MAX_MEMORY_SIZE = max_memory_size
+        authenticate(is_staff=True)
+        digest = hashlib.sha256(image_bytes()).hexdigest()
+
+        image = self.post_image(api_client, baker.make(Product), upload('Photo.JPG'))
+
+        assert image.image.name == f'store/images/{digest[:2]}/{digest}.jpg'
+        assert (media / image.image.name).read_bytes() == image_bytes()
+
+    def test_identical_uploads_share_one_file(self, api_client, authenticate, media):
+        authenticate(is_staff=True)
+
+        first = self.post_image(api_client, baker.make(Product), upload('front.jpg'))
+        second = self.post_image(api_client, baker.make(Product), upload('variant.jpg'))
+        other = self.post_image(api_client, baker.make(Product), upload(color='navy'))
+
+        assert first.image.name == second.image.name != other.image.name
+        assert len(list(media.rglob('*.jpg'))) == 2
+        assert ImageBlob.objects.get(name=first.image.name).refs == 2
+        assert api_client.get(f'/store/products/{second.product_id}/images/{second.id}/').data['image'] == \
+            f'http://testserver/media/{first.image.name}'
+
+    def test_files_are_only_purged_without_references(self, media, django_capture_on_commit_callbacks):
+        first, second = baker.make(ProductImage, image=upload(), _quantity=2)
+        name = first.image.name
+
+        with django_capture_on_commit_callbacks(execute=True):
+            first.delete()
+        purge_image_blobs(grace_seconds=0)
+        assert (media / name).exists()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            second.delete()
+        assert purge_image_blobs() == 0
+        assert (media / name).exists()
+        assert purge_image_blobs(grace_seconds=0) == 1
+        assert not (media / name).exists()
+        assert not ImageBlob.objects.exists()
+
+    def test_a_new_upload_takes_a_released_file_back(self, eager_tasks, media, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(ProductImage, image=upload()).delete()
+
+        image = baker.make(ProductImage, image=upload())
+        purge_image_blobs(grace_seconds=0)
+
+        assert (media / image.image.name).exists()
+        assert ImageBlob.objects.get(name=image.image.name).refs == 1
+
+    def test_an_upload_racing_the_purge_keeps_its_file(self, eager_tasks, media, monkeypatch, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(ProductImage, image=upload()).delete()
+        save = BlobStorage._save
+
+        def save_then_purge(storage, name, content):
+            # the upload finds the released file, then the purge deletes it before retain runs
+            name = save(storage, name, content)
+            purge_image_blobs(grace_seconds=0)
+            return name
+
+        monkeypatch.setattr(BlobStorage, '_save', save_then_purge)
+        image = baker.make(ProductImage, image=upload())
+
+        assert (media / image.image.name).read_bytes() == image_bytes()
+        assert ImageBlob.objects.get(name=image.image.name).refs == 1
+
+    def test_replacing_an_image_releases_the_old_file(self, eager_tasks, django_capture_on_commit_callbacks):
+        image = baker.make(ProductImage, image=upload())
+        old = image.image.name
+
+        with django_capture_on_commit_callbacks(execute=True):
+            image.image = upload(color='navy')
+            image.save()
+
+        assert ImageBlob.objects.get(name=old).refs == 0
+        assert ImageBlob.objects.get(name=image.image.name).refs == 1
+
+    def test_derivatives_are_made_once_per_file(self, monkeypatch):
+        first, second = baker.make(ProductImage, image=upload(), _quantity=2)
+        derivatives = generate_image_derivatives(first.id)
+        monkeypatch.setattr(images, 'make_derivatives', lambda field_file: pytest.fail('copies made twice'))
+
+        assert generate_image_derivatives(second.id) == derivatives
+        second.refresh_from_db()
+        assert second.derivatives == derivatives
+
+    def test_content_addressed_files_are_served_as_immutable(self, media):
+        image = baker.make(ProductImage, image=upload())
+        (media / 'legacy.jpg').write_bytes(image_bytes())
+        request = RequestFactory().get('/media/')
+
+        response = serve_media(request, image.image.name, document_root=media)
+        legacy = serve_media(request, 'legacy.jpg', document_root=media)
+
+        assert response['Cache-Control'] == IMMUTABLE
+        assert not legacy.has_header('Cache-Control')
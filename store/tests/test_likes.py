@@ -0,0 +1,170 @@
+from django.conf import settings as django_settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from likes.counters import get_like_store
+from likes.models import LikedItem
+from likes.tasks import flush_likes
+from store.models import Product
+
+
+def like(product, user):
+    return baker.make(LikedItem, user=user, content_type=ContentType.objects.get_for_model(Product),
+                      object_id=product.id)
+
+
+def likes(product):
+    return set(LikedItem.objects.filter(object_id=product.id).values_list('user_id', flat=True))
+
+
+@pytest.mark.django_db
+class TestLikes:
+    def test_like_and_take_it_back(self, api_client, login):
+        product = baker.make(Product)
+        like(product, baker.make(django_settings.AUTH_USER_MODEL))
+        user = login()
+        url = f'/store/products/{product.id}/like/'
+
+        assert api_client.post(url).data == {'id': product.id, 'likes': 2, 'liked': True}
+        assert api_client.post(url).data == {'id': product.id, 'likes': 2, 'liked': True}
+        assert user.id in likes(product)
+        assert api_client.delete(url).data == {'id': product.id, 'likes': 1, 'liked': False}
+        assert api_client.delete(url).data['likes'] == 1
+        assert user.id not in likes(product)
+
+    def test_only_users_like(self, api_client):
+        product = baker.make(Product)
+
+        assert api_client.post(f'/store/products/{product.id}/like/').status_code == status.HTTP_401_UNAUTHORIZED
+
+    @pytest.mark.parametrize('product_id', ['0', 'abc', '99999999999999999999'])
+    def test_unknown_products(self, api_client, login, product_id):
+        login()
+
+        assert api_client.post(f'/store/products/{product_id}/like/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_counts_and_liked_by_me_for_a_page(self, api_client, login):
+        first, second, third = baker.make(Product, _quantity=3)
+        for user in baker.make(django_settings.AUTH_USER_MODEL, _quantity=2):
+            like(first, user)
+        like(third, login())
+        url = f'/store/products/likes/?ids={third.id},{first.id},{second.id},{first.id}'
+
+        assert api_client.get(url).data == [{'id': third.id, 'likes': 1, 'liked': True},
+                                            {'id': first.id, 'likes': 2, 'liked': False},
+                                            {'id': second.id, 'likes': 0, 'liked': False}]
+        api_client.force_authenticate(user=None)
+        assert [item['liked'] for item in api_client.get(url).data] == [False, False, False]
+
+    def test_asking_for_too_many_or_bad_ids(self, api_client, settings):
+        settings.LIKES_MAX_IDS = 2
+
+        assert api_client.get('/store/products/likes/?ids=1,2,3').status_code == status.HTTP_400_BAD_REQUEST
+        assert api_client.get('/store/products/likes/?ids=1,a').status_code == status.HTTP_400_BAD_REQUEST
+        assert api_client.get('/store/products/likes/?ids=99999999999999999999').status_code == \
+            status.HTTP_400_BAD_REQUEST
+        assert api_client.get('/store/products/likes/?ids=0').status_code == status.HTTP_400_BAD_REQUEST
+        assert api_client.get('/store/products/likes/').data == []
+
+    def test_object_ids_past_the_small_integer_range(self):
+        item = baker.make(LikedItem, object_id=2 ** 40)
+
+        assert LikedItem.objects.get(pk=item.pk).object_id == 2 ** 40
+
+
+@pytest.mark.django_db
+class TestStoredLikes:
+    @pytest.fixture(autouse=True)
+    def like_store(self, settings):
+        settings.LIKES_STORE = 'likes.counters.InMemoryLikeStore'
+        return get_like_store()
+
+    def test_likes_stay_out_of_the_database(self, api_client, login):
+        product = baker.make(Product)
+        like(product, baker.make(django_settings.AUTH_USER_MODEL))
+        login()
+
+        with CaptureQueriesContext(connection) as context:
+            api_client.post(f'/store/products/{product.id}/like/')
+            api_client.delete(f'/store/products/{product.id}/like/')
+            response = api_client.post(f'/store/products/{product.id}/like/')
+
+        assert all(query['sql'].startswith('SELECT') for query in context.captured_queries)
+        assert response.data['likes'] == 2
+        assert LikedItem.objects.count() == 1
+        assert api_client.get(f'/store/products/likes/?ids={product.id}').data == \
+            [{'id': product.id, 'likes': 2, 'liked': True}]
+
+    def test_flush_writes_the_changes(self, api_client, login):
+        first, second = baker.make(Product, _quantity=2)
+        user = login()
+        like(first, user)
+        api_client.delete(f'/store/products/{first.id}/like/')
+        api_client.post(f'/store/products/{second.id}/like/')
+        api_client.post(f'/store/products/{second.id}/like/')
+
+        assert flush_likes() == 2
+
+        assert (likes(first), likes(second)) == (set(), {user.id})
+        assert flush_likes() == 0
+
+    def test_flush_in_batches(self, api_client, login):
+        products = baker.make(Product, _quantity=5)
+        user = login()
+        for product in products:
+            api_client.post(f'/store/products/{product.id}/like/')
+
+        assert flush_likes(batch_size=2) == 5
+        assert LikedItem.objects.filter(user=user).count() == 5
+
+    def test_flush_skips_deleted_users(self, api_client, login, like_store):
+        product = baker.make(Product)
+        user = login()
+        api_client.post(f'/store/products/{product.id}/like/')
+        kept = login()
+        api_client.post(f'/store/products/{product.id}/like/')
+        user.delete()
+
+        assert flush_likes() == 1
+        assert likes(product) == {kept.id}
+
+    def test_counts_match_the_database_mode(self, api_client, login, settings):
+        products = baker.make(Product, _quantity=3)
+        for user in baker.make(django_settings.AUTH_USER_MODEL, _quantity=3):
+            like(products[0], user)
+        like(products[1], login())
+        url = f'/store/products/likes/?ids={",".join(str(product.id) for product in products)}'
+
+        stored = api_client.get(url).data
+        settings.LIKES_STORE = None
+
+        assert stored == api_client.get(url).data
+
+    def test_failed_flush_is_retried(self, api_client, login, monkeypatch):
+        product = baker.make(Product)
+        user = login()
+        api_client.post(f'/store/products/{product.id}/like/')
+
+        def fail(*args, **kwargs):
+            raise DatabaseError('down')
+
+        with monkeypatch.context() as patch:
+            patch.setattr(LikedItem.objects, 'bulk_create', fail)
+            with pytest.raises(DatabaseError):
+                flush_likes()
+
+        assert flush_likes() == 1
+        assert likes(product) == {user.id}
+
+    def test_only_counts_of_existing_products_are_held(self, api_client, like_store):
+        product = baker.make(Product)
+        missing = product.id + 1000
+
+        response = api_client.get(f'/store/products/likes/?ids={product.id},{missing}')
+
+        assert [item['likes'] for item in response.data] == [0, 0]
+        content_type = ContentType.objects.get_for_model(Product).id
+        assert like_store.counts(content_type, [product.id, missing]) == {product.id: 0}
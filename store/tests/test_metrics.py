@@ -0,0 +1,97 @@
+import re
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from core import metrics
+from store import benchmark
+from store.models import Cart, CartItem, Product
+
+
+def timings(response):
+    return {match['name']: float(match['duration'])
+            for match in re.finditer(r'(?P<name>\w+);dur=(?P<duration>[\d.]+)', response['Server-Timing'])}
+
+
+def sample(name, route, method='GET', **labels):
+    return metrics.registry.get_sample_value(name, {'method': method, 'route': route, **labels}) or 0
+
+
+@pytest.mark.django_db
+class TestServerTiming:
+    @pytest.fixture(autouse=True)
+    def server_timing(self, settings):
+        settings.METRICS_SERVER_TIMING = True
+
+    def test_every_part_is_timed(self, api_client):
+        cart = baker.make(Cart)
+        for product in baker.make(Product, _quantity=2):
+            baker.make(CartItem, cart=cart, product=product)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.get(f'/store/carts/{cart.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert set(timings(response)) == {'sql', 'serializer', 'view', 'render', 'total'}
+        assert timings(response)['total'] >= timings(response)['view'] >= timings(response)['sql'] > 0
+        assert timings(response)['serializer'] > 0
+        assert f'desc="{len(queries)} queries"' in response['Server-Timing']
+        assert benchmark.sql_timing(response['Server-Timing'])[0] == len(queries)
+
+    def test_can_be_turned_off(self, api_client, settings):
+        settings.METRICS_SERVER_TIMING = False
+
+        assert 'Server-Timing' not in api_client.get('/store/collections/')
+
+    def test_only_sent_with_debug_by_default(self, api_client, settings):
+        settings.METRICS_SERVER_TIMING = None
+
+        assert 'Server-Timing' not in api_client.get('/store/collections/')
+        settings.DEBUG = True
+        assert 'Server-Timing' in api_client.get('/store/collections/')
+
+    def test_histograms_are_per_route(self, api_client):
+        product = baker.make(Product)
+        before = sample('http_request_sql_queries_count', 'store:products-detail')
+        requests = sample('http_requests_total', 'store:products-detail', status='200')
+
+        api_client.get(f'/store/products/{product.id}/')
+        api_client.get(f'/store/products/{product.id}/')
+
+        assert sample('http_request_sql_queries_count', 'store:products-detail') == before + 2
+        assert sample('http_requests_total', 'store:products-detail', status='200') == requests + 2
+        assert sample('http_response_size_bytes_sum', 'store:products-detail') > 0
+
+    def test_unknown_paths_share_one_route(self, api_client):
+        before = sample('http_request_duration_seconds_count', 'unmatched')
+
+        api_client.get('/no/such/page/')
+
+        assert sample('http_request_duration_seconds_count', 'unmatched') == before + 1
+
+
+@pytest.mark.django_db
+class TestMetricsEndpoint:
+    def test_prometheus_text(self, api_client, settings):
+        settings.DEBUG = True
+        api_client.get('/store/collections/')
+
+        response = api_client.get('/metrics')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'].startswith('text/plain')
+        assert b'http_request_sql_queries_bucket{le="0.0",method="GET",route="store:collection-list"}' \
+            in response.content
+
+    def test_token(self, api_client, settings):
+        settings.METRICS_TOKEN = 'secret'
+
+        assert api_client.get('/metrics').status_code == status.HTTP_403_FORBIDDEN
+        api_client.credentials(HTTP_AUTHORIZATION='Bearer secret')
+        assert api_client.get('/metrics').status_code == status.HTTP_200_OK
+
+    def test_closed_without_debug(self, client, settings):
+        assert client.get('/metrics').status_code == status.HTTP_403_FORBIDDEN
+        client.force_login(baker.make(settings.AUTH_USER_MODEL, is_staff=True))
+        assert client.get('/metrics').status_code == status.HTTP_200_OK
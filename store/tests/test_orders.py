@@ -0,0 +1,134 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from random import Random
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from rest_framework import status
+from rest_framework.test import APIClient
+import pytest
+from model_bakery import baker
+from store.models import Cart, CartItem, Order, OrderItem, Product
+
+
+@pytest.fixture
+def customer_user(api_client):
+    user = baker.make(settings.AUTH_USER_MODEL)
+    api_client.force_authenticate(user=user)
+    return user
+
+
+@pytest.mark.django_db
+class TestOrderTotals:
+    def test_checkout_stores_totals(self, api_client, customer_user):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=baker.make(Product, unit_price=Decimal('2.50'), inventory=10), quantity=2)
+        baker.make(CartItem, cart=cart, product=baker.make(Product, unit_price=Decimal('10.00'), inventory=10), quantity=1)
+
+        response = api_client.post('/store/orders/', {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['total_amount'] == Decimal('15.00')
+        assert response.data['item_count'] == 3
+        order = Order.objects.get(pk=response.data['id'])
+        assert (order.total_amount, order.item_count) == (Decimal('15.00'), 3)
+
+    def test_reconcile_command_repairs_totals(self, customer_user):
+        order = baker.make(Order, customer=customer_user.customer)
+        baker.make(OrderItem, order=order, quantity=3, unit_price=Decimal('1.10'))
+        empty_order = baker.make(Order, customer=customer_user.customer, total_amount=5, item_count=1)
+
+        call_command('reconcile_order_totals', batch_size=1)
+
+        order.refresh_from_db()
+        empty_order.refresh_from_db()
+        assert (order.total_amount, order.item_count) == (Decimal('3.30'), 3)
+        assert (empty_order.total_amount, empty_order.item_count) == (Decimal('0.00'), 0)
+
+
+@pytest.mark.django_db
+class TestInventoryReservation:
+    def test_checkout_decrements_inventory(self, api_client, customer_user):
+        cart = baker.make(Cart)
+        product = baker.make(Product, inventory=5)
+        baker.make(CartItem, cart=cart, product=product, quantity=2)
+
+        response = api_client.post('/store/orders/', {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        product.refresh_from_db()
+        assert product.inventory == 3
+
+    def test_short_line_fails_the_whole_order(self, api_client, customer_user):
+        cart = baker.make(Cart)
+        in_stock = baker.make(Product, inventory=5)
+        short = baker.make(Product, inventory=1)
+        baker.make(CartItem, cart=cart, product=in_stock, quantity=2)
+        baker.make(CartItem, cart=cart, product=short, quantity=2)
+
+        response = api_client.post('/store/orders/', {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert str(short.id) in str(response.data['cart_id'])
+        in_stock.refresh_from_db()
+        assert in_stock.inventory == 5
+        assert not Order.objects.exists()
+        assert Cart.objects.filter(pk=cart.pk).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentCheckout:
+    CHECKOUTS = 200
+    WORKERS = 16
+    STOCK = 120
+
+    def checkout(self, user, cart):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        try:
+            return client.post('/store/orders/', {'cart_id': cart.id}).status_code
+        finally:
+            connection.close()
+
+    def hot_checkouts(self):
+        """ the products and a (user, cart) per checkout, every cart holds the hot products in a
+        different order """
+        random = Random(7)
+        products = baker.make(Product, inventory=self.STOCK, _quantity=3)
+        checkouts = []
+        for user in baker.make(settings.AUTH_USER_MODEL, _quantity=self.CHECKOUTS):
+            cart = baker.make(Cart)
+            for product in random.sample(products, k=random.randint(1, 3)):
+                baker.make(CartItem, cart=cart, product=product, quantity=random.randint(1, 3))
+            checkouts.append((user, cart))
+        return products, checkouts
+
+    def run_checkouts(self, checkouts):
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            return list(executor.map(lambda args: self.checkout(*args), checkouts))
+
+    def test_hot_products_never_oversell(self):
+        products, checkouts = self.hot_checkouts()
+
+        statuses = self.run_checkouts(checkouts)
+
+        assert set(statuses) <= {status.HTTP_201_CREATED, status.HTTP_400_BAD_REQUEST}
+        assert statuses.count(status.HTTP_201_CREATED) == Order.objects.count() > 0
+        for product in Product.objects.filter(pk__in=[product.pk for product in products]):
+            sold = OrderItem.objects.filter(product=product).aggregate(sold=Sum('quantity'))['sold'] or 0
+            assert product.inventory == self.STOCK - sold
+            assert product.inventory >= 0
+
+    @pytest.mark.benchmark
+    def test_checkout_throughput(self):
+        _, checkouts = self.hot_checkouts()
+
+        start = time.perf_counter()
+        statuses = self.run_checkouts(checkouts)
+        elapsed = time.perf_counter() - start
+        print(f'{self.CHECKOUTS} checkouts on {self.WORKERS} workers in {elapsed:.2f}s '
+              f'({self.CHECKOUTS / elapsed:.0f} checkouts/s)')
+
+        assert status.HTTP_201_CREATED in statuses
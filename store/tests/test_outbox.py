@@ -0,0 +1,85 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core import mail
+from django.utils import timezone
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from store import outbox
+from store.cache import get_tag_versions
+from store.models import Cart, CartItem, OutboxEvent, Product
+from store.tasks import drain_outbox, purge_outbox
+
+
+@pytest.fixture
+def placed_order(api_client):
+    user = baker.make(settings.AUTH_USER_MODEL, email='buyer@example.com')
+    api_client.force_authenticate(user=user)
+    cart = baker.make(Cart)
+    product = baker.make(Product, inventory=10, unit_price=Decimal('4.00'))
+    baker.make(CartItem, cart=cart, product=product, quantity=2)
+    response = api_client.post('/store/orders/', {'cart_id': cart.id})
+    assert response.status_code == status.HTTP_201_CREATED
+    return response.data
+
+
+@pytest.mark.django_db
+class TestOutbox:
+    def test_checkout_records_an_event(self, placed_order):
+        event = OutboxEvent.objects.get()
+        assert event.topic == outbox.ORDER_PLACED
+        assert event.payload['order_id'] == placed_order['id']
+        assert event.processed_at is None
+
+    def test_drain_runs_the_handlers(self, placed_order):
+        event = OutboxEvent.objects.get()
+        product_tag = [f'product:{event.payload["product_ids"][0]}']
+        version = get_tag_versions(product_tag)
+
+        assert drain_outbox() == 1
+
+        event.refresh_from_db()
+        assert event.processed_at is not None
+        assert mail.outbox[0].to == ['buyer@example.com']
+        assert get_tag_versions(product_tag) != version
+        assert drain_outbox() == 0
+
+    def test_failed_handler_leaves_the_event_pending(self, placed_order, monkeypatch):
+        def broken(payload):
+            raise RuntimeError('mail server down')
+        monkeypatch.setitem(outbox.handlers, outbox.ORDER_PLACED, [broken])
+
+        drain_outbox()
+
+        event = OutboxEvent.objects.get()
+        assert event.processed_at is None
+        assert event.attempts == 1
+        assert 'mail server down' in event.last_error
+
+    def test_failed_events_back_off_between_runs(self, placed_order, monkeypatch):
+        calls = []
+        monkeypatch.setitem(outbox.handlers, outbox.ORDER_PLACED, [lambda payload: calls.append(1) / 0])
+
+        for _ in range(outbox.MAX_ATTEMPTS):
+            drain_outbox()
+
+        event = OutboxEvent.objects.get()
+        assert (len(calls), event.attempts) == (1, 1)
+        assert event.next_attempt_at > timezone.now() + outbox.RETRY_DELAY / 2
+
+        OutboxEvent.objects.update(next_attempt_at=timezone.now())
+        drain_outbox()
+        event.refresh_from_db()
+        assert (len(calls), event.attempts) == (2, 2)
+        assert event.next_attempt_at > timezone.now() + outbox.RETRY_DELAY * 1.5
+
+    def test_processed_events_are_purged_after_the_retention(self, settings):
+        now = timezone.now()
+        baker.make(OutboxEvent, payload={}, processed_at=now - timedelta(days=8), _quantity=2)
+        recent = baker.make(OutboxEvent, payload={}, processed_at=now - timedelta(days=1))
+        pending = baker.make(OutboxEvent, payload={}, processed_at=None)
+
+        assert purge_outbox(batch_size=1) == 2
+
+        assert set(OutboxEvent.objects.values_list('id', flat=True)) == {recent.id, pending.id}
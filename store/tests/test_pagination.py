@@ -0,0 +1,97 @@
+import json
+import time
+from base64 import b64encode
+from decimal import Decimal
+from statistics import median
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from store.models import Collection, Product
+
+
+def walk(api_client, url):
+    """ follow the next links from url and return every page """
+    pages = []
+    while url:
+        response = api_client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        pages.append(response.data)
+        url = response.data['next']
+    return pages
+
+
+@pytest.mark.django_db
+class TestKeysetPagination:
+    def test_page_number_pagination_is_still_the_default(self, api_client):
+        baker.make(Product, _quantity=3)
+        response = api_client.get('/store/products/')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 3
+
+    def test_cursor_pages_cover_every_product_once(self, api_client):
+        # duplicate titles force the id tie breaker to do its job
+        products = baker.make(Product, title='same', _quantity=25)
+        pages = walk(api_client, '/store/products/?cursor=')
+        ids = [product['id'] for page in pages for product in page['results']]
+        assert 'count' not in pages[0]
+        assert [len(page['results']) for page in pages] == [10, 10, 5]
+        assert ids == sorted(product.id for product in products)
+
+    def test_cursor_follows_ordering_param(self, api_client):
+        for price in ['3.00', '1.00', '2.00', '2.00']:
+            baker.make(Product, unit_price=Decimal(price))
+        response = api_client.get('/store/products/?cursor=&ordering=-unit_price')
+        prices = [product['unit_price'] for product in response.data['results']]
+        assert prices == [Decimal('3.00'), Decimal('2.00'), Decimal('2.00'), Decimal('1.00')]
+
+    def test_previous_link_returns_the_same_page(self, api_client):
+        baker.make(Product, _quantity=25)
+        first = api_client.get('/store/products/?cursor=').data
+        second = api_client.get(first['next']).data
+        back = api_client.get(second['previous']).data
+        assert back['results'] == first['results']
+        assert back['previous'] is None
+
+    def test_invalid_cursor_404(self, api_client):
+        response = api_client.get('/store/products/?cursor=not-a-cursor')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+class TestKeysetPaginationBenchmark:
+    PAGE_SIZE = 10
+    PAGES = [1, 10, 100, 1000, 10000]
+
+    def time_request(self, api_client, url, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = api_client.get(url)
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == status.HTTP_200_OK
+        return median(timings)
+
+    def cursor_url(self, page):
+        if page == 1:
+            return '/store/products/?cursor='
+        # the cursor a client would hold after walking to the end of the previous page
+        title, id = Product.objects.order_by('title', 'id') \
+            .values_list('title', 'id')[(page - 1) * self.PAGE_SIZE - 1]
+        cursor = b64encode(json.dumps({'v': title, 'id': id}).encode()).decode()
+        return f'/store/products/?cursor={cursor}'
+
+    def test_cursor_latency_is_flat(self, api_client):
+        collection = baker.make(Collection)
+        Product.objects.bulk_create(
+            (Product(title=f'product {i:06}', slug=f'product-{i}', description='', unit_price=1, inventory=1,
+                     collection=collection)
+             for i in range(max(self.PAGES) * self.PAGE_SIZE)),
+            batch_size=5000)
+
+        cursor = {page: self.time_request(api_client, self.cursor_url(page)) for page in self.PAGES}
+        offset = {page: self.time_request(api_client, f'/store/products/?page={page}') for page in self.PAGES}
+        for page in self.PAGES:
+            print(f'page {page:>6}: cursor {cursor[page] * 1000:7.2f}ms  offset {offset[page] * 1000:7.2f}ms')
+
+        assert cursor[max(self.PAGES)] < cursor[1] * 2
@@ -0,0 +1,95 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from store import pricing
+from store.models import Cart, CartItem, OrderItem, Product, Promotion
+
+
+def promote(product, discount, **kwargs):
+    product.promotions.add(baker.make(Promotion, discount=discount, **kwargs))
+
+
+@pytest.mark.django_db
+class TestEffectivePrice:
+    def test_best_active_promotion_and_tax(self, api_client):
+        product = baker.make(Product, unit_price=Decimal('9.99'))
+        promote(product, 15)
+        promote(product, 5)
+        promote(product, 50, ends_at=timezone.now() - timedelta(days=1))
+        promote(product, 60, starts_at=timezone.now() + timedelta(days=1))
+
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        # 9.99 * 0.85 = 8.4915, 8.49 * 1.1 = 9.339
+        assert response.data['unit_price'] == Decimal('9.99')
+        assert response.data['effective_price'] == Decimal('8.49')
+        assert response.data['price_with_tax'] == Decimal('9.34')
+
+    def test_without_promotions(self, api_client):
+        product = baker.make(Product, unit_price=Decimal('2.25'))
+
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        assert (response.data['effective_price'], response.data['price_with_tax']) == \
+            (Decimal('2.25'), Decimal('2.48'))
+
+    def test_tax_rate_setting(self, api_client, settings):
+        settings.STORE_TAX_RATE = Decimal('0.2')
+        product = baker.make(Product, unit_price=Decimal('10.00'))
+
+        assert api_client.get(f'/store/products/{product.id}/').data['price_with_tax'] == Decimal('12.00')
+
+    @pytest.mark.parametrize('discount', [0, 12.5, 33.33, 99.99, 100, 150, -5])
+    def test_database_and_python_agree(self, discount):
+        for unit_price in ['0.01', '0.99', '9.95', '123.45', '9999.99']:
+            product = baker.make(Product, unit_price=Decimal(unit_price))
+            promote(product, discount)
+            annotated = pricing.with_prices(Product.objects.all()).get(pk=product.pk)
+            loaded = pricing.price_product(Product.objects.get(pk=product.pk))
+
+            assert (annotated.effective_price, annotated.price_with_tax) == \
+                (loaded.effective_price, loaded.price_with_tax)
+
+    def test_list_prices_in_the_same_query(self, api_client, django_assert_num_queries):
+        for product in baker.make(Product, _quantity=5):
+            promote(product, 10)
+
+        # the three ETag validators, count, page and the images
+        with django_assert_num_queries(6):
+            response = api_client.get('/store/products/')
+
+        assert all(item['effective_price'] < item['unit_price'] for item in response.data['results'])
+
+
+@pytest.mark.django_db
+class TestCartAndCheckoutPrices:
+    @pytest.fixture
+    def cart(self):
+        cart = baker.make(Cart)
+        discounted = baker.make(Product, unit_price=Decimal('10.00'), inventory=10)
+        promote(discounted, 25)
+        baker.make(CartItem, cart=cart, product=discounted, quantity=2)
+        baker.make(CartItem, cart=cart, product=baker.make(Product, unit_price=Decimal('1.50'), inventory=10),
+                   quantity=1)
+        return cart
+
+    def test_cart_uses_discounted_prices(self, api_client, cart):
+        response = api_client.get(f'/store/carts/{cart.id}/')
+
+        assert response.data['total_cart_price'] == Decimal('16.50')
+        assert sorted(item['cart_price'] for item in response.data['cart_items']) == \
+            [Decimal('1.50'), Decimal('15.00')]
+        assert api_client.get(f'/store/carts/{cart.id}/summary/').data['total_cart_price'] == Decimal('16.50')
+
+    def test_checkout_records_discounted_prices(self, api_client, cart):
+        api_client.force_authenticate(user=baker.make(settings.AUTH_USER_MODEL))
+
+        response = api_client.post('/store/orders/', {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['total_amount'] == Decimal('16.50')
+        assert sorted(OrderItem.objects.values_list('unit_price', flat=True)) == [Decimal('1.50'), Decimal('7.50')]
@@ -0,0 +1,347 @@
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from likes.models import LikedItem
+from store.models import Cart, CartItem, Collection, Order, OrderItem, Product, ProductImage, Review
+
+""" every route in store/urls.py is requested with N related rows seeded for N = 1 and N = 20,
+and must stay within a query budget that does not depend on N. Raise a budget only with a reason """
+
+SIZES = [1, 20]
+
+
+@pytest.fixture
+def products():
+    def make_products(n):
+        products = baker.make(Product, _quantity=n)
+        for product in products:
+            baker.make(ProductImage, product=product, _quantity=2)
+        return products
+    return make_products
+
+
+@pytest.fixture
+def cart():
+    def make_cart(n):
+        cart = baker.make(Cart)
+        for product in baker.make(Product, inventory=100, _quantity=n):
+            baker.make(CartItem, cart=cart, product=product, quantity=2)
+        return cart
+    return make_cart
+
+
+@pytest.fixture
+def orders():
+    def make_orders(customer, n, items=3):
+        orders = baker.make(Order, customer=customer, _quantity=n)
+        for order in orders:
+            for product in baker.make(Product, _quantity=items):
+                baker.make(OrderItem, order=order, product=product, quantity=1, unit_price=product.unit_price)
+        return orders
+    return make_orders
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('n', SIZES)
+class TestCatalogQueryBudget:
+    # reads on a cold cache also run the ETag validator queries (store.conditional): three for a
+    # product list, two for a product, one for collections and images
+    def test_api_root(self, api_client, n, django_assert_max_num_queries):
+        with django_assert_max_num_queries(0):
+            response = api_client.get('/store/')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_list_products(self, api_client, products, n, django_assert_max_num_queries):
+        products(n)
+        with django_assert_max_num_queries(6):
+            response = api_client.get('/store/products/')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_list_products_with_cursor(self, api_client, products, n, django_assert_max_num_queries):
+        products(n)
+        with django_assert_max_num_queries(5):
+            response = api_client.get('/store/products/?cursor=&ordering=-unit_price')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_search_products(self, api_client, products, n, django_assert_max_num_queries):
+        for product in products(n):
+            product.title = 'searchable'
+            product.save()
+        with django_assert_max_num_queries(6):
+            response = api_client.get('/store/products/?search=searchable')
+        assert response.data['count'] == n
+
+    def test_retrieve_product(self, api_client, products, n, django_assert_max_num_queries):
+        product = products(n)[0]
+        with django_assert_max_num_queries(4):
+            response = api_client.get(f'/store/products/{product.id}/')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_create_product(self, api_client, login, n, django_assert_max_num_queries):
+        login(is_staff=True)
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=n)
+        data = {'title': 'a', 'slug': 'a', 'inventory': 1, 'description': 'a', 'unit_price': 1,
+                'collection': collection.id}
+        # the insert plus the collection's products_count update, and the unique slug check
+        with django_assert_max_num_queries(5):
+            response = api_client.post('/store/products/', data)
+        assert response.status_code == status.HTTP_201_CREATED
+
+    def test_update_product(self, api_client, login, products, n, django_assert_max_num_queries):
+        login(is_staff=True)
+        product = products(n)[0]
+        with django_assert_max_num_queries(5):
+            response = api_client.patch(f'/store/products/{product.id}/', {'title': 'b'})
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_delete_product(self, api_client, login, n, django_assert_max_num_queries):
+        login(is_staff=True)
+        product = baker.make(Product)
+        baker.make(ProductImage, product=product, _quantity=n)
+        baker.make(Review, product=product, _quantity=n)
+        # the delete collector fetches the images and reviews in bulk so their signals can fire,
+        # one more update keeps the collection's products_count
+        with django_assert_max_num_queries(13):
+            response = api_client.delete(f'/store/products/{product.id}/')
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    def test_export_products(self, api_client, login, products, n, django_assert_max_num_queries):
+        login(is_staff=True)
+        products(n)
+        with django_assert_max_num_queries(1):
+            response = api_client.get('/store/products/export/')
+            lines = b''.join(response.streaming_content).splitlines()
+        assert len(lines) == n + 1
+
+    def test_import_products(self, api_client, login, n, django_assert_max_num_queries):
+        login(is_staff=True)
+        collection = baker.make(Collection)
+        rows = ''.join(f'p{i},P,d,1.00,1,{collection.id}\n' for i in range(n))
+        upload = SimpleUploadedFile('products.csv', f'slug,title,description,unit_price,inventory,collection\n{rows}'.encode())
+        # the collection ids, the temporary table, truncate, copy and merge per batch, the count repair
+        with django_assert_max_num_queries(8):
+            response = api_client.post('/store/products/import/', {'file': upload}, format='multipart')
+        assert response.data['created'] == n
+
+    def test_like_product(self, api_client, login, products, n, django_assert_max_num_queries):
+        login()
+        product = products(n)[0]
+        baker.make(LikedItem, content_object=product, _quantity=n)
+        # the product exists, the insert, the count
+        with django_assert_max_num_queries(3):
+            response = api_client.post(f'/store/products/{product.id}/like/')
+        assert response.data['likes'] == n + 1
+
+    def test_product_likes(self, api_client, login, products, n, django_assert_max_num_queries):
+        login()
+        ids = [product.id for product in products(n)]
+        for product_id in ids:
+            baker.make(LikedItem, content_object=Product(id=product_id), _quantity=2)
+        with django_assert_max_num_queries(2):
+            response = api_client.get(f'/store/products/likes/?ids={",".join(map(str, ids))}')
+        assert [item['likes'] for item in response.data] == [2] * n
+
+    def test_list_collections(self, api_client, n, django_assert_max_num_queries):
+        for collection in baker.make(Collection, _quantity=n):
+            baker.make(Product, collection=collection, _quantity=2)
+        with django_assert_max_num_queries(2):
+            response = api_client.get('/store/collections/')
+        assert len(response.data) == n
+
+    def test_retrieve_collection(self, api_client, n, django_assert_max_num_queries):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=n)
+        with django_assert_max_num_queries(2):
+            response = api_client.get(f'/store/collections/{collection.id}/')
+        assert response.data['products_count'] == n
+
+    def test_create_collection(self, api_client, login, n, django_assert_max_num_queries):
+        login(is_staff=True)
+        baker.make(Collection, _quantity=n)
+        with django_assert_max_num_queries(1):
+            response = api_client.post('/store/collections/', {'title': 'a'})
+        assert response.status_code == status.HTTP_201_CREATED
+
+    def test_delete_collection(self, api_client, login, n, django_assert_max_num_queries):
+        login(is_staff=True)
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=n)
+        with django_assert_max_num_queries(2):
+            response = api_client.delete(f'/store/collections/{collection.id}/')
+        assert response.status_code == status.HTTP_405_METHOD_NOT_ALLOWED
+
+    def test_list_reviews(self, api_client, n, django_assert_max_num_queries):
+        product = baker.make(Product)
+        baker.make(Review, product=product, _quantity=n)
+        with django_assert_max_num_queries(1):
+            response = api_client.get(f'/store/products/{product.id}/reviews/')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_retrieve_review(self, api_client, n, django_assert_max_num_queries):
+        product = baker.make(Product)
+        review = baker.make(Review, product=product, _quantity=n)[0]
+        with django_assert_max_num_queries(1):
+            response = api_client.get(f'/store/products/{product.id}/reviews/{review.id}/')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_create_review(self, api_client, login, n, django_assert_max_num_queries):
+        login(is_staff=True)
+        product = baker.make(Product)
+        baker.make(Review, product=product, _quantity=n)
+        # the insert and one update of the product's review counters
+        with django_assert_max_num_queries(2):
+            response = api_client.post(f'/store/products/{product.id}/reviews/',
+                                       {'name': 'a', 'description': 'a', 'rating': 5})
+        assert response.status_code == status.HTTP_201_CREATED
+
+    def test_list_images(self, api_client, n, django_assert_max_num_queries):
+        product = baker.make(Product)
+        baker.make(ProductImage, product=product, _quantity=n)
+        with django_assert_max_num_queries(2):
+            response = api_client.get(f'/store/products/{product.id}/images/')
+        assert len(response.data) == n
+
+    def test_retrieve_image(self, api_client, n, django_assert_max_num_queries):
+        product = baker.make(Product)
+        image = baker.make(ProductImage, product=product, _quantity=n)[0]
+        with django_assert_max_num_queries(2):
+            response = api_client.get(f'/store/products/{product.id}/images/{image.id}/')
+        assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('n', SIZES)
+class TestCartQueryBudget:
+    def test_create_cart(self, api_client, n, django_assert_max_num_queries):
+        with django_assert_max_num_queries(3):
+            response = api_client.post('/store/carts/')
+        assert response.status_code == status.HTTP_201_CREATED
+
+    def test_retrieve_cart(self, api_client, cart, n, django_assert_max_num_queries):
+        cart = cart(n)
+        with django_assert_max_num_queries(2):
+            response = api_client.get(f'/store/carts/{cart.id}/')
+        assert len(response.data['cart_items']) == n
+
+    def test_cart_summary(self, api_client, cart, n, django_assert_max_num_queries):
+        cart = cart(n)
+        with django_assert_max_num_queries(1):
+            response = api_client.get(f'/store/carts/{cart.id}/summary/')
+        assert response.data['item_count'] == 2 * n
+
+    def test_delete_cart(self, api_client, cart, n, django_assert_max_num_queries):
+        cart = cart(n)
+        with django_assert_max_num_queries(4):
+            response = api_client.delete(f'/store/carts/{cart.id}/')
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    def test_list_cart_items(self, api_client, cart, n, django_assert_max_num_queries):
+        cart = cart(n)
+        with django_assert_max_num_queries(1):
+            response = api_client.get(f'/store/carts/{cart.id}/items/')
+        assert len(response.data) == n
+
+    def test_retrieve_cart_item(self, api_client, cart, n, django_assert_max_num_queries):
+        cart = cart(n)
+        item = cart.cart_items.first()
+        with django_assert_max_num_queries(1):
+            response = api_client.get(f'/store/carts/{cart.id}/items/{item.id}/')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_add_cart_item(self, api_client, cart, n, django_assert_max_num_queries):
+        cart = cart(n)
+        product = baker.make(Product)
+        with django_assert_max_num_queries(3):
+            response = api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': product.id, 'quantity': 1})
+        assert response.status_code == status.HTTP_201_CREATED
+
+    def test_batch_add_cart_items(self, api_client, cart, n, django_assert_max_num_queries):
+        cart = cart(n)
+        items = [{'product_id': product.id, 'quantity': 1} for product in baker.make(Product, _quantity=n)]
+        with django_assert_max_num_queries(5):
+            response = api_client.post(f'/store/carts/{cart.id}/items/batch/', {'items': items}, format='json')
+        assert len(response.data) == n
+
+    def test_update_cart_item(self, api_client, cart, n, django_assert_max_num_queries):
+        cart = cart(n)
+        item = cart.cart_items.first()
+        with django_assert_max_num_queries(4):
+            response = api_client.patch(f'/store/carts/{cart.id}/items/{item.id}/', {'quantity': 5})
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_delete_cart_item(self, api_client, cart, n, django_assert_max_num_queries):
+        cart = cart(n)
+        item = cart.cart_items.first()
+        with django_assert_max_num_queries(3):
+            response = api_client.delete(f'/store/carts/{cart.id}/items/{item.id}/')
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('n', SIZES)
+class TestCustomerAndOrderQueryBudget:
+    def test_list_customers(self, api_client, login, n, django_assert_max_num_queries):
+        baker.make(settings.AUTH_USER_MODEL, _quantity=n)
+        login(is_staff=True)
+        with django_assert_max_num_queries(1):
+            response = api_client.get('/store/customers/')
+        assert len(response.data) == n + 1
+
+    def test_retrieve_customer(self, api_client, login, n, django_assert_max_num_queries):
+        baker.make(settings.AUTH_USER_MODEL, _quantity=n)
+        user = login(is_staff=True)
+        with django_assert_max_num_queries(1):
+            response = api_client.get(f'/store/customers/{user.customer.id}/')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_me(self, api_client, login, n, django_assert_max_num_queries):
+        baker.make(settings.AUTH_USER_MODEL, _quantity=n)
+        login()
+        with django_assert_max_num_queries(1):
+            response = api_client.get('/store/customers/me/')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_update_me(self, api_client, login, n, django_assert_max_num_queries):
+        user = login()
+        with django_assert_max_num_queries(3):
+            response = api_client.put('/store/customers/me/', {'user_id': user.id, 'phone': '1'})
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_list_orders_as_customer(self, api_client, login, orders, n, django_assert_max_num_queries):
+        user = login()
+        orders(user.customer, n)
+        with django_assert_max_num_queries(3):
+            response = api_client.get('/store/orders/')
+        assert len(response.data) == n
+
+    def test_list_orders_as_staff(self, api_client, login, orders, n, django_assert_max_num_queries):
+        orders(baker.make(settings.AUTH_USER_MODEL).customer, n)
+        login(is_staff=True)
+        with django_assert_max_num_queries(2):
+            response = api_client.get('/store/orders/')
+        assert len(response.data) == n
+
+    def test_retrieve_order(self, api_client, login, orders, n, django_assert_max_num_queries):
+        user = login()
+        order = orders(user.customer, 1, items=n)[0]
+        with django_assert_max_num_queries(3):
+            response = api_client.get(f'/store/orders/{order.id}/')
+        assert len(response.data['items']) == n
+
+    def test_update_order(self, api_client, login, orders, n, django_assert_max_num_queries):
+        order = orders(baker.make(settings.AUTH_USER_MODEL).customer, 1, items=n)[0]
+        login(is_staff=True)
+        with django_assert_max_num_queries(4):
+            response = api_client.patch(f'/store/orders/{order.id}/', {'payment_status': 'C'})
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_create_order(self, api_client, login, cart, n, django_assert_max_num_queries):
+        login()
+        cart = cart(n)
+        with django_assert_max_num_queries(16):
+            response = api_client.post('/store/orders/', {'cart_id': cart.id})
+        assert response.status_code == status.HTTP_201_CREATED
+        assert len(response.data['items']) == n
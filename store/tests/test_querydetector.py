@@ -0,0 +1,78 @@
+import logging
+from django.conf import settings
+import pytest
+from model_bakery import baker
+from core.querydetector import QueryDetector, RepeatedQueriesError, fingerprint
+from store.models import Customer, Order, OrderItem, Product
+from store.serializer import OrderSerializer
+from store.views import OrderViewSet
+
+
+@pytest.fixture
+def orders():
+    customer = Customer.objects.get(user=baker.make(settings.AUTH_USER_MODEL))
+    orders = baker.make(Order, customer=customer, _quantity=6)
+    for order in orders:
+        baker.make(OrderItem, order=order, product=baker.make(Product), quantity=1, unit_price=1)
+    return orders
+
+
+def test_fingerprint_leaves_out_the_values():
+    assert fingerprint('SELECT * FROM t WHERE id = 1 AND name = \'it\'\'s\' LIMIT 21') == \
+        'SELECT * FROM t WHERE id = ? AND name = ? LIMIT ?'
+    assert fingerprint('SELECT * FROM t  WHERE id IN (%s, %s, %s)') == fingerprint('SELECT * FROM t WHERE id IN (%s)')
+    assert fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)') == 'INSERT INTO t (a, b) VALUES (%s, %s), ...'
+    assert fingerprint('SELECT "t0"."id" FROM t0') == 'SELECT "t0"."id" FROM t0'
+
+
+@pytest.mark.django_db
+class TestQueryDetector:
+    def test_names_the_serializer_field(self, orders):
+        with QueryDetector() as detector:
+            OrderSerializer(Order.objects.all(), many=True).data
+
+        with pytest.raises(RepeatedQueriesError) as error:
+            detector.report('orders', mode='raise')
+        message = str(error.value)
+        assert '6 N+1 queries from OrderSerializer.items at store/tests/test_querydetector.py' in message
+        assert '6 N+1 queries from OrderItemSerializer.product' in message
+
+    def test_prefetched_is_fine(self, orders):
+        with QueryDetector() as detector:
+            OrderSerializer(Order.objects.prefetch_related('items__product'), many=True).data
+
+        assert detector.repeated() == []
+
+    def test_duplicates(self):
+        product = baker.make(Product)
+        with QueryDetector(threshold=2) as detector:
+            for _ in range(3):
+                Product.objects.get(pk=product.pk)
+
+        (shape,) = detector.repeated()
+        assert shape.kind == 'duplicate' and shape.count == 3
+
+    def test_threshold(self, orders):
+        with QueryDetector(threshold=6) as detector:
+            for order in orders:
+                order.items.count()
+
+        assert detector.repeated() == []
+
+    def test_log_mode(self, orders, caplog):
+        with QueryDetector() as detector:
+            for order in orders:
+                order.items.count()
+
+        with caplog.at_level(logging.WARNING, logger='core.querydetector'):
+            detector.report('counts', mode='log')
+
+        assert 'repeated queries in counts' in caplog.text
+
+    def test_requests_raise_in_the_tests(self, api_client, orders, monkeypatch):
+        assert settings.QUERY_DETECTOR_MODE == 'raise'
+        api_client.force_authenticate(user=baker.make(settings.AUTH_USER_MODEL, is_staff=True))
+        monkeypatch.setattr(OrderViewSet, 'get_queryset', lambda view: Order.objects.all())
+
+        with pytest.raises(RepeatedQueriesError, match='GET /store/orders/'):
+            api_client.get('/store/orders/')
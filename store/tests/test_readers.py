@@ -0,0 +1,121 @@
+import time
+from decimal import Decimal
+from statistics import median
+from django.core.cache import cache
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from store.models import Collection, Product, ProductImage, Promotion
+from store.pagination import DefaultPagination
+from store.views import ProductViewSet
+
+
+@pytest.fixture
+def catalog():
+    collection = baker.make(Collection)
+    products = [baker.make(Product, collection=collection, title=f'product {i}', unit_price=Decimal(i) + Decimal('0.99'),
+                           description='soap and more' if i % 2 else 'other')
+                for i in range(15)]
+    promotion = baker.make(Promotion, discount=12.5)
+    for product in products[::3]:
+        product.promotions.add(promotion)
+    for product in products[:4]:
+        baker.make(ProductImage, product=product, image=f'store/images/{product.id}.jpg', _quantity=2)
+    baker.make(ProductImage, product=products[4], image='')
+    ProductImage.objects.filter(product=products[0]).update(derivatives={
+        'thumbnail': {'width': 150, 'image/jpeg': 'store/images/a.thumbnail.jpg',
+                      'image/webp': 'store/images/a.thumbnail.webp'},
+        'medium': {'width': 600, 'image/jpeg': 'store/images/a.medium.jpg', 'image/webp': 'store/images/a.medium.webp'},
+    })
+    return products
+
+
+@pytest.mark.django_db
+class TestFastProductReads:
+    def both(self, api_client, monkeypatch, url):
+        fast = api_client.get(url)
+        cache.clear()
+        monkeypatch.setattr(ProductViewSet, 'fast_reads', False)
+        slow = api_client.get(url)
+        monkeypatch.setattr(ProductViewSet, 'fast_reads', True)
+        cache.clear()
+        return fast, slow
+
+    @pytest.mark.parametrize('query', [
+        '',
+        '?page=2',
+        '?ordering=-unit_price',
+        '?search=soap',
+        '?fields=id,title,images',
+        '?omit=description,price_with_tax',
+        '?cursor=&ordering=unit_price',
+        '?cursor=&fields=id',
+    ])
+    def test_list_matches_the_serializer(self, api_client, monkeypatch, catalog, query):
+        fast, slow = self.both(api_client, monkeypatch, f'/store/products/{query}')
+
+        assert fast.status_code == slow.status_code == status.HTTP_200_OK
+        assert fast.content == slow.content
+
+    def test_cursor_links_walk_the_same_pages(self, api_client, monkeypatch, catalog):
+        fast, slow = self.both(api_client, monkeypatch, '/store/products/?cursor=&ordering=-unit_price')
+        fast_next, slow_next = self.both(api_client, monkeypatch, fast.data['next'])
+
+        assert fast.data['next'] == slow.data['next']
+        assert fast_next.content == slow_next.content
+
+    @pytest.mark.parametrize('index', [0, 4, 9])
+    def test_retrieve_matches_the_serializer(self, api_client, monkeypatch, catalog, index):
+        fast, slow = self.both(api_client, monkeypatch, f'/store/products/{catalog[index].id}/')
+
+        assert fast.content == slow.content
+
+    def test_missing_product_404(self, api_client, catalog):
+        assert api_client.get('/store/products/0/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_pk_that_is_not_a_number_404(self, api_client, monkeypatch):
+        # past the validators, which 404 on their own
+        monkeypatch.setattr(ProductViewSet, 'get_validators', lambda view: ([], None))
+
+        assert api_client.get('/store/products/abc/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_images_are_fetched_once_per_page(self, api_client, catalog, django_assert_num_queries):
+        # the three ETag validators, the count, the page and the images
+        with django_assert_num_queries(6):
+            api_client.get('/store/products/')
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+class TestFastProductReadsBenchmark:
+    PAGE_SIZES = [10, 100, 1000]
+
+    def requests_per_second(self, api_client, url, seconds=2.0):
+        count, start = 0, time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            assert api_client.get(url).status_code == status.HTTP_200_OK
+            count += 1
+        return count / (time.perf_counter() - start)
+
+    def test_fast_reads_serve_more_requests(self, api_client, monkeypatch, settings):
+        settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        collection = baker.make(Collection)
+        products = Product.objects.bulk_create(
+            Product(title=f'product {i:06}', slug=f'product-{i}', description='a product', unit_price=Decimal('9.99'),
+                    inventory=1, collection=collection)
+            for i in range(max(self.PAGE_SIZES)))
+        ProductImage.objects.bulk_create(ProductImage(product=product, image=f'store/images/{product.id}.jpg')
+                                         for product in products)
+
+        results = {}
+        for page_size in self.PAGE_SIZES:
+            monkeypatch.setattr(DefaultPagination, 'page_size', page_size)
+            fast = median(self.requests_per_second(api_client, '/store/products/') for _ in range(3))
+            monkeypatch.setattr(ProductViewSet, 'fast_reads', False)
+            slow = median(self.requests_per_second(api_client, '/store/products/') for _ in range(3))
+            monkeypatch.setattr(ProductViewSet, 'fast_reads', True)
+            results[page_size] = (fast, slow)
+            print(f'{page_size:>5} items: fast {fast:8.1f} req/s  serializer {slow:8.1f} req/s  '
+                  f'x{fast / slow:.2f}')
+
+        assert results[max(self.PAGE_SIZES)][0] > results[max(self.PAGE_SIZES)][1]
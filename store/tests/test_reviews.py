@@ -0,0 +1,115 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from rest_framework import status
+import pytest
+from model_bakery import baker
+from store.models import Product, Review
+
+
+def counters(product):
+    product.refresh_from_db()
+    return product.reviews_count, product.ratings_count, product.ratings_total, product.rating_average
+
+
+@pytest.mark.django_db
+class TestReviewPages:
+    def test_only_the_products_reviews_newest_first(self, api_client):
+        product, other = baker.make(Product, _quantity=2)
+        reviews = baker.make(Review, product=product, rating=3, _quantity=15)
+        baker.make(Review, product=other, rating=3)
+        # a day apart, and two on the same day so the id breaks the tie
+        for days, review in enumerate(reviews):
+            Review.objects.filter(pk=review.pk).update(date=date(2024, 1, 1) + timedelta(days=min(days, 13)))
+
+        first = api_client.get(f'/store/products/{product.id}/reviews/').data
+        second = api_client.get(first['next']).data
+
+        ids = [review['id'] for review in first['results'] + second['results']]
+        assert ids == [review.id for review in reversed(reviews)]
+        assert len(first['results']) == 10 and second['next'] is None
+        assert api_client.get(second['previous']).data['results'] == first['results']
+
+    @pytest.mark.parametrize('url', ['/store/products/abc/reviews/', '/store/products/abc/reviews/1/'])
+    def test_product_pk_that_is_not_a_number_404(self, api_client, url):
+        assert api_client.get(url).status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.parametrize('rating', [None, 0, 6])
+    def test_rating_is_required_and_one_to_five(self, api_client, authenticate, rating):
+        authenticate(is_staff=True)
+        product = baker.make(Product)
+        data = {'name': 'a', 'description': 'b'} if rating is None else {'name': 'a', 'description': 'b', 'rating': rating}
+
+        response = api_client.post(f'/store/products/{product.id}/reviews/', data)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'rating' in response.data
+
+
+@pytest.mark.django_db
+class TestReviewCounters:
+    def test_follow_the_reviews(self, api_client, authenticate):
+        authenticate(is_staff=True)
+        product = baker.make(Product)
+        url = f'/store/products/{product.id}/reviews/'
+
+        api_client.post(url, {'name': 'a', 'description': 'b', 'rating': 5})
+        review = api_client.post(url, {'name': 'a', 'description': 'b', 'rating': 2}).data
+        assert counters(product) == (2, 2, 7, Decimal('3.50'))
+
+        api_client.patch(f'{url}{review["id"]}/', {'rating': 4})
+        assert counters(product) == (2, 2, 9, Decimal('4.50'))
+
+        api_client.delete(f'{url}{review["id"]}/')
+        assert counters(product) == (1, 1, 5, Decimal('5.00'))
+
+    def test_unrated_reviews_only_count_as_reviews(self):
+        product = baker.make(Product)
+        baker.make(Review, product=product, rating=None)
+        review = baker.make(Review, product=product, rating=4)
+
+        assert counters(product) == (2, 1, 4, Decimal('4.00'))
+        review.delete()
+        assert counters(product) == (1, 0, 0, None)
+
+    def test_a_moved_review_moves_its_rating(self):
+        product, other = baker.make(Product, _quantity=2)
+        review = baker.make(Review, product=product, rating=1)
+
+        review = Review.objects.get(pk=review.pk)
+        review.product = other
+        review.save()
+
+        assert counters(product) == (0, 0, 0, None)
+        assert counters(other) == (1, 1, 1, Decimal('1.00'))
+
+    def test_deleting_a_product_deletes_its_reviews(self):
+        product = baker.make(Product)
+        baker.make(Review, product=product, rating=2, _quantity=3)
+
+        product.delete()
+
+        assert not Review.objects.exists()
+
+    def test_shown_in_product_lists(self, api_client):
+        product = baker.make(Product)
+        baker.make(Review, product=product, rating=4, _quantity=2)
+
+        listed = api_client.get('/store/products/').data['results'][0]
+
+        assert (listed['reviews_count'], listed['rating_average']) == (2, Decimal('4.00'))
+
+    def test_reconcile(self, api_client):
+        product = baker.make(Product)
+        baker.make(Review, product=product, rating=3, _quantity=2)
+        baker.make(Review, product=product, rating=None)
+        api_client.get(f'/store/products/{product.id}/')
+        Product.objects.filter(pk=product.pk).update(reviews_count=0, ratings_count=7, rating_average=1)
+        out = StringIO()
+
+        call_command('reconcile_review_counts', stdout=out)
+
+        assert 'Repaired the review counters of 1 products' in out.getvalue()
+        assert counters(product) == (3, 2, 6, Decimal('3.00'))
+        assert api_client.get(f'/store/products/{product.id}/').data['reviews_count'] == 3
@@ -0,0 +1,51 @@
+from decimal import Decimal
+import pytest
+from model_bakery import baker
+from store.models import Collection, Product
+
+
+@pytest.fixture(params=['store.search.PostgresSearchBackend', 'store.search.InvertedIndexSearchBackend'])
+def search_backend(request, settings):
+    settings.STORE_SEARCH_BACKEND = request.param
+    return request.param
+
+
+@pytest.mark.django_db
+class TestProductSearch:
+    def test_title_match_ranks_above_description_match(self, api_client, search_backend):
+        baker.make(Product, title='Garden hose', description='waters lettuce')
+        baker.make(Product, title='Lettuce - Mini Greens', description='fresh')
+        baker.make(Product, title='Bread', description='baked daily')
+
+        response = api_client.get('/store/products/', {'search': 'lettuce'})
+
+        titles = [product['title'] for product in response.data['results']]
+        assert titles == ['Lettuce - Mini Greens', 'Garden hose']
+
+    def test_last_term_matches_as_prefix(self, api_client, search_backend):
+        baker.make(Product, title='Shrimp - Peeled', description='')
+        baker.make(Product, title='Shrimp paste', description='')
+
+        response = api_client.get('/store/products/', {'search': 'shrimp pee'})
+
+        assert [product['title'] for product in response.data['results']] == ['Shrimp - Peeled']
+
+    def test_search_sees_updated_products(self, api_client, search_backend):
+        product = baker.make(Product, title='Old name', description='')
+        api_client.get('/store/products/', {'search': 'old'})
+        product.title = 'New name'
+        product.save()
+
+        response = api_client.get('/store/products/', {'search': 'new'})
+
+        assert [item['id'] for item in response.data['results']] == [product.id]
+
+    def test_search_combines_with_filter_and_pagination(self, api_client, search_backend):
+        collection = baker.make(Collection)
+        baker.make(Product, title='cheap soap', unit_price=Decimal(1), collection=collection, _quantity=12)
+        baker.make(Product, title='cheap soap', unit_price=Decimal(1))
+
+        response = api_client.get('/store/products/', {'search': 'soap', 'collection_id': collection.id})
+
+        assert response.data['count'] == 12
+        assert len(response.data['results']) == 10
@@ -1,6 +1,7 @@
+from django.conf import settings
 from django.core.exceptions import ValidationError
 
 def validate_file_size(file):
-    max_size = 50
+    max_size = settings.STORE_IMAGE_MAX_UPLOAD_KB
     if file.size > max_size * 1024:
         raise ValidationError(f'File cannot be greater than {max_size}kb')
\ No newline at end of file
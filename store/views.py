@@ -1,51 +1,221 @@
+import math
 from rest_framework import serializers
 from rest_framework.response import Response
 from rest_framework import status
-from django.shortcuts import get_object_or_404
+from io import TextIOWrapper
+from django.core.exceptions import ValidationError
+from django.http import Http404, StreamingHttpResponse
+from django.views.static import serve
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from .models import Product, Customer, Address, Collection, Cart, CartItem, OrderItem, Review, Order, ProductImage
 from .serializer import ProductSerializer, CollectionSerializer, ReviewSerializer, CartSerializer, CartItemSerializer
 from .serializer import AddCartItemSerializer, UpdateCartItemSerializer, CustomerSerializer, OrderSerializer,\
-    OrderCreateSerializer, UpdateOrderSerializer, ProductImageSerializer
-from django.db.models import Count
+    OrderCreateSerializer, UpdateOrderSerializer, ProductImageSerializer, BatchAddCartItemSerializer, \
+    CartSummarySerializer
+from django.db.models import Max, Prefetch, Sum
+from django.db.models.functions import Coalesce
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, UpdateModelMixin
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 from .filters import ProductFilter
-from rest_framework.filters import SearchFilter, OrderingFilter
-from .pagination import DefaultPagination
+from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import MultiPartParser
+from .pagination import DefaultPagination, KeysetPagination
+from .search import ProductSearchFilter
+from .cache import CachedResponseMixin
+from .pricing import cart_total, tax_rate, with_prices
+from .fieldsets import selected_fields
+from .readers import FastProductReadMixin
+from .conditional import ConditionalGetMixin, aggregate_validators, latest, promotion_schedule, \
+    touch_products
+from .carts import StoredCart, get_cart_store, load_cart, stored_cart_items
+from . import catalog
 from .permissions import IsAdminorReadOnly
+from .storage import IMMUTABLE, is_blob_name
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.core.mail import send_mail, mail_admins
+from django.conf import settings
+from django.utils import timezone
+from likes.counters import like_counts, liked_by, set_liked
 
-class ProductViewSet(ModelViewSet):
-    queryset = Product.objects.prefetch_related('images').all()
+PRICE_FIELDS = {'effective_price', 'price_with_tax'}
+# the largest id a like can point at, larger ones fail in the database instead of matching nothing
+MAX_OBJECT_ID = 2 ** 63 - 1
+
+
+def parse_pk(model, value):
+    """ a primary key from the url as the model's type, a 404 when it can't be one """
+    try:
+        return model._meta.pk.to_python(value)
+    except ValidationError:
+        raise Http404
+
+
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, FastProductReadMixin, ModelViewSet):
+    # the search vector is only ever read inside the database
+    queryset = Product.objects.defer('search_vector').prefetch_related('images').all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     pagination_class = DefaultPagination
     permission_classes = [IsAdminorReadOnly]
     search_fields = ['title','description']
     ordering_fields = ['unit_price','last_update']
 
+    @property
+    def paginator(self):
+        """ clients opt into keyset paging by sending a `cursor` param, an empty one starts at the first page """
+        if not hasattr(self, '_paginator'):
+            if KeysetPagination.cursor_query_param in self.request.query_params:
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = selected_fields(self.request, ProductSerializer.Meta.fields)
+        if fields is None:
+            # the prices are annotated per request, they depend on the tax rate setting
+            return with_prices(queryset)
+
+        # a sparse fieldset only loads the columns, prices and images it shows
+        columns = {field.name for field in Product._meta.concrete_fields}
+        load = {'id', 'title'} | (columns & set(fields))
+        # the keyset paginator reads the ordering value of the last row
+        ordering = OrderingFilter().get_ordering(self.request, queryset, self) or []
+        load |= {name.lstrip('-') for name in ordering} & columns
+        if PRICE_FIELDS & set(fields):
+            load.add('unit_price')
+            queryset = with_prices(queryset)
+        if 'images' not in fields:
+            queryset = queryset.prefetch_related(None)
+        return queryset.only(*load)
+
     def get_serializer_context(self):
         return {'request': self.request}
 
+    def get_cache_tags(self):
+        # bulk imports (store.catalog) bump 'catalog' instead of every product's tag
+        if self.action == 'retrieve':
+            return [f'product:{parse_pk(Product, self.kwargs["pk"])}', 'catalog']
+        return ['products']
+
+    def get_promotion_schedule(self):
+        if not hasattr(self, '_promotion_schedule'):
+            self._promotion_schedule = promotion_schedule()
+        return self._promotion_schedule
+
+    def get_cache_timeout(self):
+        # the cached prices and validators expire when the next scheduled promotion starts or ends
+        next_change = self.get_promotion_schedule()[1]
+        if next_change is None:
+            return self.cache_timeout
+        return max(1, min(self.cache_timeout, math.ceil((next_change - timezone.now()).total_seconds())))
+
+    def get_validators(self):
+        # images and promotions touch last_update, a deleted product touches its collection
+        promotions = self.get_promotion_schedule()[0]
+        collections = None
+        if self.action == 'retrieve':
+            last_update = Product.objects.filter(pk=parse_pk(Product, self.kwargs['pk'])) \
+                .values_list('last_update', flat=True).first()
+            fingerprint = [last_update]
+        else:
+            # filtered without the price annotations, the aggregate only needs the matching rows
+            fingerprint, last_update = aggregate_validators(self.filter_queryset(Product.objects.all()))
+            collections = Collection.objects.aggregate(last_update=Max('last_update'))['last_update']
+            fingerprint.append(collections)
+        return fingerprint + [promotions, tax_rate()], latest(last_update, collections, promotions)
+
+    # the file type is read from `type`, DRF keeps the `format` param for picking a renderer
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """ streams the filtered products as a csv (the default) or ndjson file """
+        file_type = request.query_params.get('type', 'csv')
+        if file_type not in catalog.FORMATS:
+            return Response({'Error': f'type must be one of {list(catalog.FORMATS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        lines = catalog.export_lines(self.filter_queryset(Product.objects.all()), file_type)
+        response = StreamingHttpResponse(lines, content_type=catalog.FORMATS[file_type])
+        response['Content-Disposition'] = f'attachment; filename="products.{file_type}"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser],
+            parser_classes=[MultiPartParser])
+    def import_file(self, request):
+        """ upserts the products of an uploaded csv or ndjson `file` by slug """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'Error': 'Upload the products as `file`'}, status=status.HTTP_400_BAD_REQUEST)
+        file_type = request.query_params.get('type') or catalog.guess_format(upload.name)
+        if file_type not in catalog.FORMATS:
+            return Response({'Error': f'type must be one of {list(catalog.FORMATS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            counts = catalog.import_products(catalog.read_rows(
+                TextIOWrapper(upload.file, encoding='utf-8', newline=''), file_type))
+        except (ValidationError, UnicodeDecodeError) as error:
+            messages = error.messages if isinstance(error, ValidationError) else [str(error)]
+            return Response({'Error': messages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(counts)
+
+    @action(detail=True, methods=['post', 'delete'], permission_classes=[IsAuthenticated])
+    def like(self, request, pk):
+        """ likes the product, DELETE takes the like back, both return the product's like count """
+        product_id = parse_pk(Product, pk)
+        if not Product.objects.filter(pk=product_id).exists():
+            raise Http404
+        count = set_liked(Product, request.user.id, product_id, request.method == 'POST')
+        return Response({'id': product_id, 'likes': count, 'liked': request.method == 'POST'})
+
+    @action(detail=False, methods=['get'])
+    def likes(self, request):
+        """ the like counts of the products in `ids`, e.g. the page being shown, and whether the user likes them """
+        try:
+            product_ids = list(dict.fromkeys(int(value) for value in request.query_params.get('ids', '').split(',')
+                                             if value))
+        except ValueError:
+            return Response({'Error': 'ids must be a comma separated list of product ids'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not all(0 < product_id <= MAX_OBJECT_ID for product_id in product_ids):
+            return Response({'Error': f'ids must be between 1 and {MAX_OBJECT_ID}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(product_ids) > settings.LIKES_MAX_IDS:
+            return Response({'Error': f'Ask for at most {settings.LIKES_MAX_IDS} products at a time'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        counts = like_counts(Product, product_ids)
+        liked = liked_by(Product, request.user.id, product_ids) if request.user.is_authenticated else set()
+        return Response([{'id': product_id, 'likes': counts[product_id], 'liked': product_id in liked}
+                         for product_id in product_ids])
+
     def destroy(self, request, *args, **kwargs):  # a delete method implemented
-        if OrderItem.objects.filter(product_id=kwargs['pk']):
+        if OrderItem.objects.filter(product_id=parse_pk(Product, kwargs['pk'])).exists():
             return Response({'Error': 'Product with associated order items cannot be '
                                       'deleted '}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
-        self.delete()
+        return super().destroy(request, *args, **kwargs)
 
 
-class CollectionViewSet(ModelViewSet):
+class CollectionViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
     serializer_class = CollectionSerializer
-    queryset = Collection.objects.annotate(products_count=Count('products')).all()
+    queryset = Collection.objects.all()
     permission_classes = [IsAdminorReadOnly]
 
-    def delete(self, request, pk):
-        collection = get_object_or_404(Collection, pk=pk)
-        if collection.products.count() > 0:
+    def get_cache_tags(self):
+        return ['collections']
+
+    def get_validators(self):
+        if self.action == 'retrieve':
+            last_update = Collection.objects.filter(pk=parse_pk(Collection, self.kwargs['pk'])) \
+                .values_list('last_update', flat=True).first()
+            return [last_update], last_update
+        return aggregate_validators(self.get_queryset())
+
+    # the router maps DELETE to destroy, a method named delete would never be called
+    def destroy(self, request, *args, **kwargs):
+        collection = self.get_object()
+        if collection.products_count > 0:
             return Response({'Error':'Collection with associated products can\'t be deleted'},
                             status=status.HTTP_405_METHOD_NOT_ALLOWED)
         collection.delete()
@@ -53,18 +223,73 @@ class CollectionViewSet(ModelViewSet):
 
 
 # handles every query pertaining to review
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(CachedResponseMixin, ModelViewSet):
     serializer_class = ReviewSerializer
-    queryset = Review.objects.all()
     permission_classes = [IsAdminorReadOnly]
+    # pages of the product's reviews, newest first, seek on the (product, date, id) index
+    pagination_class = KeysetPagination
+    ordering = ('-date',)
+
+    def get_queryset(self):
+        return Review.objects.filter(product_id=parse_pk(Product, self.kwargs['product_pk']))
 
     def get_serializer_context(self):
-        return {'product_id':self.kwargs['product_pk']}    # the self.kwargs contain the url query parameters
+        # the self.kwargs contain the url query parameters
+        return {**super().get_serializer_context(), 'product_id': parse_pk(Product, self.kwargs['product_pk'])}
+
+    def get_cache_tags(self):
+        return [f'reviews:{parse_pk(Product, self.kwargs["product_pk"])}']
 
 
 class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
-    serializer_class = CartSerializer
-    queryset = Cart.objects.prefetch_related('cart_items__product').all()
+
+    def get_serializer_class(self):
+        if self.action == 'summary':
+            return CartSummarySerializer
+        return CartSerializer
+
+    def get_queryset(self):
+        # the prices are discounted and summed by the database, python never multiplies them out
+        total_price = cart_total()
+        if self.action == 'retrieve':
+            return Cart.objects.annotate(total_price=total_price) \
+                .prefetch_related(Prefetch('cart_items', queryset=CartItem.objects.priced()))
+        if self.action == 'summary':
+            return Cart.objects.annotate(total_price=total_price, item_count=Coalesce(Sum('cart_items__quantity'), 0))
+        return Cart.objects.all()
+
+    def get_stored_cart(self, store):
+        cart_id = load_cart(store, self.kwargs['pk'])
+        if cart_id is None:
+            raise Http404
+        return StoredCart(cart_id, stored_cart_items(store, cart_id))
+
+    def retrieve(self, request, *args, **kwargs):
+        store = get_cart_store()
+        if store is None:
+            return super().retrieve(request, *args, **kwargs)
+        return Response(self.get_serializer(self.get_stored_cart(store)).data)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        store = get_cart_store()
+        if store is not None:
+            store.load(str(serializer.instance.id), {})
+
+    def perform_destroy(self, instance):
+        cart_id = str(instance.id)
+        super().perform_destroy(instance)
+        store = get_cart_store()
+        if store is not None:
+            store.delete(cart_id)
+
+    # carts/{id}/summary -- item count and total for the mini cart, from one aggregate query
+    @action(detail=True)
+    def summary(self, request, pk):
+        store = get_cart_store()
+        cart = self.get_object() if store is None else self.get_stored_cart(store)
+        serializer = self.get_serializer(cart)
+        return Response(serializer.data)
 
 class CartItemViewSet(ModelViewSet):
     # define method allowed for this veiw set
@@ -73,17 +298,83 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return CartItemSerializer
+        elif self.action == 'batch':
+            return BatchAddCartItemSerializer
         elif self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
             return UpdateCartItemSerializer
 
     def get_serializer_context(self):
-        return {'cart_id':self.kwargs['cart_pk']}
+        # stored items are keyed by the normalized id, an uppercase or undashed uuid names the same cart
+        cart_id = self.kwargs['cart_pk'] if self.cart_store is None else self.cart_id
+        return {**super().get_serializer_context(), 'cart_id': cart_id}
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk']).\
-                select_related('product').all()
+        return CartItem.objects.priced().filter(cart_id=self.kwargs['cart_pk']).all()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # with a cart store the items are read and written there, see store.carts
+        self.cart_store = get_cart_store()
+        if self.cart_store is not None:
+            self.cart_id = load_cart(self.cart_store, kwargs['cart_pk'])
+            if self.cart_id is None:
+                raise Http404
+
+    def list(self, request, *args, **kwargs):
+        if self.cart_store is None:
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_serializer(stored_cart_items(self.cart_store, self.cart_id), many=True)
+        return Response(serializer.data)
+
+    def get_object(self):
+        if self.cart_store is None:
+            return super().get_object()
+        try:
+            product_id = int(self.kwargs['pk'])
+        except ValueError:
+            raise Http404
+        cart_items = stored_cart_items(self.cart_store, self.cart_id, [product_id])
+        if not cart_items:
+            raise Http404
+        return cart_items[0]
+
+    def touch_cart(self):
+        """ marks the cart as active so the abandoned cart purge leaves it alone, stored carts are
+        marked when they are flushed """
+        if self.cart_store is None:
+            Cart.objects.filter(pk=self.kwargs['cart_pk']).update(last_activity=timezone.now())
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        self.touch_cart()
+
+    def perform_update(self, serializer):
+        if self.cart_store is None:
+            super().perform_update(serializer)
+        else:
+            serializer.instance.quantity = serializer.validated_data.get('quantity', serializer.instance.quantity)
+            self.cart_store.set(self.cart_id, serializer.instance.product_id, serializer.instance.quantity)
+        self.touch_cart()
+
+    def perform_destroy(self, instance):
+        if self.cart_store is None:
+            super().perform_destroy(instance)
+        else:
+            self.cart_store.remove(self.cart_id, instance.product_id)
+        self.touch_cart()
+
+    # carts/{id}/items/batch -- add many products with a single upsert
+    @action(detail=False, methods=['POST'])
+    def batch(self, request, cart_pk):
+        if self.cart_store is None:
+            get_object_or_404(Cart.objects.only('id'), pk=cart_pk)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart_items = serializer.save()
+        self.touch_cart()
+        return Response(CartItemSerializer(cart_items, many=True).data)
 
 class CustomerViewSet(ModelViewSet):
     # the delete view set is not supported for this class since we can actually delete a customer by deleting the user
@@ -97,7 +388,7 @@ class CustomerViewSet(ModelViewSet):
         (customer, created) = Customer.objects.get_or_create(user_id=request.user.id)
         # the tuple unpacking is used since the get_or_create manager method returns a tuple of (user, created(boolean)
         if request.method == 'GET':
-            serializer = CustomerSerializer(customer)
+            serializer = CustomerSerializer(customer, context={'request': request})
             return Response(serializer.data)
         if request.method == 'PUT':
             serializer = CustomerSerializer(customer, data=request.data)
@@ -120,7 +411,7 @@ class OrderViewSet(ModelViewSet):
         serializer = OrderCreateSerializer(data=request.data, context={'user_id':self.request.user.id})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
-        order_serializer = OrderSerializer(order)
+        order_serializer = OrderSerializer(self.get_queryset().get(pk=order.pk))
         return Response(order_serializer.data, status=status.HTTP_201_CREATED)
 
     def get_serializer_class(self):
@@ -132,23 +423,47 @@ class OrderViewSet(ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        orders = Order.objects.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product')))
         if user.is_staff:
-            return Order.objects.all()
+            return orders.all()
         # return the order for the authenticated customer
-        customer_id= Customer.objects.only('id').get(user_id=user.id)
-        order = Order.objects.filter(customer_id=customer_id)
-        return order
+        return orders.filter(customer__user_id=user.id)
 
-class ProductImageVeiwSet(ModelViewSet):
+class ProductImageVeiwSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
     serializer_class = ProductImageSerializer
 
     def get_queryset(self):
-        return ProductImage.objects.filter(product_id=self.kwargs['product_pk'])
+        return ProductImage.objects.filter(product_id=parse_pk(Product, self.kwargs['product_pk']))
 
     def get_serializer_context(self):
-        return {'product_id':self.kwargs['product_pk']}
+        return {**super().get_serializer_context(), 'product_id':self.kwargs['product_pk']}
+
+    def get_cache_tags(self):
+        return [f'product:{parse_pk(Product, self.kwargs["product_pk"])}']
+
+    # the images are versioned by their product's last_update, which every change below moves
+    def get_validators(self):
+        last_update = Product.objects.filter(pk=parse_pk(Product, self.kwargs['product_pk'])) \
+            .values_list('last_update', flat=True).first()
+        return [last_update], last_update
 
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        touch_products([parse_pk(Product, self.kwargs['product_pk'])])
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        touch_products([parse_pk(Product, self.kwargs['product_pk'])])
 
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        touch_products([parse_pk(Product, self.kwargs['product_pk'])])
 
 
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """ django's development media view, with content-addressed files cached for good """
+    response = serve(request, path, document_root, show_indexes)
+    if is_blob_name(path):
+        response['Cache-Control'] = IMMUTABLE
+    return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 import os
+from decimal import Decimal
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its timings cover the whole stack, see core.metrics
+    'core.metrics.RequestMetricsMiddleware',
+    'core.querydetector.QueryDetectorMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -161,13 +165,83 @@ ADMINS = [
 ]
 
 CELERY_BROKER_URL = 'redis://localhost:6379/1'
-"""
+CELERY_BEAT_SCHEDULE = {
+    'drain_outbox': {
+        'task': 'store.tasks.drain_outbox',
+        'schedule': 5,
+    },
+    'purge_outbox': {
+        'task': 'store.tasks.purge_outbox',
+        'schedule': timedelta(hours=1),
+    },
+    'purge_abandoned_carts': {
+        'task': 'store.tasks.purge_abandoned_carts',
+        'schedule': timedelta(hours=1),
+    },
+    'flush_carts': {
+        'task': 'store.tasks.flush_carts',
+        'schedule': 30,
+    },
+    'purge_image_blobs': {
+        'task': 'store.tasks.purge_image_blobs',
+        'schedule': timedelta(hours=1),
+    },
+    'flush_likes': {
+        'task': 'likes.tasks.flush_likes',
+        'schedule': 30,
+    },
+}
+
+# processed outbox events are kept this long, then deleted by purge_outbox
+OUTBOX_RETENTION = timedelta(days=int(os.environ.get('OUTBOX_RETENTION_DAYS', 7)))
+
+# carts without any activity for this long are deleted by purge_abandoned_carts
+CART_TTL = timedelta(days=int(os.environ.get('CART_TTL_DAYS', 14)))
+
+# product images are served as resized copies made by store.tasks.generate_image_derivatives,
+# so the originals can be large
+STORE_IMAGE_MAX_UPLOAD_KB = int(os.environ.get('STORE_IMAGE_MAX_UPLOAD_KB', 5 * 1024))
+STORE_IMAGE_SIZES = {'thumbnail': 150, 'medium': 600}
+
+# uploads are hashed as they stream in and stored by content, see store.storage. Files no image
+# uses are deleted by purge_image_blobs after the grace period
+FILE_UPLOAD_HANDLERS = [
+    'store.storage.HashingMemoryFileUploadHandler',
+    'store.storage.HashingTemporaryFileUploadHandler',
+]
+STORE_IMAGE_BLOB_GRACE = timedelta(hours=1)
+
+# added to the discounted price of products, see store.pricing
+STORE_TAX_RATE = Decimal(os.environ.get('STORE_TAX_RATE', '0.1'))
+
+# keep live cart items in redis and write them to the database at checkout and from flush_carts,
+# None keeps them in the database
+STORE_CART_STORE = os.environ.get('STORE_CART_STORE') or None  # e.g. 'store.carts.RedisCartStore'
+
+# count likes and remember who liked what in redis and write the likes to the database from
+# flush_likes, None keeps them in the database, see likes.counters
+LIKES_STORE = os.environ.get('LIKES_STORE') or None  # e.g. 'likes.counters.RedisLikeStore'
+# the most products one request can ask the like counts of
+LIKES_MAX_IDS = 100
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
         "LOCATION": "redis://127.0.0.1:6379/2",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # a cache outage degrades to database reads instead of failing requests
+            "IGNORE_EXCEPTIONS": True,
         }
     }
-}"""
\ No newline at end of file
+}
+# per request timings in a Server-Timing header and as prometheus histograms at /metrics, see
+# core.metrics. The header tells clients the sql time and query count, None sends it only with
+# DEBUG. Without DEBUG /metrics asks for the token as a bearer token, or a staff user
+METRICS_SERVER_TIMING = None
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
+# a request running one query shape more than QUERY_DETECTOR_THRESHOLD times warns, logs or raises,
+# see core.querydetector. None leaves the detector out, the tests raise
+QUERY_DETECTOR_MODE = None
+QUERY_DETECTOR_THRESHOLD = 5
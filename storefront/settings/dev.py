@@ -1,2 +1,3 @@
 from .common import *
-DEBUG = True
\ No newline at end of file
+DEBUG = True
+QUERY_DETECTOR_MODE = 'warn'
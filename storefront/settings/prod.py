@@ -8,6 +8,8 @@ DEBUG = False
 ALLOWED_HOSTS = ['shopit-api.herokuapp.com']
 REDIS = os.environ.get('REDIS_URL')
 CELERY_BROKER_URL = REDIS
+# the response cache and the cart and like stores all use the default cache's redis
+CACHES['default']['LOCATION'] = REDIS
 
 
 DATABASES = {